@@ -4,7 +4,7 @@ import settings
 from accounts.forms import UserPasswordResetForm
 from amcat.models import AmCAT
 from amcat.models import ArticleSet
-from amcat.models.authorisation import ROLE_PROJECT_READER
+from amcat.models.authorisation import get_resolver
 from amcat.tools.usage import log_request_usage
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 from django.contrib.auth import signals
@@ -25,8 +25,9 @@ def _login(request, error, username, announcement):
 
     if allow_anonymous:
         
-        featured_sets = [(aset, aset.project.get_role_id(user=request.user) >= ROLE_PROJECT_READER)
-                         for aset in ArticleSet.objects.filter(featured=True)]
+        featured_sets = list(ArticleSet.objects.filter(featured=True))
+        readable = get_resolver(request.user).filter_projects({aset.project_id for aset in featured_sets})
+        featured_sets = [(aset, aset.project_id in readable) for aset in featured_sets]
     
     return render(request, "accounts/login.html", locals())
 
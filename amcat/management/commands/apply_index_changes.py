@@ -0,0 +1,53 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+import json
+import logging
+import time
+
+from django.core.management import BaseCommand
+
+from amcat.models.articleset import apply_index_changes, get_index_lag
+
+log = logging.getLogger(__name__)
+stats_log = logging.getLogger("statistics:" + __name__)
+
+
+class Command(BaseCommand):
+    help = 'Push pending articleset changes to elastic. Use --interval to keep running.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help="Seconds to wait between runs. If not given, run once.")
+        parser.add_argument('--limit', type=int, default=100000,
+                            help="Maximum number of changes to apply per run.")
+
+    def handle(self, *args, **options):
+        while True:
+            n, lag = get_index_lag()
+            stats_log.info(json.dumps({"action": "index_lag", "pending": n, "lag": lag}))
+
+            applied = apply_index_changes(limit=options["limit"])
+            log.info("Applied {applied} of {n} pending changes (lag: {lag:.1f}s)".format(**locals()))
+
+            if options["interval"] is None:
+                break
+
+            # Continue immediately if there is a backlog
+            if applied < options["limit"]:
+                time.sleep(options["interval"])
@@ -0,0 +1,109 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+Run the benchmarks (see amcat.tools.benchmark) on a synthetic corpus in a throwaway database
+and elastic index, and optionally compare the results to an earlier report
+"""
+import json
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+
+from amcat.tools import benchmark
+from amcat.tools.amcates import ES
+from amcat.tools.progress import ProgressMonitor, NullMonitor
+
+
+class Command(BaseCommand):
+    help = 'Benchmark article creation, searching, aggregation, clustermaps, codingjob exports and ' \
+           'LexisNexis parsing on a synthetic corpus'
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.DEFAULT_PARAMETERS.items():
+            parser.add_argument('--' + name, type=int, default=default,
+                                help="Corpus parameter (default: {default})".format(**locals()))
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timed calls per benchmark")
+        parser.add_argument('--only', action="append", choices=list(benchmark.BENCHMARKS),
+                            help="Only run this benchmark (can be repeated)")
+        parser.add_argument('--index', default="benchmark_amcat",
+                            help="Elastic index to create (and delete afterwards)")
+        parser.add_argument('--output', help="Write the report (json) to this file")
+        parser.add_argument('--compare', help="Compare the results to this report")
+        parser.add_argument('--threshold', type=float, default=benchmark.DEFAULT_THRESHOLD,
+                            help="Relative slowdown of the median considered a regression")
+
+    def handle(self, *args, **options):
+        if options["index"] == settings.ES_INDEX:
+            raise CommandError("Refusing to run benchmarks on the configured index {}".format(settings.ES_INDEX))
+
+        previous = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                previous = json.load(f)
+
+        verbosity = options["verbosity"]
+        monitor = ProgressMonitor(name="benchmark") if verbosity > 1 else NullMonitor()
+        parameters = {name: options[name] for name in benchmark.DEFAULT_PARAMETERS}
+
+        settings.ES_INDEX = options["index"]
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+        try:
+            call_command("loaddata", "_initial_data.json", verbosity=verbosity)
+            es = ES()
+            es.delete_index()
+            es.check_index()
+            try:
+                corpus = benchmark.create_corpus(monitor=monitor, **parameters)
+                report = benchmark.run_benchmarks(corpus, options["only"], options["repeat"], monitor=monitor)
+            finally:
+                es.delete_index()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+        self.print_report(report)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+
+        if previous is not None:
+            rows = benchmark.compare(previous, report, threshold=options["threshold"])
+            self.print_comparison(rows)
+            regressions = [name for (name, _, _, _, status) in rows if status == "regression"]
+            if regressions:
+                raise CommandError("Regression(s) in: {}".format(", ".join(regressions)))
+
+    def print_report(self, report):
+        self.stdout.write("{:<24}{:>10}{:>10}{:>10}{:>8}{:>8}".format("benchmark", "median", "min", "max", "sql", "es"))
+        for name, result in report["benchmarks"].items():
+            self.stdout.write("{name:<24}{median:>10.3f}{min:>10.3f}{max:>10.3f}{sql_queries:>8}{es_calls:>8}"
+                              .format(name=name, **result))
+
+    def print_comparison(self, rows):
+        self.stdout.write("")
+        self.stdout.write("{:<24}{:>10}{:>10}{:>8}  {}".format("benchmark", "old", "new", "ratio", "status"))
+        for name, old, new, ratio, status in rows:
+            self.stdout.write("{:<24}{:>10}{:>10}{:>8}  {}".format(name, _format(old), _format(new), _format(ratio, 2), status))
+
+
+def _format(value, decimals=3):
+    if value is None:
+        return "-"
+    return "{:.{decimals}f}".format(value, decimals=decimals)
@@ -0,0 +1,69 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+Compare the speed of the query parser with the pyparsing grammar it replaced
+"""
+
+import time
+
+from django.core.management import BaseCommand
+
+from amcat.tools import queryparser
+
+QUERIES = [
+    'a',
+    'a AND b',
+    '"a b"~5 OR x:c*',
+    '(a AND (b OR c)) NOT (d W/10 e)',
+    'title:"climate change" AND (temperature* OR warming) NOT "global cooling"~10',
+]
+
+
+def _time(func, queries, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        for q in queries:
+            func(q)
+    return (time.time() - start) / (repeat * len(queries))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the query parser against the legacy pyparsing grammar'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10,
+                            help="Number of times to parse each query")
+        parser.add_argument('--terms', type=int, default=500,
+                            help="Number of terms in the large OR query")
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        large = " OR ".join('term{i}*'.format(i=i) for i in range(options["terms"]))
+        benchmarks = [("small", QUERIES), ("large", [large])]
+
+        start = time.time()
+        grammar = queryparser.get_pyparsing_grammar()
+        self.stdout.write("Building pyparsing grammar: {:.3f}s".format(time.time() - start))
+
+        for name, queries in benchmarks:
+            old = _time(lambda q: grammar.parseString(q, parseAll=True), queries, repeat)
+            new = _time(lambda q: queryparser.QueryParser(q).parse(), queries, repeat)
+            cached = _time(queryparser.parse, queries, repeat)
+            self.stdout.write("{name:>6}: pyparsing {old:.6f}s, parser {new:.6f}s ({ratio:.1f}x), cached {cached:.6f}s"
+                  .format(ratio=old / new, **locals()))
@@ -0,0 +1,44 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+Index the sentences of articles which have no sentences in the index yet
+"""
+
+import logging
+
+from django.core.management import BaseCommand
+
+from amcat.tools.amcates import ES
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Index sentences of articles without indexed sentences. Can be interrupted and resumed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--set', type=int, action="append", dest="sets",
+                            help="Only index articles in this articleset. Can be given multiple times.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of articles indexed per batch.")
+
+    def handle(self, *args, **options):
+        filters = {"sets": options["sets"]} if options["sets"] else {}
+        n = ES().backfill_sentences(batch_size=options["batch_size"], **filters)
+        log.info("Indexed sentences of {n} articles".format(**locals()))
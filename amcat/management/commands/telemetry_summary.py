@@ -0,0 +1,73 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+Summarize the telemetry events (see amcat.tools.telemetry) per task class or view
+"""
+import datetime
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from amcat.tools import telemetry
+
+
+class Command(BaseCommand):
+    help = 'Show p50/p95 durations, sql queries and elastic calls per task class (query action, ' \
+           'upload plugin, ..) or view (api endpoint, ..)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=settings.TELEMETRY_FILE,
+                            help="Telemetry file, defaults to settings.TELEMETRY_FILE")
+        parser.add_argument('--kind', choices=["task", "request"], help="Only show tasks or requests")
+        parser.add_argument('--days', type=float, help="Only use events of the last DAYS days")
+        parser.add_argument('--name', help="Only show events whose name contains NAME")
+        parser.add_argument('--field', action="append", dest="fields", default=[],
+                            help="Also summarize this stage or counter (can be repeated)")
+        parser.add_argument('--limit', type=int, default=50, help="Number of rows to show")
+
+    def handle(self, *args, **options):
+        if not options["file"]:
+            raise CommandError("No telemetry file given, and settings.TELEMETRY_FILE is not configured")
+
+        since = None
+        if options["days"] is not None:
+            since = datetime.datetime.now() - datetime.timedelta(days=options["days"])
+
+        events = telemetry.read_events(options["file"], since=since)
+        if options["kind"]:
+            events = (e for e in events if e["kind"] == options["kind"])
+        if options["name"]:
+            events = (e for e in events if options["name"] in e["name"])
+
+        fields = ["duration", "sql_queries", "es_calls"] + options["fields"]
+        rows = telemetry.summarize(events, fields=fields)[:options["limit"]]
+
+        header = ["kind", "name", "n"] + ["{}_{}".format(f, s) for f in fields for s in ("p50", "p95")]
+        table = [header] + [[_format(row.get(h)) for h in header] for row in rows]
+        widths = [max(len(r[i]) for r in table) for i in range(len(header))]
+        for r in table:
+            self.stdout.write("  ".join(v.ljust(w) if i < 2 else v.rjust(w) for i, (v, w) in enumerate(zip(r, widths))))
+
+
+def _format(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "{:.3f}".format(value)
+    return str(value)
@@ -0,0 +1,41 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+Build or update the stored article hash filter (see amcat.models.signature.ArticleHashFilter).
+Run this periodically, e.g. daily from cron, so processes only need to add few hashes.
+"""
+import logging
+
+from django.core.management import BaseCommand
+
+from amcat.models.signature import hash_filter
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Add new articles to the stored article hash filter, creating it if needed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action="store_true",
+                            help="Create the filter from scratch, e.g. after deleting many articles.")
+
+    def handle(self, *args, **options):
+        n = hash_filter.build(rebuild=options["rebuild"])
+        log.info("Added {n} hashes to the hash filter (watermark: {hash_filter.watermark})".format(**locals()))
@@ -24,7 +24,7 @@ from amcat.management.commands.upgrade_hashes import GROUP_SIZE
 from django.core.management import BaseCommand
 from amcat.models import Article
 from amcat.tools import amcates
-from amcat.tools.amcates import get_article_dict
+from amcat.tools.amcates import get_article_dicts
 from amcat.tools.toolkit import grouper
 
 
@@ -32,9 +32,22 @@ class Command(BaseCommand):
     help = 'Reindex existing articles in elasticsearch database, using postgres data. Does not' \
            'update hash or set membership.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--reindex-into', dest="reindex_into", metavar="INDEX",
+                            help="Instead of updating articles in place, copy them into a new index "
+                                 "INDEX with the current mappings (e.g. to add the sentence doctype). "
+                                 "Point ES_INDEX to the new index afterwards.")
+
     def handle(self, *args, **options):
         es = amcates.ES()
 
+        if options["reindex_into"]:
+            print("Copying articles from {} to {}..".format(es.index, options["reindex_into"]), end=" ")
+            sys.stdout.flush()
+            print(es.reindex_into(options["reindex_into"]))
+            print("Done. Set ES_INDEX to {} and run index_sentences.".format(options["reindex_into"]))
+            return
+
         print("Counting articles..", end=" ")
         sys.stdout.flush()
         narticles = es.count(query="*", filters={})
@@ -46,7 +59,7 @@ class Command(BaseCommand):
             print("{} of {} ({:.2f}%)".format(i*GROUP_SIZE, narticles, progress))
 
             articles = Article.objects.filter(id__in=article_ids).select_related("medium")
-            article_dicts = map(get_article_dict, articles)
+            article_dicts = get_article_dicts(articles)
 
             for article_dict in article_dicts:
                 del article_dict["sets"]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('amcat', '0009_plugins'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleSetChange',
+            fields=[
+                ('id', models.AutoField(db_column='change_id', primary_key=True, serialize=False)),
+                ('article_id', models.IntegerField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('articleset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='amcat.ArticleSet')),
+            ],
+            options={
+                'db_table': 'articlesets_changes',
+            },
+        ),
+    ]
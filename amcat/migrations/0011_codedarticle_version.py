@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('amcat', '0010_articlesetchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codedarticle',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
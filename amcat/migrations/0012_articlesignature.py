@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('amcat', '0011_codedarticle_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleSignature',
+            fields=[
+                ('article', models.OneToOneField(db_column='article_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='amcat.Article')),
+                ('version', models.SmallIntegerField()),
+                ('signature', models.BinaryField(null=True)),
+            ],
+            options={
+                'db_table': 'articles_signatures',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArticleSignatureBand',
+            fields=[
+                ('id', models.AutoField(db_column='signature_band_id', primary_key=True, serialize=False)),
+                ('band', models.SmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='amcat.Article')),
+            ],
+            options={
+                'db_table': 'articles_signatures_bands',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='articlesignatureband',
+            index_together=set([('band', 'bucket')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('amcat', '0012_articlesignature'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateFilter',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('watermark', models.IntegerField()),
+                ('data', models.BinaryField()),
+            ],
+            options={
+                'db_table': 'articles_duplicate_filters',
+            },
+        ),
+    ]
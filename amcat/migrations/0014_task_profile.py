@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('amcat', '0013_duplicatefilter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='profiling',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='profile',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def delete_old_hash_filter(apps, schema_editor):
+    # The filter of hex hashes was replaced by a filter of binary digests ('articles.hash.digest')
+    DuplicateFilter = apps.get_model("amcat", "DuplicateFilter")
+    DuplicateFilter.objects.filter(name="articles.hash").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('amcat', '0014_task_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_old_hash_filter, migrations.RunPython.noop),
+    ]
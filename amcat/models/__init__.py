@@ -25,6 +25,7 @@ from amcat.models.articleset import *
 from amcat.models.user import *
 from amcat.models.project import *
 from amcat.models.sentence import *
+from amcat.models.signature import *
 from amcat.models.amcat import *
 from amcat.models.task import *
 from amcat.models.query import *
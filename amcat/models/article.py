@@ -21,6 +21,7 @@
 Model module containing the Article class representing documents in the
 articles database table.
 """
+import binascii
 import collections
 import functools
 import html
@@ -36,13 +37,13 @@ from typing import List, Sequence, Set
 
 import datetime
 from django.contrib.postgres.fields import JSONField
-from django.core.exceptions import PermissionDenied, ValidationError
-from django.db import models, connection
+from django.core.exceptions import ValidationError
+from django.db import models, connection, transaction, IntegrityError
 from django.template.defaultfilters import escape as escape_filter
 from django_hash_field import HashField
 from psycopg2._json import Json
 
-from amcat.models.authorisation import ROLE_PROJECT_READER
+from amcat.models.authorisation import get_resolver
 from amcat.models.authorisation import Role
 from amcat.tools import amcates
 from amcat.tools.djangotoolkit import bulk_insert_returning_ids
@@ -392,7 +393,9 @@ class Article(AmcatModel):
         return amcates.get_article_dict(self, **kargs)
 
     def compute_hash(self):
-        hash = self.get_article_dict()['hash']
+        return self._set_hash(self.get_article_dict()['hash'])
+
+    def _set_hash(self, hash):
         if self.hash and self.hash != hash:
             raise ValueError("Incorrect hash specified")
         self.hash = hash
@@ -408,7 +411,8 @@ class Article(AmcatModel):
                 yield aid
 
     @classmethod
-    def create_articles(cls, articles, articleset=None, articlesets=None, deduplicate=True, monitor=NullMonitor()):
+    def create_articles(cls, articles, articleset=None, articlesets=None, deduplicate=True, monitor=NullMonitor(),
+                        near_duplicate_threshold=None):
         """
         Add the given articles to the database, the index, and the given set
 
@@ -416,7 +420,13 @@ class Article(AmcatModel):
 
         @param articles: a collection of objects with the necessary properties (.title etc)
         @param articleset(s): articleset object(s), specify either or none
+        @param near_duplicate_threshold: if given, articles with a similarity of at least this
+                                         threshold to an article in the sets of their project
+                                         are also considered duplicates (see amcat.models.signature)
         """
+        from amcat.models.articleset import log_index_changes, discard_index_changes
+        from amcat.models.signature import get_article_signature, save_signatures
+
         monitor = monitor.submonitor(total=6)
         if articlesets is None:
             articlesets = [articleset] if articleset else []
@@ -426,9 +436,10 @@ class Article(AmcatModel):
             if a.id is not None:
                 raise ValueError("Specifying explicit article ID in save not allowed")
 
-        # Compute hashes, mark all articles as non-duplicates
-        for a in articles:
-            a.compute_hash()
+        # Compute index documents and hashes, mark all articles as non-duplicates
+        dicts = amcates.get_article_dicts(articles, sets=[aset.id for aset in articlesets])
+        for a, d in zip(articles, dicts):
+            a._set_hash(d['hash'])
             a._duplicate = None
 
         # Determine which articles are dupes of each other, *then* query the database
@@ -437,59 +448,88 @@ class Article(AmcatModel):
             hashes = collections.defaultdict(list)  # type: Dict[bytes, List[Article]]
 
             for a in articles:
-                if a.hash in hashes:
-                    a._duplicate = hashes[a.hash][0]
+                digest = binascii.unhexlify(a.hash)
+                if digest in hashes:
+                    a._duplicate = hashes[digest][0]
                 else:
-                    hashes[a.hash].append(a)
+                    hashes[digest].append(a)
 
             # Check database for duplicates
             monitor.update(message="Checking _duplicates based on hash..")
             if hashes:
-                results = Article.objects.filter(hash__in=hashes.keys()).only("hash")
-                for orig in results:
-                    dupes = hashes[orig.hash]
-                    for dupe in dupes:
-                        dupe._duplicate = orig
-                        dupe.id = orig.id
+                _mark_exact_duplicates(hashes)
         else:
             monitor.update()
 
+        signatures = {}
+        if deduplicate and near_duplicate_threshold is not None:
+            signatures = {i: get_article_signature(a.title, a.text)
+                          for (i, a) in enumerate(articles) if not a._duplicate}
+            _mark_near_duplicates(articles, signatures, near_duplicate_threshold)
+
         # Save all non-duplicates
         to_insert = [a for a in articles if not a._duplicate]
         monitor.update(message="Inserting {} articles into database..".format(len(to_insert)))
         if to_insert:
-            result = bulk_insert_returning_ids(to_insert)
+            try:
+                with transaction.atomic():
+                    result = bulk_insert_returning_ids(to_insert)
+            except IntegrityError:
+                if not deduplicate:
+                    raise
+                # The hash filter can miss articles committed out of order, so check all hashes
+                log.warning("Duplicate hash not found in hash filter, checking all hashes")
+                _mark_exact_duplicates(hashes, use_filter=False)
+                to_insert = [a for a in articles if not a._duplicate]
+                with transaction.atomic():
+                    result = bulk_insert_returning_ids(to_insert) if to_insert else []
+
             for a, inserted in zip(to_insert, result):
                 a.id = inserted.id
-            dicts = [a.get_article_dict(sets=[aset.id for aset in articlesets]) for a in to_insert]
-            amcates.ES().bulk_insert(dicts, batch_size=100, monitor=monitor)
-        else:
-            monitor.update()
+            if signatures:
+                save_signatures({a.id: signatures[i] for (i, a) in enumerate(articles) if i in signatures
+                                 and not a._duplicate})
 
         # At this point we can still have internal duplicates. Give them an ID as well.
         for article in articles:
             if article.id is None and article._duplicate is not None:
                 article.id = article._duplicate.id
 
-        if not articlesets:
-            monitor.update(3)
-            return articles
-
-        # add new articles and _duplicates to articlesets
+        # add new articles and _duplicates to articlesets. Changes of new articles are logged
+        # along with their membership, so the index can be repaired if indexing below fails
         monitor.update(message="Adding articles to articleset..")
         new_ids = {a.id for a in to_insert}
         dupes = {a._duplicate.id for a in articles if a._duplicate} - new_ids
+        changes = []
         for aset in articlesets:
             if new_ids:
-                aset.add_articles(new_ids, add_to_index=False, monitor=monitor)
+                with transaction.atomic():
+                    aset.add_articles(new_ids, add_to_index=False, monitor=monitor)
+                    changes += log_index_changes(aset.id, new_ids)
             else:
                 monitor.update()
 
+        if to_insert:
+            new_dicts = []
+            for a, d in zip(articles, dicts):
+                if not a._duplicate:
+                    d['id'] = a.id
+                    new_dicts.append(d)
+            amcates.ES().bulk_insert(new_dicts, batch_size=100, monitor=monitor)
+            # New articles were indexed including their sets
+            discard_index_changes([c.id for c in changes])
+        else:
+            monitor.update()
+
+        for aset in articlesets:
             if dupes:
                 aset.add_articles(dupes, add_to_index=True, monitor=monitor)
             else:
                 monitor.update()
 
+        if not articlesets:
+            monitor.update(2)
+
         # Add to articleset caches
         properties = set()
         for article in articles:
@@ -501,38 +541,39 @@ class Article(AmcatModel):
         return articles
 
 
+def _mark_exact_duplicates(hashes, use_filter=True):
+    """
+    Mark articles whose hash already exists as duplicates of the existing article
+
+    @param hashes: mapping of (binary) hash digest -> list of articles with that hash
+    """
+    from amcat.models.signature import find_exact_duplicates, hash_filter
+    existing = find_exact_duplicates(hashes.keys(), use_filter=use_filter)
+    if not use_filter:
+        hash_filter.add(existing.keys())
+    for digest, aid in existing.items():
+        orig = Article(id=aid, hash=binascii.hexlify(digest).decode("ascii"))
+        for dupe in hashes[digest]:
+            dupe._duplicate = orig
+            dupe.id = orig.id
+
+
+def _mark_near_duplicates(articles, signatures, threshold):
+    """
+    Mark articles that are near-duplicates of an article in their project as duplicates of that article
+
+    @param signatures: mapping of index in articles -> signature
+    """
+    from amcat.models.signature import find_near_duplicates
+    by_project = collections.defaultdict(dict)
+    for i, signature in signatures.items():
+        by_project[articles[i].project_id][i] = signature
+    for project_id, project_signatures in by_project.items():
+        for i, aid in find_near_duplicates(project_id, project_signatures, threshold).items():
+            articles[i]._duplicate = Article(id=aid)
+            articles[i].id = aid
+
+
 def _check_read_access(user, aids):
     """Raises PermissionDenied if the user does not have full read access on all given articles"""
-    # get article set memberships
-    from amcat.models import ArticleSet, Project
-
-    sets = list(ArticleSet.articles.through.objects.filter(article_id__in=aids).values_list("articleset_id", "article_id"))
-    setids = {setid for (setid, aid) in sets}
-
-    # get project memberships
-    ok_sets = set()
-    project_cache = {} # pid : True / False
-    def project_ok(pid):
-        if pid not in project_cache:
-            role = Project.objects.get(pk=pid).get_role_id(user)
-            project_cache[pid] = role and (role >= ROLE_PROJECT_READER)
-        return project_cache[pid]
-
-    asets = [ArticleSet.objects.filter(pk__in=setids).values_list("pk", "project_id"),
-             Project.articlesets.through.objects.filter(articleset_id__in=setids)
-             .values_list("articleset_id", "project_id")]
-
-    for aset in asets:
-        for sid, pid in aset:
-            if project_ok(pid):
-                ok_sets.add(sid)
-
-
-    ok_articles = set()
-    for sid, aid in sets:
-        if sid in ok_sets:
-            ok_articles.add(aid)
-    aids = {aid for (setid, aid) in sets}
-    if aids - ok_articles:
-        logging.info("Permission denied for {user}, articles {}".format(aids - ok_articles, **locals()))
-        raise PermissionDenied("User does not have full read access on (some) of the selected articles")
+    get_resolver(user).check_read_access(aids)
@@ -22,6 +22,8 @@ Model module for Article Sets. A Set is a generic collection of articles,
 either created manually or as a result of importing articles or assigning
 codingjobs.
 """
+import collections
+import datetime
 import functools
 import itertools
 import json
@@ -33,11 +35,13 @@ import redis
 from django import db
 from django.db import connection
 from django.db import models
+from django.db import transaction
 
 from amcat.models.article import Article
 from amcat.models.coding.codedarticle import CodedArticle
 from amcat.tools import amcates, toolkit
 from amcat.tools.amcates import ES
+from amcat.tools.djangotoolkit import bulk_insert_returning_ids
 from amcat.tools.model import AmcatModel
 from amcat.tools.progress import NullMonitor
 
@@ -92,7 +96,7 @@ class ArticleSet(AmcatModel):
         from amcat.tools.amcates import ES
         return ES().count(filters={"sets": self.id})
 
-    def add_articles(self, article_ids, add_to_index=True, monitor=NullMonitor()):
+    def add_articles(self, article_ids, add_to_index=True, monitor=NullMonitor(), verify=True):
         """
         Add the given articles to this articleset. Implementation is exists of three parts:
 
@@ -105,30 +109,40 @@ class ArticleSet(AmcatModel):
 
         @param add_to_index: notify elasticsearch of changes
         @type add_to_index: bool
+
+        @param verify: check whether the articles exist and are not already in this set. Only
+                       set to False if the caller guarantees this (e.g. when filling a new set)
+        @type verify: bool
         """
         monitor = monitor.submonitor(total=4)
 
         article_ids = {(art if type(art) is int else art.id) for art in article_ids}
 
         # Only use articles that exist
-        to_add = article_ids - self.get_article_ids()
-        to_add = list(Article.exists(to_add))
+        if verify:
+            to_add = article_ids - self.get_article_ids()
+            to_add = list(Article.exists(to_add))
+        else:
+            to_add = list(article_ids)
+
+        with transaction.atomic():
+            monitor.update(message="Adding {n} articles to {aset}..".format(n=len(to_add), aset=self))
+            ArticleSetArticle.objects.bulk_create(
+                [ArticleSetArticle(articleset=self, article_id=artid) for artid in to_add],
+                batch_size=100,
+            )
 
-        monitor.update(message="Adding {n} articles to {aset}..".format(n=len(to_add), aset=self))
-        ArticleSetArticle.objects.bulk_create(
-            [ArticleSetArticle(articleset=self, article_id=artid) for artid in to_add],
-            batch_size=100,
-        )
+            monitor.update(message="{n} articleset articles added to database, adding to codingjobs..".format(n=len(to_add)))
+            cjarts = [CodedArticle(codingjob=c, article_id=a) for c, a in itertools.product(self.codingjob_set.all(), to_add)]
+            CodedArticle.objects.bulk_create(cjarts)
 
-        monitor.update(message="{n} articleset articles added to database, adding to codingjobs..".format(n=len(to_add)))
-        cjarts = [CodedArticle(codingjob=c, article_id=a) for c, a in itertools.product(self.codingjob_set.all(), to_add)]
-        CodedArticle.objects.bulk_create(cjarts)
+            if add_to_index:
+                log_index_changes(self.id, to_add)
 
         if add_to_index:
             monitor.update(message="{n} articles added to codingjobs, adding to index".format(n=len(cjarts)))
-            es = ES()
-            es.add_to_set(self.id, to_add, monitor=monitor)
-            es.refresh()  # We need to flush, or setting cache will fail
+            apply_index_changes(articleset_ids=[self.id], limit=None, monitor=monitor)
+            ES().refresh()  # We need to flush, or setting cache will fail
         else:
             monitor.update(2)
 
@@ -196,15 +210,19 @@ class ArticleSet(AmcatModel):
         monitor = monitor.submonitor(4)
         to_remove = {(art if type(art) is int else art.id) for art in articles}
 
-        monitor.update(message="Deleting articles from database")
-        ArticleSetArticle.objects.filter(articleset=self, article__in=articles).delete()
+        with transaction.atomic():
+            monitor.update(message="Deleting articles from database")
+            ArticleSetArticle.objects.filter(articleset=self, article__in=to_remove).delete()
 
-        monitor.update(message="Deleting coded articles from database")
-        CodedArticle.objects.filter(codingjob__articleset=self, article__in=articles).delete()
+            monitor.update(message="Deleting coded articles from database")
+            CodedArticle.objects.filter(codingjob__articleset=self, article__in=to_remove).delete()
+
+            if remove_from_index:
+                log_index_changes(self.id, to_remove)
 
         if remove_from_index:
             monitor.update(message="Deleting from index")
-            amcates.ES().remove_from_set(self.id, to_remove)
+            apply_index_changes(articleset_ids=[self.id], limit=None)
         else:
             monitor.update()
 
@@ -324,3 +342,87 @@ class ArticleSet(AmcatModel):
 # Legacy
 ArticleSetArticle = ArticleSet.articles.through
 
+
+class ArticleSetChange(models.Model):
+    """
+    Change log (outbox) of articleset memberships which might not be reflected in the
+    index yet. Changes are logged in the same transaction as the memberships themselves,
+    and removed by apply_index_changes once the index agrees with the database.
+    """
+    id = models.AutoField(primary_key=True, db_column='change_id')
+    articleset = models.ForeignKey(ArticleSet, related_name="+", on_delete=models.CASCADE)
+    article_id = models.IntegerField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta():
+        app_label = 'amcat'
+        db_table = 'articlesets_changes'
+
+
+def log_index_changes(articleset_id, article_ids):
+    """
+    Record that membership of the given articles of the given set changed.
+
+    @returns: list of ArticleSetChange objects (with only .id set on postgres)
+    """
+    changes = (ArticleSetChange(articleset_id=articleset_id, article_id=aid) for aid in article_ids)
+    return bulk_insert_returning_ids(changes) or []
+
+
+def discard_index_changes(change_ids):
+    """Remove changes which are known to be applied (e.g. by indexing articles along with their sets)"""
+    for batch in toolkit.splitlist(change_ids, itemsperbatch=10000):
+        ArticleSetChange.objects.filter(id__in=batch).delete()
+
+
+def get_index_lag():
+    """
+    Returns the number of pending changes and the age of the oldest one in seconds.
+    """
+    pending = ArticleSetChange.objects.aggregate(n=models.Count("id"), oldest=models.Min("timestamp"))
+    if pending["oldest"] is None:
+        return 0, 0.0
+    oldest = pending["oldest"].replace(tzinfo=None)
+    return pending["n"], (datetime.datetime.now() - oldest).total_seconds()
+
+
+def apply_index_changes(articleset_ids=None, limit=100000, monitor=NullMonitor()):
+    """
+    Push pending changes (see ArticleSetChange) to the index. Changes only mark
+    (set, article) pairs as dirty: the index is made to agree with the membership in
+    the database, so applying a change multiple times is harmless.
+
+    @param articleset_ids: only apply changes of these sets
+    @param limit: maximum number of changes to apply in one call (None for all)
+    @returns: number of changes applied
+    """
+    changes = ArticleSetChange.objects.order_by("id")
+    if articleset_ids is not None:
+        changes = changes.filter(articleset_id__in=articleset_ids)
+    changes = list(changes.values_list("id", "articleset_id", "article_id")[:limit])
+
+    dirty = collections.defaultdict(set)
+    for _, setid, aid in changes:
+        dirty[setid].add(aid)
+
+    monitor = monitor.submonitor(total=max(1, len(dirty)))
+    if not dirty:
+        monitor.update()
+
+    es = ES()
+    for setid, aids in dirty.items():
+        members = set(ArticleSetArticle.objects.filter(articleset_id=setid, article_id__in=aids)
+                      .values_list("article_id", flat=True))
+        indexed = set(es.in_index(aids))
+
+        es.remove_from_set(setid, (aids - members) & indexed)
+        es.add_articles(list(members - indexed))
+        es.add_to_set(setid, members & indexed, monitor=monitor)
+
+    discard_index_changes([cid for cid, _, _ in changes])
+
+    if changes:
+        stats_log.info(json.dumps({"action": "index_changes_applied", "n": len(changes)}))
+
+    return len(changes)
+
@@ -25,13 +25,23 @@ Main entry points are
 
 check(db, privilege/str/int) checks whether user has privilege
 getPrivilege(db, str or int) returns Privilege object
+get_resolver(user) returns a (memoized) PermissionResolver to check roles in bulk
 
 """
-from django.contrib.auth.models import User
+import logging
+import random
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Set
 
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from amcat.tools.model import AmcatModel
 
+log = logging.getLogger(__name__)
+
 ROLE_PROJECT_METAREADER = 10
 ROLE_PROJECT_READER = 11
 ROLE_PROJECT_WRITER = 12
@@ -78,3 +88,206 @@ class Privilege(AmcatModel):
     class Meta():
         db_table = 'privileges'
         app_label = 'amcat'
+
+
+# The generation is changed whenever roles, guest roles or project memberships of sets change,
+# so resolvers (which live at most as long as a request) never use stale roles after such a
+# change. It is kept in the (shared) cache, so changes made by other processes are seen as well.
+GENERATION_KEY = "amcat-permission-resolver-generation"
+
+
+def _get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, random.getrandbits(48), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def invalidate_resolvers(**kwargs):
+    """Invalidate the roles loaded by all permission resolvers. Used as signal receiver."""
+    try:
+        # incr is atomic, so concurrent invalidations are never lost
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # Not in the cache (anymore), start at a random generation no resolver can have
+        cache.set(GENERATION_KEY, random.getrandbits(48), None)
+
+
+post_save.connect(invalidate_resolvers, sender=ProjectRole, dispatch_uid="permission-resolver-projectrole")
+post_delete.connect(invalidate_resolvers, sender=ProjectRole, dispatch_uid="permission-resolver-projectrole")
+
+
+_role_ids = {}
+
+
+def get_role_id(role) -> int:
+    """
+    Return the id of the given role
+    @param role: a role instance, ID, or label
+    """
+    if isinstance(role, Role):
+        return role.id
+    if isinstance(role, str):
+        if role not in _role_ids:
+            _role_ids[role] = Role.objects.get(label=role).id
+        return _role_ids[role]
+    return role
+
+
+_MISSING = object()
+
+
+def _get_id(obj):
+    return obj if isinstance(obj, int) else obj.id
+
+
+class PermissionResolver(object):
+    """
+    Resolve the roles of a single user on projects, article sets and articles. The roles of
+    the user on all projects are loaded with a single query, and guest roles and project
+    memberships of sets are loaded in bulk and memoized. Use get_resolver(user) to get the
+    resolver of the user of the current request.
+    """
+    def __init__(self, user: Optional[User]):
+        self.user = user
+        self._reset()
+
+    def _reset(self, generation=None):
+        self._generation = _get_generation() if generation is None else generation
+        self._user_roles = None  # project_id -> role_id of the user
+        self._guest_roles = {}  # project_id -> guest role_id or None
+        self._set_projects = {}  # articleset_id -> ids of the projects the set belongs to
+
+    def _check_generation(self):
+        generation = _get_generation()
+        if self._generation != generation:
+            self._reset(generation)
+
+    @property
+    def is_superuser(self) -> bool:
+        return self.user is not None and self.user.is_superuser
+
+    def _get_user_roles(self) -> Dict[int, int]:
+        if self._user_roles is None:
+            if self.user is None or self.user.is_anonymous():
+                self._user_roles = {}
+            else:
+                roles = ProjectRole.objects.filter(user_id=self.user.id).values_list("project_id", "role_id")
+                self._user_roles = dict(roles)
+        return self._user_roles
+
+    def get_role_ids(self, projects: Iterable) -> Dict[int, Optional[int]]:
+        """
+        Return the roles this user has on the given projects, by their own right or as guest.
+        @param projects: Project objects or ids. The guest role of Project objects is used as is.
+        @return: a mapping of project id -> role id (or None if the user has no role at all)
+        """
+        from amcat.models import Project
+        self._check_generation()
+
+        guest_roles = {}
+        for project in projects:
+            if isinstance(project, Project):
+                guest_roles[project.id] = project.guest_role_id
+            else:
+                guest_roles[project] = self._guest_roles.get(project, _MISSING)
+
+        missing = [pid for (pid, role_id) in guest_roles.items() if role_id is _MISSING]
+        if missing:
+            self._guest_roles.update({pid: None for pid in missing})
+            self._guest_roles.update(Project.objects.filter(pk__in=missing).values_list("id", "guest_role_id"))
+            guest_roles.update((pid, self._guest_roles[pid]) for pid in missing)
+
+        user_roles = self._get_user_roles()
+        result = {}
+        for pid, guest_role in guest_roles.items():
+            roles = [r for r in (guest_role, user_roles.get(pid)) if r is not None]
+            result[pid] = max(roles) if roles else None
+        return result
+
+    def get_role_id(self, project) -> Optional[int]:
+        """Return the role this user has on the given project (object or id), see get_role_ids"""
+        return self.get_role_ids([project])[_get_id(project)]
+
+    def has_role(self, project, role) -> bool:
+        """
+        Returns whether the user has the given role on the given project (object or id).
+        If user is site-admin, always return True
+        @param role: a role instance, ID, or label
+        """
+        return bool(self.filter_projects([project], role))
+
+    def filter_projects(self, projects: Iterable, role=ROLE_PROJECT_READER) -> Set[int]:
+        """Return the ids of the given projects (objects or ids) on which the user has (at least) role"""
+        projects = list(projects)
+        if self.is_superuser:
+            return {_get_id(p) for p in projects}
+        role_id = get_role_id(role)
+        return {pid for (pid, actual) in self.get_role_ids(projects).items()
+                if actual is not None and actual >= role_id}
+
+    def _get_set_projects(self, articleset_ids) -> Dict[int, Set[int]]:
+        from amcat.models import ArticleSet, Project
+        self._check_generation()
+
+        missing = {aid for aid in articleset_ids if aid not in self._set_projects}
+        if missing:
+            set_projects = defaultdict(set)
+            for sid, pid in ArticleSet.objects.filter(pk__in=missing).values_list("pk", "project_id"):
+                set_projects[sid].add(pid)
+            links = Project.articlesets.through.objects.filter(articleset_id__in=missing)
+            for sid, pid in links.values_list("articleset_id", "project_id"):
+                set_projects[sid].add(pid)
+            self._set_projects.update((sid, set_projects[sid]) for sid in missing)
+        return {sid: self._set_projects[sid] for sid in articleset_ids}
+
+    def filter_articlesets(self, articleset_ids: Iterable[int], role=ROLE_PROJECT_READER) -> Set[int]:
+        """
+        Return the ids of the given sets on which the user has (at least) role, i.e. the sets
+        that belong to (or are linked to) a project on which the user has that role
+        """
+        set_projects = self._get_set_projects(set(articleset_ids))
+        ok_projects = self.filter_projects(set().union(*set_projects.values()), role)
+        return {sid for (sid, pids) in set_projects.items() if pids & ok_projects}
+
+    def get_article_sets(self, article_ids: Iterable[int]) -> Dict[int, Set[int]]:
+        """Return a mapping of article id -> ids of the sets the article is contained in"""
+        from amcat.models import ArticleSet
+        article_sets = defaultdict(set)
+        memberships = ArticleSet.articles.through.objects.filter(article_id__in=article_ids)
+        for sid, aid in memberships.values_list("articleset_id", "article_id"):
+            article_sets[aid].add(sid)
+        return article_sets
+
+    def filter_articles(self, article_ids: Iterable[int], role=ROLE_PROJECT_READER) -> Set[int]:
+        """
+        Return the ids of the given articles on which the user has (at least) role, i.e. the
+        articles in at least one set on which the user has that role
+        """
+        article_sets = self.get_article_sets(list(article_ids))
+        ok_sets = self.filter_articlesets(set().union(*article_sets.values()), role)
+        return {aid for (aid, sids) in article_sets.items() if sids & ok_sets}
+
+    def check_read_access(self, article_ids: Iterable[int]):
+        """Raises PermissionDenied if the user does not have full read access on all given articles"""
+        article_sets = self.get_article_sets(list(article_ids))
+        ok_sets = self.filter_articlesets(set().union(*article_sets.values()), ROLE_PROJECT_READER)
+        denied = {aid for (aid, sids) in article_sets.items() if not sids & ok_sets}
+        if denied:
+            log.info("Permission denied for {self.user}, articles {denied}".format(**locals()))
+            raise PermissionDenied("User does not have full read access on (some) of the selected articles")
+
+
+def get_resolver(user: Optional[User]) -> PermissionResolver:
+    """
+    Return the permission resolver of the given user. The resolver is stored on the user
+    object, so (as request.user is loaded for each request) it is memoized per request.
+    """
+    if user is None:
+        return PermissionResolver(None)
+    resolver = getattr(user, "_permission_resolver", None)
+    if resolver is None:
+        resolver = PermissionResolver(user)
+        user._permission_resolver = resolver
+    return resolver
@@ -59,6 +59,112 @@ class CodebookCycleException(ValueError):
     pass
 
 
+class CodebookIndex(object):
+    """
+    Materialised representation of a codebook hierarchy, as returned by
+    Codebook._get_hierarchy_ids. For every code it stores its parent, depth and
+    ancestors, and the range it occupies in a pre-order walk of the tree, so
+    ancestor lookups and subtree tests don't need to walk the hierarchy.
+
+    Parents which are not in the hierarchy themselves (for example, because they
+    are hidden) are considered roots, just like in Codebook.get_roots. Codes in
+    (or below) a cycle are not part of the tree; asking for their ancestors or
+    descendants raises a CodebookCycleException.
+    """
+    def __init__(self, hierarchy, valid_until=None):
+        """
+        @param hierarchy: mapping of code_id : parent_id (or None)
+        @param valid_until: datetime at which the hierarchy changes due to validfrom / validto
+        """
+        self.valid_until = valid_until
+
+        parent_ids = OrderedDict.fromkeys(p for p in hierarchy.values() if p is not None)
+        self.code_ids = tuple(chain(hierarchy, (p for p in parent_ids if p not in hierarchy)))
+        self.position = {code_id: i for i, code_id in enumerate(self.code_ids)}
+
+        self.parents = [-1] * len(self.code_ids)
+        self.children = [[] for _ in self.code_ids]
+        for code_id, parent_id in hierarchy.items():
+            if parent_id is not None:
+                i, parent = self.position[code_id], self.position[parent_id]
+                self.parents[i] = parent
+                self.children[parent].append(i)
+
+        # Roots are ordered by their last occurrence in the hierarchy, see get_roots
+        order = {code_id: i for i, code_id in enumerate(chain(hierarchy.keys(), hierarchy.values()))}
+        roots = (i for i, parent in enumerate(self.parents) if parent == -1)
+        self.roots = sorted(roots, key=lambda i: order[self.code_ids[i]])
+
+        # Walk tree and register depth, ancestors and pre-order ranges [start, end)
+        self.depth = [None] * len(self.code_ids)
+        self.ancestors = [None] * len(self.code_ids)
+        self.start = [None] * len(self.code_ids)
+        self.end = [None] * len(self.code_ids)
+        self.preorder = []
+
+        for root in self.roots:
+            self.depth[root] = 0
+            self.ancestors[root] = (self.code_ids[root],)
+            self.start[root] = len(self.preorder)
+            self.preorder.append(self.code_ids[root])
+            stack = [(root, iter(self.children[root]))]
+
+            while stack:
+                node, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    self.end[node] = len(self.preorder)
+                    stack.pop()
+                    continue
+                self.depth[child] = self.depth[node] + 1
+                self.ancestors[child] = (self.code_ids[child],) + self.ancestors[node]
+                self.start[child] = len(self.preorder)
+                self.preorder.append(self.code_ids[child])
+                stack.append((child, iter(self.children[child])))
+
+    def __contains__(self, code_id):
+        return code_id in self.position
+
+    def __len__(self):
+        return len(self.code_ids)
+
+    def _get_position(self, code_id):
+        """Return position of code_id. Raises a KeyError if it is not in this index and
+        a CodebookCycleException if it is not part of the tree."""
+        i = self.position[code_id]
+        if self.start[i] is None:
+            raise CodebookCycleException("Cycle in hierarchy at code {code_id}".format(**locals()))
+        return i
+
+    @property
+    def root_ids(self):
+        return [self.code_ids[i] for i in self.roots]
+
+    def get_parent_id(self, code_id):
+        parent = self.parents[self.position[code_id]]
+        return None if parent == -1 else self.code_ids[parent]
+
+    def get_children_ids(self, code_id):
+        return [self.code_ids[i] for i in self.children[self.position[code_id]]]
+
+    def get_depth(self, code_id):
+        return self.depth[self._get_position(code_id)]
+
+    def get_ancestor_ids(self, code_id):
+        """Return a tuple of ancestor ids for this code, from the code itself up to its root"""
+        return self.ancestors[self._get_position(code_id)]
+
+    def get_descendant_ids(self, code_id):
+        """Return a tuple of this code and all its descendants, in pre-order"""
+        i = self._get_position(code_id)
+        return tuple(self.preorder[self.start[i]:self.end[i]])
+
+    def is_descendant(self, code_id, ancestor_id):
+        """Return whether code_id is ancestor_id or one of its descendants"""
+        i, ancestor = self._get_position(code_id), self._get_position(ancestor_id)
+        return self.start[ancestor] <= self.start[i] < self.end[ancestor]
+
+
 class Codebook(AmcatModel):
     """Model class for table codebooks
 
@@ -86,6 +192,7 @@ class Codebook(AmcatModel):
         self._cached_labels = set()
         self._prefetched_objects_cache = {}
         self._labels = collections.defaultdict(dict)
+        self._indices = {}
 
     @property
     def cached(self):
@@ -132,6 +239,7 @@ class Codebook(AmcatModel):
         ccodes = ccodes.select_related("code", *select_related)
         ccodes = ccodes.prefetch_related(*prefetch_related)
         self._prefetched_objects_cache['codebookcode_set'] = ccodes = tuple(ccodes)
+        self._indices = {}
         self._codes = OrderedDict((cc.code_id, cc.code) for cc in ccodes)
         self._codebookcodes = collections.defaultdict(list)
 
@@ -236,27 +344,48 @@ class Codebook(AmcatModel):
             return OrderedDict((co.code_id, co.parent_id) for co in codes)
         return OrderedDict((co.code_id, co.parent_id) for co in codes if not co.hide)
 
+    def _get_valid_until(self, date):
+        """Return the first validfrom / validto after date, i.e. the moment at which the
+        hierarchy for date might change. Returns None if it never changes."""
+        dates = (d for co in self.codebookcodes for d in (co.validfrom, co.validto) if d and d > date)
+        return min(dates, default=None)
 
-    def _get_node(self, children, node, seen):
+    def get_index(self, date=None, include_hidden=False):
         """
-        Return a namedtuple as described in get_tree(). Raises a CodebookCycleException
-        when it detects a cycle.
+        Return a CodebookIndex of the hierarchy of this codebook. If this codebook
+        is cached, the index for the current date is built only once, and rebuilt
+        when a code becomes (in)valid.
+
+        @param date, include_hidden: see get_hierarchy
         """
-        if node in seen:
-            raise CodebookCycleException("Cycle? {}".format(node))
+        if date is not None or not self.cached:
+            return CodebookIndex(self._get_hierarchy_ids(date, include_hidden))
+
+        now = datetime.now()
+        index = self._indices.get(include_hidden)
+        if index is None or (index.valid_until is not None and now >= index.valid_until):
+            hierarchy = self._get_hierarchy_ids(now, include_hidden)
+            index = CodebookIndex(hierarchy, valid_until=self._get_valid_until(now))
+            self._indices[include_hidden] = index
+        return index
+
 
+    def _get_node(self, index, codes, node):
+        """
+        Return a namedtuple as described in get_tree().
+        """
         cc = self.get_codebookcode(node)
-        seen.add(node)
+        children = index.get_children_ids(node.id) if node.id in index else ()
 
         return TreeItem(
             code_id=node.id, codebookcode_id=cc.id if cc else None,
             hidden=cc.hide if cc else None, ordernr=cc.ordernr if cc else None,
-            children=self._walk(children, children[node], seen),
+            children=self._walk(index, codes, (codes[cid] for cid in children)),
             label=node.label
         )
 
-    def _walk(self, children, nodes, seen):
-        return tuple(self._get_node(children, n, seen) for n in nodes)
+    def _walk(self, index, codes, nodes):
+        return tuple(self._get_node(index, codes, n) for n in nodes)
 
     def get_tree(self, include_hidden=True, date=None, roots=None):
         """
@@ -271,16 +400,19 @@ class Codebook(AmcatModel):
         @type roots: List of CodebookCodes
         @requires: roots in self.codebookcodes
         """
-        children = collections.defaultdict(list)
-        hierarchy = self.get_hierarchy(include_hidden=include_hidden, date=date)
-        nodes = roots or self.get_roots(include_hidden=include_hidden, date=date)
-        seen = set()
+        index = self.get_index(include_hidden=include_hidden, date=date)
+        root_ids = [node.id for node in roots] if roots else index.root_ids
+
+        # Raises a CodebookCycleException if a root is part of a cycle
+        code_ids = set(chain.from_iterable(index.get_descendant_ids(cid) for cid in root_ids if cid in index))
 
-        for child, parent in hierarchy:
-            if parent:
-                children[parent].append(child)
+        if self.cached:
+            codes = self._codes
+        else:
+            codes = Code.objects.in_bulk(code_ids)
 
-        return self._walk(children, nodes, seen)
+        nodes = roots or [codes[cid] for cid in root_ids]
+        return self._walk(index, codes, nodes)
 
 
     def get_hierarchy(self, date=None, include_hidden=False):
@@ -441,6 +573,7 @@ class Codebook(AmcatModel):
 
         # Update child (`code`) caching
         if self.cached:
+            self._indices = {}
             self._codebookcodes[code.id].append(child)
             sort_codebookcodes(self._codebookcodes[code.id])
             code = child._code_cache = self._codes[code.id] = self._codes.get(code.id, code)
@@ -464,6 +597,7 @@ class Codebook(AmcatModel):
     def delete_codebookcode(self, codebookcode):
         """Delete this CodebookCode from this Codebook."""
         if self.cached:
+            self._indices = {}
             self._codebookcodes[codebookcode.code_id].remove(codebookcode)
             if not self._codebookcodes[codebookcode.code_id]:
                 # No Codebookcodes left to refer to this code
@@ -485,22 +619,9 @@ class Codebook(AmcatModel):
         @return: the root nodes in this codebook
         @param kargs: passed to get_hierarchy (e.g. date, include_hidden)
         """
-        parents, children, roots = set(), set(), set()
-        hierarchy = tuple(self.get_hierarchy(**kwargs))
-
-        for child, parent in hierarchy:
-            if parent is None:
-                roots.add(child)
-
-            parents.add(parent)
-            children.add(child)
-
-        # Keep ordering by using order of hierarchy
-        roots |= parents - children - {None, }
-        hierarchy = OrderedDict(hierarchy)
-        codes = chain(hierarchy.keys(), hierarchy.values())
-        codes = {code: i for i, code in enumerate(codes)}
-        return sorted(roots, key=codes.get)
+        root_ids = self.get_index(**kwargs).root_ids
+        codes = self._codes if self.cached else Code.objects.in_bulk(root_ids)
+        return [codes[cid] for cid in root_ids]
 
     def get_children(self, code, **kargs):
         """
@@ -511,29 +632,12 @@ class Codebook(AmcatModel):
 
     def get_ancestor_ids(self, code_id):
         """
-        Return a sequence of ancestor ids for this code, from the code itself up to a root of the codeobok
-        @parem code: a Code object in this codebook
+        Return a sequence of ancestor ids for this code, from the code itself up to a root of the codebook.
+        Raises a KeyError if the code is not in this codebook and a CodebookCycleException (a ValueError)
+        if it is part of a cycle.
+        @param code_id: id of a Code object in this codebook
         """
-        hierarchy = self._get_hierarchy_ids()
-
-        def _get_parent(code):
-            for child, parent in hierarchy.items():
-                if child == code:
-                    return parent
-            raise ValueError("Code {code!r} not in hierarchy!")
-
-        seen = set()
-        while True:
-            yield code_id
-            seen.add(code_id)
-            parent = hierarchy[code_id]  #_get_parent(code_id)
-            if parent is None:
-                return
-            elif parent in seen:
-                raise ValueError("Cycle in hierarchy: parent {parent} already in seen {seen}".format(**locals()))
-            seen.add(parent)
-
-            code_id = parent
+        return self.get_index().get_ancestor_ids(code_id)
 
     def get_language_ids(self):
         """
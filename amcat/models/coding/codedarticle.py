@@ -27,7 +27,7 @@ from functools import partial
 from django.db.models import sql
 from amcat.models.coding.codingschemafield import CodingSchemaField
 from amcat.models.coding.coding import CodingValue, Coding
-from amcat.tools.djangotoolkit import bulk_insert_returning_ids
+from amcat.tools.djangotoolkit import bulk_insert_returning_ids, copy_insert
 from amcat.tools.model import AmcatModel
 
 log = logging.getLogger(__name__)
@@ -78,6 +78,42 @@ def _to_codingvalues(coding, values):
     """
     return map(partial(_to_codingvalue, coding), values)
 
+def _get_field_ids(codingjob):
+    """
+    Returns the set of codingschemafield ids valid for the given codingjob. None
+    is included, so missing ids trigger an IntegrityError upon insertion instead.
+    """
+    schemas = (codingjob.unitschema_id, codingjob.articleschema_id)
+    fields = CodingSchemaField.objects.filter(codingschema__id__in=schemas)
+    return set(fields.values_list("id", flat=True)) | {None}
+
+def _validate_coding_dicts(coding_dicts, field_ids):
+    """
+    Checks coding dictionaries (see CodedArticle.replace_codings) for consistency.
+
+    @raises ValueError: if any of the codings or values are invalid
+    """
+    if not all(isinstance(cd, dict) and isinstance(cd.get("values"), list) for cd in coding_dicts):
+        raise ValueError("codings must be objects with a list of values")
+
+    values = tuple(itertools.chain.from_iterable(cd["values"] for cd in coding_dicts))
+    if not all(isinstance(v, dict) for v in values):
+        raise ValueError("values must be objects")
+
+    if any(v.get("intval") == v.get("strval") is None for v in values):
+        raise ValueError("intval and strval cannot both be None")
+
+    if any(v.get("intval") is not None and v.get("strval") is not None for v in values):
+        raise ValueError("intval and strval cannot both be not None")
+
+    if any(v.get("codingschemafield_id") not in field_ids for v in values):
+        raise ValueError("codingschemafield_id must be in codingjob")
+
+def _get_coding_key(coding):
+    """Returns the (sentence_id, start, end) tuple identifying a coding (dict)"""
+    if isinstance(coding, Coding):
+        return coding.sentence_id, coding.start, coding.end
+    return coding.get("sentence_id"), coding.get("start"), coding.get("end")
 
 class CodedArticle(models.Model):
     """
@@ -86,11 +122,15 @@ class CodedArticle(models.Model):
     and is created when creating a codingjob (see `create_coded_articles` in codingjob.py).
 
     Each coded article contains codings (1:N) and each coding contains codingvalues (1:N).
+
+    The version is incremented on each save by the annotator, which uses it to detect
+    concurrent edits of the same coded article.
     """
     comments = models.TextField(blank=True, null=True)
     status = models.ForeignKey(CodedArticleStatus, default=STATUS_NOTSTARTED)
     article = models.ForeignKey("amcat.Article", related_name="coded_articles")
     codingjob = models.ForeignKey("amcat.CodingJob", related_name="coded_articles")
+    version = models.IntegerField(default=0)
 
     def __str__(self):
         return "Article: {self.article}, Codingjob: {self.codingjob}".format(**locals())
@@ -157,23 +197,76 @@ class CodedArticle(models.Model):
         @returns: ([Coding], [CodingValue])
         """
         coding_dicts = tuple(coding_dicts)
+        _validate_coding_dicts(coding_dicts, _get_field_ids(self.codingjob))
+
+        with transaction.atomic():
+            return self._replace_codings(coding_dicts)
 
-        values = tuple(itertools.chain.from_iterable(cd["values"] for cd in coding_dicts))
-        if any(v.get("intval") == v.get("strval") is None for v in values):
-            raise ValueError("intval and strval cannot both be None")
+    def _update_codings(self, new_codings):
+        # Match new codings with existing ones on (sentence_id, start, end), in order
+        existing = collections.defaultdict(list)
+        for coding, values in self.get_codings():
+            existing[_get_coding_key(coding)].append((coding, {v.field_id: v for v in values}))
+
+        coding_objects, value_objects = [], []
+        added_codings, added_values, changed_values, deleted_value_ids = [], [], [], []
+
+        for coding_dict in new_codings:
+            candidates = existing[_get_coding_key(coding_dict)]
+            if not candidates:
+                added_codings.append(coding_dict)
+                continue
+
+            coding, old_values = candidates.pop(0)
+            coding_objects.append(coding)
+            for value_dict in coding_dict["values"]:
+                value = old_values.pop(value_dict.get("codingschemafield_id"), None)
+                if value is None:
+                    value = _to_codingvalue(coding, value_dict)
+                    added_values.append(value)
+                elif (value.intval, value.strval) != (value_dict.get("intval"), value_dict.get("strval")):
+                    value.intval, value.strval = value_dict.get("intval"), value_dict.get("strval")
+                    changed_values.append(value)
+                value_objects.append(value)
+            deleted_value_ids.extend(v.id for v in old_values.values())
+
+        deleted_coding_ids = [c.id for candidates in existing.values() for c, _ in candidates]
+
+        if deleted_value_ids or deleted_coding_ids:
+            CodingValue.objects.filter(id__in=deleted_value_ids).delete()
+            CodingValue.objects.filter(coding__id__in=deleted_coding_ids).delete()
+            Coding.objects.filter(id__in=deleted_coding_ids).delete()
+
+        for value in changed_values:
+            CodingValue.objects.filter(id=value.id).update(intval=value.intval, strval=value.strval)
+
+        new_coding_objects = bulk_insert_returning_ids(map(partial(_to_coding, self), added_codings)) or []
+        new_coding_values = list(itertools.chain.from_iterable(
+            _to_codingvalues(co, c["values"]) for c, co in zip(added_codings, new_coding_objects)
+        ))
+        CodingValue.objects.bulk_create(added_values + new_coding_values)
+
+        log.debug("Updated codings of coded article {}: {} added, {} deleted, {} values changed".format(
+            self.id, len(added_codings), len(deleted_coding_ids),
+            len(added_values) + len(changed_values) + len(deleted_value_ids)))
 
-        if any(v.get("intval") is not None and v.get("strval") is not None for v in values):
-            raise ValueError("intval and strval cannot both be not None")
+        return coding_objects + new_coding_objects, value_objects + new_coding_values
 
-        schemas = (self.codingjob.unitschema_id, self.codingjob.articleschema_id)
-        fields = CodingSchemaField.objects.filter(codingschema__id__in=schemas)
-        field_ids = set(fields.values_list("id", flat=True)) | {None}
+    def update_codings(self, coding_dicts):
+        """
+        Like replace_codings, but only writes the differences between the current and
+        the given codings. A new coding replaces an existing one with the same sentence,
+        start and end; of those, only changed values are written. Saving the same codings
+        twice therefore does not touch the database.
 
-        if any(v.get("codingschemafield_id") not in field_ids for v in values):
-            raise ValueError("codingschemafield_id must be in codingjob")
+        @raises: see replace_codings
+        @returns: ([Coding], [CodingValue])
+        """
+        coding_dicts = tuple(coding_dicts)
+        _validate_coding_dicts(coding_dicts, _get_field_ids(self.codingjob))
 
         with transaction.atomic():
-            return self._replace_codings(coding_dicts)
+            return self._update_codings(coding_dicts)
 
     class Meta():
         db_table = 'coded_articles'
@@ -181,3 +274,60 @@ class CodedArticle(models.Model):
         unique_together = ("codingjob", "article")
 
 
+def bulk_replace_codings(codingjob, coding_dicts, check_rules=False):
+    """
+    Replaces the codings of many coded articles of a single codingjob in one
+    transaction. Schema fields are fetched once, existing codings are deleted using
+    a single statement for all coded articles and coding values are inserted using
+    COPY (on postgres).
+
+    @param codingjob: codingjob all coded articles belong to
+    @type codingjob: CodingJob
+    @param coding_dicts: mapping of coded_article_id to an iterator of coding
+                         dictionaries, as described in CodedArticle.replace_codings
+    @type coding_dicts: dict
+    @param check_rules: check codings against the codingrules of the schemas of the
+                        codingjob (see codingruletoolkit.validate_codings)
+    @raises ValueError: see CodedArticle.replace_codings
+    @raises ValueError: a coded article does not belong to codingjob
+    @raises ValidationError: check_rules is True and codings violate codingrules
+    @returns: ([Coding], [CodingValue])
+    """
+    coding_dicts = {int(caid): tuple(cds) for caid, cds in coding_dicts.items()}
+
+    if not coding_dicts:
+        return [], []
+
+    field_ids = _get_field_ids(codingjob)
+    for cds in coding_dicts.values():
+        _validate_coding_dicts(cds, field_ids)
+
+    if check_rules:
+        # codingruletoolkit imports amcat.models, so import lazily
+        from amcat.models.coding.codingruletoolkit import validate_codings
+        validate_codings(codingjob, coding_dicts)
+
+    coded_article_ids = set(coding_dicts)
+    coded_articles = CodedArticle.objects.filter(codingjob=codingjob, id__in=coded_article_ids)
+    if len(coded_articles.values_list("id", flat=True)) != len(coded_article_ids):
+        raise ValueError("coded articles must belong to codingjob")
+
+    with transaction.atomic():
+        values = CodingValue.objects.filter(coding__coded_article__id__in=coded_article_ids)
+        values._raw_delete(values.db)
+        codings = Coding.objects.filter(coded_article__id__in=coded_article_ids)
+        codings._raw_delete(codings.db)
+
+        new_codings = [(caid, cd) for caid, cds in coding_dicts.items() for cd in cds]
+        new_coding_objects = [
+            Coding(coded_article_id=caid, sentence_id=cd.get("sentence_id"),
+                   start=cd.get("start"), end=cd.get("end"))
+            for caid, cd in new_codings
+        ]
+        new_coding_objects = bulk_insert_returning_ids(new_coding_objects) or []
+
+        coding_values = list(itertools.chain.from_iterable(
+            _to_codingvalues(co, cd["values"]) for (_, cd), co in zip(new_codings, new_coding_objects)
+        ))
+
+        return new_coding_objects, copy_insert(coding_values)
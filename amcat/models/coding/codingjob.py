@@ -24,9 +24,17 @@ Coding Jobs are sets of articles assigned to users for manual coding.
 Each codingjob has codingschemas for articles and/or sentences.
 """
 
+import collections
+import itertools
+import json
+
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from amcat.models import CodedArticle, ArticleSet
+from amcat.models import Article, CodedArticle, ArticleSet, ArticleSetArticle
+from amcat.tools.amcates import ES
+from amcat.tools.djangotoolkit import bulk_insert_returning_ids, copy_insert
+from amcat.tools.progress import NullMonitor
 
 from amcat.tools.model import AmcatModel
 from amcat.tools.table import table3
@@ -42,6 +50,7 @@ import logging;
 from amcat.tools.toolkit import splitlist
 
 log = logging.getLogger(__name__)
+stats_log = logging.getLogger("statistics:" + __name__)
 
 class CodingJob(AmcatModel):
     """
@@ -89,24 +98,89 @@ class CodingJob(AmcatModel):
         return self.coded_articles.get(article=article)
 
 
-def _create_codingjob_batches(codingjob, article_ids, batch_size):
-    name = codingjob.name
+def _name_exists(project, name):
+    return (ArticleSet.objects.filter(project=project, name=name).exists() or
+            CodingJob.objects.filter(project=project, name=name).exists())
+
+
+def _get_unique_names(project, names):
+    """
+    Return names not yet used by an articleset or codingjob in project, appending a number
+    if needed (like ArticleSet.get_unique_name). All names are checked in one query per model.
+    """
+    taken = set(ArticleSet.objects.filter(project=project, name__in=names).values_list("name", flat=True))
+    taken |= set(CodingJob.objects.filter(project=project, name__in=names).values_list("name", flat=True))
+
+    unique_names = []
+    for name in names:
+        if name in taken:
+            candidates = ("{name} {i}".format(**locals()) for i in itertools.count())
+            name = next(c for c in candidates if c not in taken and not _name_exists(project, c))
+        taken.add(name)
+        unique_names.append(name)
+    return unique_names
+
 
-    for i, batch in enumerate(splitlist(article_ids, batch_size)):
-        codingjob.pk = None
-        codingjob.name = "{name} - {i}".format(i=i+1, name=name)
-        codingjob.articleset = ArticleSet.create_set(
-            project=codingjob.project,
-            name=codingjob.name,
-            favourite=False,
-            articles=batch,
+def _create_codingjob_batches(codingjob, article_ids, batch_size, monitor=NullMonitor()):
+    """
+    Create a codingjob (and articleset) for each batch of article_ids. All sets, set
+    memberships, codingjobs and coded articles are inserted in bulk within one
+    transaction, which bypasses ArticleSet.save (so the sets do not become favourites),
+    ArticleSet.add_articles and the create_coded_articles signal. Set memberships are
+    added to the index in a single bulk pass afterwards. Each codingjob gets the same
+    name as its set, which is unique in the project.
+
+    @returns: list of codingjob ids
+    """
+    monitor = monitor.submonitor(total=5)
+
+    article_ids = list(collections.OrderedDict.fromkeys(article_ids))
+    existing = set(Article.exists(article_ids))
+    batches = list(splitlist([aid for aid in article_ids if aid in existing], batch_size))
+
+    names = ["{name} - {i}".format(i=i+1, name=codingjob.name) for i in range(len(batches))]
+    names = _get_unique_names(codingjob.project, names)
+    fields = [f.attname for f in CodingJob._meta.concrete_fields if f.attname not in ("id", "name", "articleset_id")]
+    project = codingjob.project
+
+    with transaction.atomic():
+        monitor.update(message="Creating {n} articlesets..".format(n=len(batches)))
+        sets = bulk_insert_returning_ids(
+            ArticleSet(project=project, name=name) for name in names
+        ) or []
+
+        monitor.update(message="Creating {n} codingjobs..".format(n=len(batches)))
+        jobs = bulk_insert_returning_ids(
+            CodingJob(name=name, articleset_id=aset.id, **{f: getattr(codingjob, f) for f in fields})
+            for name, aset in zip(names, sets)
+        ) or []
+
+        monitor.update(message="Adding articles to articlesets and codingjobs..")
+        copy_insert(
+            ArticleSetArticle(articleset_id=aset.id, article_id=aid)
+            for aset, batch in zip(sets, batches) for aid in batch
         )
+        copy_insert(
+            CodedArticle(codingjob_id=job.id, article_id=aid)
+            for job, batch in zip(jobs, batches) for aid in batch
+        )
+
+    # ArticleSet.save is bypassed, so log the new sets like it does
+    for name, aset in zip(names, sets):
+        stats_log.info(json.dumps({
+            "action": "articleset_added", "id": aset.id,
+            "name": name, "project_id": project.id,
+            "project__name": project.name
+        }))
+
+    monitor.update(message="Adding articles to index..")
+    ES().add_to_sets({aset.id: batch for aset, batch in zip(sets, batches)}, monitor=monitor)
+    ES().refresh()
 
-        codingjob.save()
-        yield codingjob.pk
+    return [job.id for job in jobs]
 
 
-def create_codingjob_batches(codingjob, article_ids, batch_size):
+def create_codingjob_batches(codingjob, article_ids, batch_size, monitor=NullMonitor()):
     """
     Split article_ids in batches of of 'batch_size', and create a codingjob
     for each batch.
@@ -115,8 +189,9 @@ def create_codingjob_batches(codingjob, article_ids, batch_size):
     @type codingjob: CodingJob
     @type article_ids: [int]
     @type batch_size: int
+    @type monitor: ProgressMonitor
     """
-    codingjob_ids = _create_codingjob_batches(codingjob, article_ids, batch_size)
+    codingjob_ids = _create_codingjob_batches(codingjob, article_ids, batch_size, monitor=monitor)
     return CodingJob.objects.filter(id__in=codingjob_ids)
 
 
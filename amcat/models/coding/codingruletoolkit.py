@@ -19,7 +19,11 @@
 
 
 import ast
+import collections
+import functools
 import json
+import logging
+import operator
 
 from amcat.models import CodingSchemaField, Code, CodingRule
 from amcat.models.coding.serialiser import IntSerialiser, QualitySerialiser, IntervalSerialiser
@@ -52,9 +56,20 @@ AST_MAP = {
 
 __all__ = (
     "OR", "AND", "NOT", "EQUALS", "NOT_EQUALS", "parse",
-    "walk", "is_valid", "clean_tree"
+    "walk", "is_valid", "clean_tree", "CompiledRules", "compile_rules",
+    "get_compiled_rules", "validate_codings"
 )
 
+log = logging.getLogger(__name__)
+
+# Number of compiled rule sets kept in memory by get_compiled_rules
+COMPILED_RULES_CACHE_SIZE = 128
+
+# Labels of CodingRuleActions with a meaning for validation
+ACTION_RED = "display red"
+ACTION_NOT_CODABLE = "not codable"
+ACTION_NOT_NULL = "not null"
+
 
 def walk(node):
     """Yields all descendants of `node` plus itself.
@@ -68,7 +83,20 @@ def walk(node):
         for node in w: yield node
 
 
-def resolve_operands(node):
+def _get_object(model, pk, cache=None):
+    """Get object from the cache used while parsing (see parse), or from the database"""
+    if cache is None:
+        return model.objects.get(id=pk)
+
+    objects = cache.setdefault(model, {})
+    try:
+        return objects[pk]
+    except KeyError:
+        objects[pk] = obj = model.objects.get(id=pk)
+        return obj
+
+
+def resolve_operands(node, _cache=None):
     """Resolve types of operands of one of EQUALS / NOT_EQUALS"""
     left, right = node.left, node.comparators[0]
     operator = node.ops[0]
@@ -85,7 +113,7 @@ def resolve_operands(node):
         value = right.s
 
     # Check if type of right operand seems to match the type requested by its serialiser
-    schemafield = CodingSchemaField.objects.get(id=left.n)
+    schemafield = _get_object(CodingSchemaField, left.n, _cache)
     serialiser = schemafield.serialiser
 
     if (not isinstance(serialiser, (IntervalSerialiser, IntSerialiser, QualitySerialiser))
@@ -100,26 +128,26 @@ def resolve_operands(node):
     return schemafield, serialiser.deserialise(value)
 
 
-def parse_node(node, _seen=()):
+def parse_node(node, _seen=(), _cache=None):
     if isinstance(node, ast.BoolOp):
         # and .. or
         return {
             "type": OR if isinstance(node.op, ast.Or) else AND,
-            "values": tuple(parse_node(n, _seen) for n in node.values),
+            "values": tuple(parse_node(n, _seen, _cache) for n in node.values),
         }
     if isinstance(node, ast.Compare):
         return {
             "type": AST_MAP[node.ops[0].__class__],
-            "values": resolve_operands(node)
+            "values": resolve_operands(node, _cache)
         }
     if isinstance(node, ast.Num):
-        return parse(CodingRule.objects.get(id=node.n), _seen)
+        return parse(_get_object(CodingRule, node.n, _cache), _seen, _cache)
     if isinstance(node, ast.Str):
         raise SyntaxError("invalid syntax (col {}, line {})".format(node.col_offset, node.lineno))
     if isinstance(node, ast.Expr):
-        return parse_node(node.value, _seen)
+        return parse_node(node.value, _seen, _cache)
     if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
-        return dict(type=NOT, value=parse_node(node.operand, _seen))
+        return dict(type=NOT, value=parse_node(node.operand, _seen, _cache))
     if isinstance(node, ast.Tuple):
         # We can ignore an empty tuple
         if not node.elts: return None
@@ -127,7 +155,7 @@ def parse_node(node, _seen=()):
     raise SyntaxError("Unknown node (col {}, line {})".format(node.col_offset, node.lineno))
 
 
-def parse(codingrule, _seen=()):
+def parse(codingrule, _seen=(), _cache=None):
     """
     Parse a condition of a codingrule. Returns a dictionary with the first node of the
     AST generated from `codingrule.condition`.
@@ -143,6 +171,10 @@ def parse(codingrule, _seen=()):
 
     All CodingRule's will be replaced be their condition and parsed.
 
+    If _cache is given, it should be a dictionary which is used to look up (and store)
+    CodingSchemaFields and CodingRules by model and id, instead of querying them for
+    each operand.
+
     @raises: SyntaxError, CodingSchemaField.DoesNotExist, Code.DoesNotExist
     @returns: root of tree, or None if condition is empty
     """
@@ -160,15 +192,18 @@ def parse(codingrule, _seen=()):
                 raise SyntaxError("invalid syntax (col {}, line {})".format(node.col_offset, node.lineno))
             raise SyntaxError("invalid syntax")
 
-    return parse_node(tree, _seen=_seen + (codingrule,))
+    return parse_node(tree, _seen=_seen + (codingrule,), _cache=_cache)
 
 
-def clean_tree(codingschema, tree):
+def clean_tree(codingschema, tree, fields=None):
     """
     Checks if this tree is valid by checking if given values are valid for
     this schemafield.
+
+    @param fields: fields of codingschema, queried if not given
     """
-    fields = set(codingschema.fields.all())
+    if fields is None:
+        fields = set(codingschema.fields.all())
     nodes = [n for n in walk(tree) if (isinstance(n, dict) and n["type"] in (EQUALS, NOT_EQUALS))]
 
     for node in nodes:
@@ -182,10 +217,10 @@ def clean_tree(codingschema, tree):
             raise ValidationError("Value {} not in possible values".format(value))
 
 
-def is_valid(codingschema, tree):
+def is_valid(codingschema, tree, fields=None):
     """True if tree is valid, else False."""
     try:
-        clean_tree(codingschema, tree)
+        clean_tree(codingschema, tree, fields)
     except ValidationError:
         return False
     return True
@@ -194,10 +229,13 @@ def is_valid(codingschema, tree):
 def schemarules_valid(schema):
     """Checks whether all codingrules of `codingschema` are valid"""
     try:
-        return all(is_valid(schema, parse(rule)) for rule in schema.rules.all())
+        compiled = get_compiled_rules(schema)
     except (SyntaxError, Code.DoesNotExist, CodingRule.DoesNotExist, CodingSchemaField.DoesNotExist):
         return False
 
+    fields = set(schema.fields.all())
+    return all(is_valid(schema, rule.tree, fields) for rule in compiled.rules)
+
 
 def _to_json(node):
     if isinstance(node, dict):
@@ -207,7 +245,7 @@ def _to_json(node):
         if "value" in node:
             node["value"] = _to_json(node["value"])
         else:
-            node["values"] = map(_to_json, node["values"])
+            node["values"] = list(map(_to_json, node["values"]))
 
         return node
     elif isinstance(node, Code):
@@ -231,3 +269,245 @@ def to_json(node, serialise=True):
     if serialise:
         return json.dumps(_to_json(node))
     return _to_json(node)
+
+
+###########################################################################
+#                        C O M P I L E D   R U L E S                      #
+###########################################################################
+
+# A compiled condition is a program in postfix notation: a tuple of instructions which
+# push a column of booleans (one per coding) on a stack, or combine the topmost columns:
+#
+#   (CMP, field_id, operator, value)  compare (serialised) coded values with value
+#   (NOT,)                            negate topmost column
+#   (AND, n) / (OR, n)                combine the n topmost columns
+#   (TRUE,)                           empty condition, which always applies
+CMP = "CMP"
+TRUE = "TRUE"
+
+OPERATORS = {
+    EQUALS: operator.eq, NOT_EQUALS: operator.ne,
+    GREATER_THAN: operator.gt, LESSER_THAN: operator.lt,
+    GREATER_THAN_OR_EQUAL_TO: operator.ge, LESSER_THAN_OR_EQUAL_TO: operator.le
+}
+
+CompiledRule = collections.namedtuple("CompiledRule", ["id", "label", "field_id", "action", "tree", "program"])
+
+
+def _compile_node(node, program):
+    if node is None:
+        program.append((TRUE,))
+    elif node["type"] == NOT:
+        _compile_node(node["value"], program)
+        program.append((NOT,))
+    elif node["type"] in (AND, OR):
+        for value in node["values"]:
+            _compile_node(value, program)
+        program.append((node["type"], len(node["values"])))
+    else:
+        schemafield, value = node["values"]
+        program.append((CMP, schemafield.id, node["type"], schemafield.serialiser.serialise(value)))
+    return program
+
+
+def _compare(op, column, value):
+    """Compare each coded value in column with value. Missing values are only unequal."""
+    func = OPERATORS[op]
+    if op == NOT_EQUALS:
+        return [v is None or func(v, value) for v in column]
+    return [v is not None and func(v, value) for v in column]
+
+
+class CompiledRules(object):
+    """
+    The codingrules of a codingschema, parsed once and compiled into flat programs
+    which can be evaluated for many codings at once.
+
+    @ivar rules: tuple of CompiledRule objects, ordered by id
+    @ivar fields: mapping field_id -> CodingSchemaField of all fields used in conditions
+    @ivar dependencies: mapping field_id -> tuple of indices in rules of which the
+                        condition depends on the value of that field
+    """
+    def __init__(self, rules, fields):
+        self.rules = tuple(rules)
+        self.fields = fields
+
+        dependencies = collections.defaultdict(list)
+        for i, rule in enumerate(self.rules):
+            for field_id in sorted({instr[1] for instr in rule.program if instr[0] == CMP}):
+                dependencies[field_id].append(i)
+        self.dependencies = {field_id: tuple(rules) for field_id, rules in dependencies.items()}
+
+    def __len__(self):
+        return len(self.rules)
+
+    def get_affected_rules(self, field_ids):
+        """Return the rules of which the outcome might change if the given fields change"""
+        indices = set()
+        for field_id in field_ids:
+            indices.update(self.dependencies.get(field_id, ()))
+        return [self.rules[i] for i in sorted(indices)]
+
+    def evaluate(self, codings, rules=None):
+        """
+        Evaluate rules for each of the given codings.
+
+        @param codings: sequence of mappings field_id -> serialised value (intval or strval)
+        @param rules: rules to evaluate, defaults to all rules
+        @return: mapping rule_id -> list of booleans, one for each coding
+        """
+        codings = list(codings)
+        rules = self.rules if rules is None else rules
+
+        # Columns are built once, and shared between rules
+        columns = {}
+        def get_column(field_id):
+            try:
+                return columns[field_id]
+            except KeyError:
+                columns[field_id] = column = [c.get(field_id) for c in codings]
+                return column
+
+        return {rule.id: self._evaluate_program(rule.program, get_column, len(codings)) for rule in rules}
+
+    @staticmethod
+    def _evaluate_program(program, get_column, n):
+        stack = []
+        for instruction in program:
+            op = instruction[0]
+            if op == CMP:
+                _, field_id, cmp, value = instruction
+                stack.append(_compare(cmp, get_column(field_id), value))
+            elif op == NOT:
+                stack.append([not v for v in stack.pop()])
+            elif op in (AND, OR):
+                columns = stack[-instruction[1]:]
+                del stack[-instruction[1]:]
+                stack.append(list(map(all if op == AND else any, zip(*columns))))
+            elif op == TRUE:
+                stack.append([True] * n)
+        return stack.pop()
+
+    def validate(self, codings):
+        """
+        Check the actions of all rules applying to each of the given codings:
+
+         - 'not null': the field of the rule must be coded
+         - 'not codable': the field of the rule must not be coded
+         - 'display red': the coding is invalid
+
+        @param codings: see evaluate
+        @return: list of (coding_index, rule) tuples for each violated rule
+        """
+        codings = list(codings)
+        rules = [r for r in self.rules if r.action in (ACTION_RED, ACTION_NOT_CODABLE, ACTION_NOT_NULL)]
+        results = self.evaluate(codings, rules)
+
+        violations = []
+        for rule in rules:
+            for i, applies in enumerate(results[rule.id]):
+                if not applies:
+                    continue
+                value = codings[i].get(rule.field_id)
+                if (rule.action == ACTION_RED
+                        or (rule.action == ACTION_NOT_NULL and value is None)
+                        or (rule.action == ACTION_NOT_CODABLE and value is not None)):
+                    violations.append((i, rule))
+        return sorted(violations, key=lambda v: (v[0], v[1].id))
+
+    def get_dependencies_json(self):
+        """Return dependencies as mapping field_id -> list of rule ids"""
+        return {field_id: [self.rules[i].id for i in indices]
+                for (field_id, indices) in self.dependencies.items()}
+
+
+def compile_rules(codingschema):
+    """
+    Parse and compile all codingrules of codingschema. All fields of the schema are
+    fetched at once, so parsing does not query the database for each operand.
+
+    @raises: see parse
+    @rtype: CompiledRules
+    """
+    cache = {
+        CodingSchemaField: {f.id: f for f in codingschema.fields.select_related("fieldtype")},
+        CodingRule: {}
+    }
+
+    rules = list(codingschema.rules.select_related("action").order_by("id"))
+    cache[CodingRule].update((r.id, r) for r in rules)
+
+    compiled = []
+    for rule in rules:
+        tree = parse(rule, _cache=cache)
+        program = tuple(_compile_node(tree, []))
+        action = rule.action.label if rule.action_id is not None else None
+        compiled.append(CompiledRule(rule.id, rule.label, rule.field_id, action, tree, program))
+
+    fields = {instr[1]: cache[CodingSchemaField][instr[1]]
+              for rule in compiled for instr in rule.program if instr[0] == CMP}
+    return CompiledRules(compiled, fields)
+
+
+@functools.lru_cache(maxsize=COMPILED_RULES_CACHE_SIZE)
+def _get_compiled_rules(codingschema_id, version):
+    from amcat.models import CodingSchema
+    log.debug("Compiling codingrules of codingschema {codingschema_id}".format(**locals()))
+    return compile_rules(CodingSchema.objects.get(id=codingschema_id))
+
+
+def get_schema_version(codingschema):
+    """
+    Return a value that changes whenever the rules or fields of codingschema change.
+    Conditions referring to rules of other schemas are not taken into account.
+    """
+    rules = codingschema.rules.order_by("id").values_list("id", "condition", "field_id", "action_id")
+    fields = codingschema.fields.order_by("id").values_list("id", "fieldtype_id", "codebook_id")
+    return tuple(rules), tuple(fields)
+
+
+def get_compiled_rules(codingschema):
+    """
+    Return compiled rules of codingschema, which are compiled once per version of
+    the schema (see get_schema_version).
+
+    @raises: see parse
+    @rtype: CompiledRules
+    """
+    return _get_compiled_rules(codingschema.id, get_schema_version(codingschema))
+
+
+def _get_coded_values(coding_dict):
+    return {v["codingschemafield_id"]: v.get("intval") if v.get("intval") is not None else v.get("strval")
+            for v in coding_dict["values"]}
+
+
+def validate_codings(codingjob, coding_dicts):
+    """
+    Check the given codings against the codingrules of the schemas of codingjob. The
+    codingrules of the articleschema are applied to article codings (without sentence),
+    those of the unitschema to sentence codings. Codings for which the codingjob has no
+    schema are not checked.
+
+    @param coding_dicts: mapping coded_article_id -> list of coding dicts (see
+                         CodedArticle.replace_codings)
+    @raises: ValidationError listing all violated rules
+    """
+    article_codings, sentence_codings = [], []
+    for coded_article_id, codings in coding_dicts.items():
+        for coding in codings:
+            target = sentence_codings if coding.get("sentence_id") is not None else article_codings
+            target.append((coded_article_id, coding))
+
+    errors = []
+    for schema, codings in ((codingjob.articleschema, article_codings), (codingjob.unitschema, sentence_codings)):
+        if schema is None or not codings:
+            continue
+        compiled = get_compiled_rules(schema)
+        for i, rule in compiled.validate([_get_coded_values(c) for (_, c) in codings]):
+            coded_article_id, coding = codings[i]
+            errors.append("Coded article {coded_article_id}: coding violates rule {rule.label!r} ({rule.action})"
+                          .format(**locals()))
+
+    if errors:
+        raise ValidationError(errors)
@@ -174,8 +174,8 @@ class _CodebookSerialiser(BaseSerialiser):
         try:
             return self._codebook
         except AttributeError:
-            self._codebook = list(Codebook.objects.filter(pk=self.field.codebook_id)
-                                  .prefetch_related("codebookcode_set"))[0]
+            self._codebook = Codebook.objects.get(pk=self.field.codebook_id)
+            self._codebook.cache()
             return self._codebook
 
     def deserialise(self, value):
@@ -204,7 +204,7 @@ class _CodebookSerialiser(BaseSerialiser):
 
     def _get_ancestor(self, value, i, label=False):
         try:
-            ancestors = list(self.field.codebook.get_ancestor_ids(value))
+            ancestors = self.codebook.get_ancestor_ids(value)
         except (KeyError, ValueError):
             log.exception("Error on getting ancestors for {value}".format(**locals()))
             return None
@@ -218,6 +218,36 @@ class TestCodebook(amcattest.AmCATTestCase):
         B = amcattest.create_test_codebook(name="B")
         B.add_code(f, b)
 
+    def test_get_index(self):
+        a, b, c, d, e, f = [amcattest.create_test_code(label=l) for l in "abcdef"]
+        A = amcattest.create_test_codebook(name="A")
+        A.add_code(a)
+        A.add_code(b)
+        A.add_code(c, b)
+        A.add_code(d, c)
+        A.add_code(e, a)
+        A.add_code(f, a, hide=True)
+
+        index = A.get_index()
+        self.assertEqual(index.root_ids, [a.id, b.id])
+        self.assertEqual(index.get_ancestor_ids(d.id), (d.id, c.id, b.id))
+        self.assertEqual(index.get_depth(d.id), 2)
+        self.assertEqual(index.get_descendant_ids(b.id), (b.id, c.id, d.id))
+        self.assertTrue(index.is_descendant(d.id, b.id))
+        self.assertFalse(index.is_descendant(b.id, d.id))
+        self.assertFalse(index.is_descendant(e.id, b.id))
+        self.assertNotIn(f.id, index)
+        self.assertIn(f.id, A.get_index(include_hidden=True))
+
+        # Index is reused for cached codebooks, until the codebook changes
+        A.cache()
+        self.assertIs(A.get_index(), A.get_index())
+        index = A.get_index()
+        g = amcattest.create_test_code(label="g")
+        A.add_code(g, d)
+        self.assertIsNot(A.get_index(), index)
+        self.assertEqual(A.get_index().get_ancestor_ids(g.id), (g.id, d.id, c.id, b.id))
+
     @amcattest.require_postgres
     def test_caching_correctness(self):
         """
@@ -19,6 +19,8 @@
 from django.db.utils import IntegrityError
 from amcat.models import CodedArticleStatus, STATUS_NOTSTARTED, STATUS_INPROGRESS, STATUS_COMPLETE, \
     STATUS_IRRELEVANT, CodedArticle
+from amcat.models.coding.codedarticle import bulk_replace_codings
+from amcat.tools.djangotoolkit import list_queries
 
 from amcat.tools import amcattest
 
@@ -102,6 +104,66 @@ class TestCodedArticle(amcattest.AmCATTestCase):
         self.assertEqual(value.strval, "a")
         self.assertEqual(value.intval, None)
 
+    def test_update_codings(self):
+        schema, codebook, strf, intf, codef, _, _ = amcattest.create_test_schema_with_fields(isarticleschema=True)
+        codingjob = amcattest.create_test_job(articleschema=schema, narticles=1)
+        coded_article = CodedArticle.objects.get(codingjob=codingjob)
+        sentence = amcattest.create_test_sentence()
+
+        article_coding = self._get_coding_dict(intval=1, field_id=intf.id)
+        sentence_coding = self._get_coding_dict(sentence_id=sentence.id, strval="a", field_id=strf.id)
+        codings, values = coded_article.update_codings([article_coding, sentence_coding])
+        self.assertEqual((len(codings), len(values)), (2, 2))
+        coding_ids = {c.id for c in codings}
+
+        # Saving the same codings again should not write anything
+        with list_queries() as queries:
+            coded_article.update_codings([article_coding, sentence_coding])
+        self.assertFalse([q for q in queries if q["sql"].split()[0] in ("INSERT", "UPDATE", "DELETE")])
+
+        # Changing a value keeps the coding, removing a coding deletes it
+        article_coding["values"][0]["intval"] = 2
+        article_coding["values"].append({"codingschemafield_id": strf.id, "intval": None, "strval": "b"})
+        codings, values = coded_article.update_codings([article_coding])
+        self.assertEqual([c.id for c in codings], [c.id for c in coded_article.codings.all()])
+        self.assertIn(codings[0].id, coding_ids)
+        self.assertEqual({(v.intval, v.strval) for v in codings[0].values.all()}, {(2, None), (None, "b")})
+        self.assertEqual(len(values), 2)
+
+    def test_bulk_replace_codings(self):
+        schema, codebook, strf, intf, codef, _, _ = amcattest.create_test_schema_with_fields(isarticleschema=True)
+        schema2, codebook2, strf2, intf2, codef2, _, _ = amcattest.create_test_schema_with_fields(isarticleschema=True)
+        codingjob = amcattest.create_test_job(articleschema=schema, narticles=3)
+        ca1, ca2, ca3 = codingjob.coded_articles.all().order_by("id")
+
+        ca3.replace_codings([self._get_coding_dict(intval=3, field_id=intf.id)])
+
+        codings, values = bulk_replace_codings(codingjob, {
+            ca1.id: [self._get_coding_dict(intval=10, field_id=codef.id)],
+            ca2.id: [self._get_coding_dict(strval="a", field_id=strf.id),
+                     self._get_coding_dict(intval=12, field_id=intf.id)],
+        })
+        self.assertEqual(3, len(codings))
+        self.assertEqual(3, len(values))
+
+        self.assertEqual([10], [v.intval for c in ca1.codings.all() for v in c.values.all()])
+        self.assertEqual({"a", 12}, {v.value for c in ca2.codings.all() for v in c.values.all()})
+
+        # Other coded articles remain untouched
+        self.assertEqual([3], [v.intval for c in ca3.codings.all() for v in c.values.all()])
+
+        # Overwrite previous codings
+        bulk_replace_codings(codingjob, {ca1.id: [], ca2.id: [self._get_coding_dict(intval=13, field_id=intf.id)]})
+        self.assertEqual(0, ca1.codings.count())
+        self.assertEqual([13], [v.intval for c in ca2.codings.all() for v in c.values.all()])
+
+        # Illegal values and coded articles
+        illval = self._get_coding_dict(intval=1, field_id=strf2.id)
+        self.assertRaises(ValueError, bulk_replace_codings, codingjob, {ca1.id: [illval]})
+
+        other = amcattest.create_test_coded_article()
+        self.assertRaises(ValueError, bulk_replace_codings, codingjob, {other.id: []})
+
 
 class TestCodedArticleStatus(amcattest.AmCATTestCase):
     def test_status(self):
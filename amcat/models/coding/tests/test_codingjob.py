@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU Affero General Public        #
 # License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
-from amcat.models import CodedArticle, CodingJob, create_codingjob_batches
+from amcat.models import ArticleSet, CodedArticle, CodingJob, create_codingjob_batches
 from amcat.tools import amcattest
 
 class TestCodingJob(amcattest.AmCATTestCase):
@@ -36,6 +36,7 @@ class TestCodingJob(amcattest.AmCATTestCase):
         job = amcattest.create_test_job(10)
         self.assertEqual(CodedArticle.objects.filter(codingjob=job).count(), 10)
 
+    @amcattest.use_elastic
     def test_create_codingjob_batches(self):
         a = amcattest.create_test_set(10)
 
@@ -55,4 +56,18 @@ class TestCodingJob(amcattest.AmCATTestCase):
         cjs = create_codingjob_batches(cj, arts, 3)
         self.assertEqual(4, len(cjs))
 
+        # Sets, codingjobs and coded articles are created for each batch
+        for cj in cjs:
+            self.assertFalse(cj.articleset in cj.project.favourite_articlesets.all())
+            aids = cj.articleset.get_article_ids()
+            self.assertEqual(aids, set(cj.coded_articles.values_list("article_id", flat=True)))
+            self.assertEqual(aids, cj.articleset.get_article_ids_from_elastic())
+        self.assertEqual(set(arts), set.union(*(cj.articleset.get_article_ids() for cj in cjs)))
+        self.assertEqual(4, len({cj.articleset.name for cj in cjs}))
+        self.assertTrue(all(cj.name == cj.articleset.name for cj in cjs))
 
+
+        # Names of new jobs and sets do not clash with existing ones
+        names = list(CodingJob.objects.filter(project=a.project).values_list("name", flat=True))
+        self.assertEqual(9, len(set(names)))
+        self.assertEqual(9, len(set(ArticleSet.objects.filter(project=a.project, name__in=names).values_list("name", flat=True))))
@@ -0,0 +1,70 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+from django.core import exceptions
+
+from amcat.models import CodingRule, CodingRuleAction
+from amcat.models.coding.codingruletoolkit import compile_rules, get_compiled_rules, validate_codings
+from amcat.tools import amcattest
+
+
+class TestCompiledRules(amcattest.AmCATTestCase):
+    def test_compile_rules(self):
+        schema, codebook, text_field, number_field, code_field, _, _ = amcattest.create_test_schema_with_fields()
+        code = codebook.codes[0]
+        not_null = CodingRuleAction.objects.get(label="not null")
+        red = CodingRuleAction.objects.get(label="display red")
+
+        r1 = CodingRule.objects.create(codingschema=schema, label="r1", field=text_field, action=not_null,
+                                       condition="{} == {}".format(code_field.id, code.id))
+        r2 = CodingRule.objects.create(codingschema=schema, label="r2", field=number_field, action=red,
+                                       condition="not {} or {} > 5".format(r1.id, number_field.id))
+        r3 = CodingRule.objects.create(codingschema=schema, label="r3", condition="()")
+
+        compiled = compile_rules(schema)
+
+        self.assertEqual([r.id for r in compiled.rules], [r1.id, r2.id, r3.id])
+        self.assertEqual(compiled.dependencies, {code_field.id: (0, 1), number_field.id: (1,)})
+        self.assertEqual([r.id for r in compiled.get_affected_rules([number_field.id])], [r2.id])
+
+        codings = [{code_field.id: code.id}, {code_field.id: code.id, text_field.id: "a", number_field.id: 6}, {}]
+        self.assertEqual(compiled.evaluate(codings), {
+            r1.id: [True, True, False], r2.id: [False, True, True], r3.id: [True, True, True]
+        })
+        self.assertEqual([(i, r.id) for (i, r) in compiled.validate(codings)],
+                         [(0, r1.id), (1, r2.id), (2, r2.id)])
+
+        # Compiled rules are reused until the rules of the schema change
+        self.assertIs(get_compiled_rules(schema), get_compiled_rules(schema))
+        r3.condition = "{} == 'a'".format(text_field.id)
+        r3.save()
+        self.assertEqual(get_compiled_rules(schema).evaluate(codings)[r3.id], [False, True, False])
+
+    def test_validate_codings(self):
+        schema, codebook, text_field, number_field, code_field, _, _ = amcattest.create_test_schema_with_fields(
+            isarticleschema=True)
+        not_null = CodingRuleAction.objects.get(label="not null")
+        CodingRule.objects.create(codingschema=schema, label="r1", field=text_field, action=not_null, condition="()")
+
+        # Without unitschema, sentence codings are not checked
+        job = amcattest.create_test_job(articleschema=schema, unitschema=None)
+        coded_article = job.coded_articles.get()
+        value = {"codingschemafield_id": number_field.id, "intval": 1}
+        validate_codings(job, {coded_article.id: [{"sentence_id": 1, "values": [value]}]})
+
+        self.assertRaises(exceptions.ValidationError, validate_codings, job, {coded_article.id: [{"values": [value]}]})
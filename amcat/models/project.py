@@ -26,17 +26,17 @@ from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.db import models
 from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from typing import Union, Set
 
 import amcat.models
-from amcat.models import ProjectRole
 from amcat.tools.model import AmcatModel
 from amcat.models.coding.codebook import Codebook
 from amcat.models.coding.codingschema import CodingSchema
 from amcat.models.article import Article
 from amcat.models.articleset import ArticleSetArticle, ArticleSet
 
-from amcat.models.authorisation import Role, ROLE_PROJECT_READER
+from amcat.models.authorisation import Role, ROLE_PROJECT_READER, get_resolver, invalidate_resolvers
 from amcat.tools.validators import DictValidator
 
 LITTER_PROJECT_ID = 1
@@ -160,41 +160,23 @@ class Project(AmcatModel):
         @param role: a role instance, ID, or label
         @param user: a user object
         """
-        if user.is_superuser:
-            return True
-
-        if isinstance(role, str):
-            role_id = Role.objects.get(label=role).id
-        elif isinstance(role, Role):
-            role_id = role.id
-        else:
-            role_id = role
-
-        actual_role_id = self.get_role_id(user=user)
-
-        log.info("{user.id}:{user.username} has role {actual_role_id} on project {self}, >=? {role_id}"
-                 .format(**locals()))
-
-        return actual_role_id is not None and actual_role_id >= role_id
+        return get_resolver(user).has_role(self, role)
 
     def get_role_id(self, user=None):
         """
         Return the role id that this user has, by his own right or as guest
         If user is None, returns the guest role id
         """
-        project_role = None
-        guest_role = self.guest_role_id
-
-        if user and not user.is_anonymous():
-            try:
-                project_role = self.projectrole_set.get(user=user).role_id
-            except ProjectRole.DoesNotExist:
-                pass
-
-        # int > None is removed in python3, so avoid direct comparison
-        if project_role is None: return guest_role
-        if guest_role is None: return project_role
-        return max(project_role, guest_role)
+        return get_resolver(user).get_role_id(self)
+
+
+# Guest roles and the projects a set belongs to determine permissions, see PermissionResolver
+post_save.connect(invalidate_resolvers, sender=Project, dispatch_uid="permission-resolver-project")
+post_delete.connect(invalidate_resolvers, sender=Project, dispatch_uid="permission-resolver-project")
+post_save.connect(invalidate_resolvers, sender=ArticleSet, dispatch_uid="permission-resolver-articleset")
+post_delete.connect(invalidate_resolvers, sender=ArticleSet, dispatch_uid="permission-resolver-articleset")
+m2m_changed.connect(invalidate_resolvers, sender=Project.articlesets.through,
+                    dispatch_uid="permission-resolver-project-articlesets")
 
 
 class RecentProject(AmcatModel):
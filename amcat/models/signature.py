@@ -0,0 +1,341 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+"""
+Persisted MinHash signatures and LSH band buckets of articles, used to find near-duplicate
+articles without comparing all pairs (see amcat.tools.minhash). Signatures are computed
+once per article, so finding near-duplicates in (or between) sets only needs to process
+articles that were not signed before.
+
+This module also keeps a Bloom filter of all article hashes, so uploads only need to query
+the database for hashes that probably exist (see find_exact_duplicates).
+"""
+
+import logging
+import threading
+
+from django.db import models, connection
+
+from amcat.tools import minhash
+from amcat.tools.bloom import BloomFilter
+from amcat.tools.toolkit import splitlist
+
+log = logging.getLogger(__name__)
+
+__all__ = ["ArticleSignature", "DuplicateFilter", "ArticleSignatureBand"]
+
+HASH_FILTER_NAME = "articles.hash.digest"
+
+# The hash filter is sized for twice the number of articles, but at least this number
+HASH_FILTER_MIN_CAPACITY = 1000000
+HASH_FILTER_ERROR_RATE = 0.001
+
+
+class ArticleSignature(models.Model):
+    """MinHash signature of an article (None if the article contains no words)"""
+    article = models.OneToOneField("amcat.Article", primary_key=True, db_column="article_id",
+                                   related_name="+", on_delete=models.CASCADE)
+    version = models.SmallIntegerField()
+    signature = models.BinaryField(null=True)
+
+    class Meta():
+        app_label = 'amcat'
+        db_table = 'articles_signatures'
+
+
+class DuplicateFilter(models.Model):
+    """Stored Bloom filter containing a value for all articles up to (and including) watermark"""
+    name = models.CharField(max_length=100, primary_key=True)
+    watermark = models.IntegerField()
+    data = models.BinaryField()
+
+    class Meta():
+        app_label = 'amcat'
+        db_table = 'articles_duplicate_filters'
+
+
+class ArticleSignatureBand(models.Model):
+    """LSH bucket of one band of the signature of an article"""
+    id = models.AutoField(primary_key=True, db_column="signature_band_id")
+    article = models.ForeignKey("amcat.Article", related_name="+", on_delete=models.CASCADE)
+    band = models.SmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta():
+        app_label = 'amcat'
+        db_table = 'articles_signatures_bands'
+        index_together = [("band", "bucket")]
+
+
+def _get_text(title, text):
+    return "\n\n".join(s for s in (title, text) if s)
+
+
+def update_signatures(article_ids, batch_size=1000):
+    """
+    Compute and store signatures for all given articles which have no (current) signature.
+
+    @param article_ids: iterable of article ids (consumed in batches)
+    @returns: number of signatures computed
+    """
+    from amcat.models import Article
+    n = 0
+    for batch in splitlist(article_ids, itemsperbatch=batch_size):
+        current = set(ArticleSignature.objects.filter(article_id__in=batch, version=minhash.SIGNATURE_VERSION)
+                      .values_list("article_id", flat=True))
+        todo = [aid for aid in batch if aid not in current]
+        if not todo:
+            continue
+
+        articles = Article.objects.filter(pk__in=todo).values_list("pk", "title", "text")
+        n += save_signatures({aid: get_article_signature(title, text) for (aid, title, text) in articles})
+        log.debug("Computed {} signatures".format(n))
+    return n
+
+
+def get_article_signature(title, text):
+    """Return the MinHash signature of an article with the given title and text (or None)"""
+    return minhash.get_signature(_get_text(title, text))
+
+
+def save_signatures(signatures):
+    """
+    Store the given signatures, replacing any existing signatures of these articles
+
+    @param signatures: mapping of article id -> signature (or None if the article has no words)
+    @returns: number of signatures stored
+    """
+    rows, bands = [], []
+    for aid, signature in signatures.items():
+        data = None if signature is None else minhash.pack(signature)
+        rows.append(ArticleSignature(article_id=aid, version=minhash.SIGNATURE_VERSION, signature=data))
+        if signature is not None:
+            bands.extend(ArticleSignatureBand(article_id=aid, band=band, bucket=bucket)
+                         for (band, bucket) in minhash.get_bands(signature))
+
+    ArticleSignature.objects.filter(article_id__in=signatures.keys()).delete()
+    ArticleSignatureBand.objects.filter(article_id__in=signatures.keys()).delete()
+    ArticleSignature.objects.bulk_create(rows)
+    ArticleSignatureBand.objects.bulk_create(bands)
+    return len(rows)
+
+
+def get_signatures(article_ids):
+    """Return a mapping of article id -> signature (tuple) for the signed articles in article_ids"""
+    signatures = (ArticleSignature.objects.filter(article_id__in=article_ids, signature__isnull=False)
+                  .values_list("article_id", "signature"))
+    return {aid: minhash.unpack(signature) for (aid, signature) in signatures}
+
+
+def get_candidate_pairs(articleset_id, other_articleset_id=None, batch_size=10000):
+    """
+    Yield lists of (article_id, other_article_id) pairs that share at least one LSH bucket.
+    If other_articleset_id is None, pairs within articleset_id are returned (with article_id
+    smaller than other_article_id). Otherwise, article_id is in articleset_id and
+    other_article_id is a different article in other_articleset_id.
+    """
+    if other_articleset_id is None:
+        other_articleset_id, order = articleset_id, "<"
+    else:
+        order = "<>"
+
+    sql = """SELECT DISTINCT a.article_id, b.article_id
+             FROM articles_signatures_bands a
+             INNER JOIN articles_signatures_bands b
+                 ON a.band = b.band AND a.bucket = b.bucket AND a.article_id {order} b.article_id
+             INNER JOIN articlesets_articles sa ON sa.article_id = a.article_id AND sa.articleset_id = %s
+             INNER JOIN articlesets_articles sb ON sb.article_id = b.article_id AND sb.articleset_id = %s
+          """.format(order=order)
+
+    with connection.cursor() as c:
+        c.execute(sql, [articleset_id, other_articleset_id])
+        while True:
+            pairs = c.fetchmany(batch_size)
+            if not pairs:
+                break
+            yield pairs
+
+
+def get_near_duplicate_pairs(articleset_id, other_articleset_id=None, threshold=0.8):
+    """
+    Yield (article_id, other_article_id, similarity) for all candidate pairs (see
+    get_candidate_pairs) with an estimated similarity of at least threshold. Signatures
+    should have been computed for both sets (see update_signatures).
+    """
+    for pairs in get_candidate_pairs(articleset_id, other_articleset_id):
+        signatures = get_signatures({aid for pair in pairs for aid in pair})
+        for a, b in pairs:
+            if a in signatures and b in signatures:
+                similarity = minhash.similarity(signatures[a], signatures[b])
+                if similarity >= threshold:
+                    yield a, b, similarity
+
+
+def find_near_duplicates(project_id, signatures, threshold=0.8):
+    """
+    Find articles in the sets of the given project that are near-duplicates of the given
+    signatures, using a single query for all signatures.
+
+    @param signatures: mapping of key -> signature (None signatures are skipped)
+    @returns: mapping of key -> id of the most similar article (only for keys with a match)
+    """
+    wanted = {}  # (band, bucket) -> [keys]
+    for key, signature in signatures.items():
+        if signature is not None:
+            for band_bucket in minhash.get_bands(signature):
+                wanted.setdefault(band_bucket, []).append(key)
+    if not wanted:
+        return {}
+
+    sql = """SELECT DISTINCT b.article_id, b.band, b.bucket
+             FROM articles_signatures_bands b
+             INNER JOIN articlesets_articles sa ON sa.article_id = b.article_id
+             INNER JOIN articlesets s ON s.articleset_id = sa.articleset_id
+             WHERE s.project_id = %s AND b.bucket = ANY(%s)"""
+    candidates = {}  # key -> {article_ids}
+    with connection.cursor() as c:
+        c.execute(sql, [project_id, list({bucket for (band, bucket) in wanted})])
+        for aid, band, bucket in c.fetchall():
+            for key in wanted.get((band, bucket), []):
+                candidates.setdefault(key, set()).add(aid)
+
+    existing = get_signatures({aid for aids in candidates.values() for aid in aids})
+    result = {}
+    for key, aids in candidates.items():
+        scores = [(minhash.similarity(signatures[key], existing[aid]), -aid) for aid in aids if aid in existing]
+        if scores:
+            score, aid = max(scores)
+            if score >= threshold:
+                result[key] = -aid
+    return result
+
+
+class ArticleHashFilter(object):
+    """
+    Bloom filter containing the hashes of all articles. The filter is built and stored in the
+    database (as DuplicateFilter) by the update_hash_filter management command, which should
+    be run periodically. Processes load the stored filter and add the hashes of articles with
+    an id above its watermark in memory only. Since hashes of articles never change, a hash
+    that is not in the filter does not exist, except for articles that were committed after an
+    article with a higher id was added to the filter. Callers should therefore still handle a
+    violation of the unique constraint on hash.
+    """
+    def __init__(self):
+        self.bloom = None
+        self.watermark = 0
+        self.lock = threading.Lock()
+
+    def _load(self):
+        try:
+            stored = DuplicateFilter.objects.get(name=HASH_FILTER_NAME)
+        except DuplicateFilter.DoesNotExist:
+            self.bloom, self.watermark = None, 0
+        else:
+            self.bloom, self.watermark = BloomFilter.from_bytes(stored.data), stored.watermark
+
+    def _create(self):
+        from amcat.models import Article
+        capacity = max(HASH_FILTER_MIN_CAPACITY, 2 * Article.objects.count())
+        log.info("Creating article hash filter with capacity {capacity}".format(**locals()))
+        self.bloom = BloomFilter(capacity, HASH_FILTER_ERROR_RATE)
+        self.watermark = 0
+
+    def _update(self, batch_size=10000):
+        # Use raw sql to get the binary digests without converting them to hex
+        n = 0
+        with connection.cursor() as c:
+            c.execute("SELECT article_id, hash FROM articles WHERE article_id > %s ORDER BY article_id",
+                      [self.watermark])
+            while True:
+                rows = c.fetchmany(batch_size)
+                if not rows:
+                    break
+                for aid, digest in rows:
+                    self.bloom.add(bytes(digest))
+                self.watermark = rows[-1][0]
+                n += len(rows)
+        return n
+
+    def save(self):
+        DuplicateFilter.objects.update_or_create(name=HASH_FILTER_NAME, defaults=dict(
+            watermark=self.watermark, data=self.bloom.to_bytes()))
+
+    def build(self, rebuild=False):
+        """
+        Add all articles added since the stored filter was built, and store the filter. The
+        filter is created from scratch if it does not exist or is full, or if rebuild is True.
+
+        @return: the number of hashes added
+        """
+        with self.lock:
+            self._load()
+            if rebuild or self.bloom is None or self.bloom.is_full:
+                self._create()
+            n = self._update()
+            self.save()
+            return n
+
+    def refresh(self):
+        """
+        Load the stored filter if needed, and add the articles added since the last refresh
+        to the in-memory filter. Does nothing if no filter was stored yet.
+        """
+        with self.lock:
+            if self.bloom is None:
+                self._load()
+            if self.bloom is not None:
+                self._update()
+
+    def __contains__(self, hash):
+        # Without a filter, any hash might exist
+        return self.bloom is None or hash in self.bloom
+
+    def add(self, hashes):
+        """Add (binary) hash digests of existing articles that were missed by refresh"""
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.update(hashes)
+
+    def reset(self):
+        """Forget the in-memory filter, so it is reloaded from the database on the next refresh"""
+        with self.lock:
+            self.bloom = None
+
+
+hash_filter = ArticleHashFilter()
+
+
+def find_exact_duplicates(hashes, use_filter=True, batch_size=1000):
+    """
+    Find existing articles with the given hashes. Only hashes that pass the hash filter are
+    looked up in the database.
+
+    @param hashes: collection of (binary) article hash digests
+    @param use_filter: if False, look up all hashes in the database
+    @returns: mapping of digest -> article id for all existing hashes
+    """
+    if use_filter:
+        hash_filter.refresh()
+        hashes = [h for h in hashes if h in hash_filter]
+    result = {}
+    with connection.cursor() as c:
+        for batch in splitlist(hashes, itemsperbatch=batch_size):
+            c.execute("SELECT hash, article_id FROM articles WHERE hash = ANY(%s)", [batch])
+            result.update((bytes(digest), aid) for (digest, aid) in c.fetchall())
+    return result
@@ -24,13 +24,17 @@ by a Script object.
 
 
 import datetime
+import time
 
+import django_redis
+import django_redis.cache
+from django.core.cache import caches
 from django.contrib.auth.models import User
 from celery.result import AsyncResult
 from jsonfield import JSONField
 from django.db import models
 from amcat.models import Project
-from amcat.tools import classtools
+from amcat.tools import classtools, profiling, telemetry
 from amcat.tools.caching import cached
 from amcat.tools.model import AmcatModel, PostgresNativeUUIDField
 from amcat.amcatcelery import app
@@ -40,12 +44,72 @@ from amcat.tools.usage import log_usage
 IN_PROGRESS = "INPROGRESS"
 FAILED = "FAILURE"
 
+# Progress of running tasks is kept in a redis hash per task, which expires after PROGRESS_TTL seconds.
+# If the default cache is not a redis cache, progress is kept in the celery result backend instead.
+PROGRESS_KEY = "amcat:task-progress:{}"
+PROGRESS_TTL = 24 * 60 * 60
+
+
+def _get_redis():
+    """Return a connection to the redis server of the default cache, or None if it is not a redis cache"""
+    if not isinstance(caches["default"], django_redis.cache.RedisCache):
+        return None
+    return django_redis.get_redis_connection()
+
+
+def set_task_progress(task_id, completed, message):
+    """
+    Store the progress of the task with the given uuid (see get_task_progress) in redis
+    @return: True if the progress was stored, False if there is no redis cache. Callers
+             should then store the progress in the result backend.
+    """
+    redis = _get_redis()
+    if redis is None:
+        return False
+    key = PROGRESS_KEY.format(task_id)
+    pipe = redis.pipeline()
+    pipe.hmset(key, {"completed": completed, "message": message or "", "updated": time.time()})
+    pipe.expire(key, PROGRESS_TTL)
+    pipe.execute()
+    return True
+
+
+def get_task_progress(task_id):
+    """
+    Return the progress of the task with the given uuid as a dict with completed (percentage),
+    message and updated (timestamp, None if read from the result backend), or None if no
+    progress was stored.
+    """
+    redis = _get_redis()
+    if redis is None:
+        result = AsyncResult(id=str(task_id), app=app)
+        if result.status == IN_PROGRESS and isinstance(result.result, dict):
+            return {"completed": result.result["completed"], "message": result.result["message"], "updated": None}
+        return None
+
+    progress = redis.hgetall(PROGRESS_KEY.format(task_id))
+    if not progress:
+        return None
+    progress = {k.decode(): v.decode() for (k, v) in progress.items()}
+    return {"completed": float(progress["completed"]), "message": progress["message"],
+            "updated": float(progress["updated"])}
+
 
 @app.task(bind=True)
 def amcat_task(self):
     t = Task.objects.get(uuid=self.request.id)
-    handler = t.get_handler()
-    return handler.run_task()
+    with telemetry.collect("task", t.class_name, handler=t.handler_class_name, project=t.project_id):
+        handler = t.get_handler()
+        if not t.profiling:
+            return handler.run_task()
+
+        try:
+            result, profile = profiling.profile_call(handler.run_task)
+        except Exception as e:
+            t.save_profile(getattr(e, "profile", None))
+            raise
+        t.save_profile(profile)
+        return result
 
 
 class TaskPending(Exception):
@@ -69,6 +133,11 @@ class Task(AmcatModel):
     user = models.ForeignKey(User, null=True)
     issued_at = models.DateTimeField(auto_now_add=True)
 
+    # If profiling is set, the task is run under a profiler and the profile (see
+    # amcat.tools.profiling) is stored in profile
+    profiling = models.BooleanField(default=False)
+    profile = models.BinaryField(null=True)
+
     # A Task is persistent if it important to keep it around (example: saved queries)
     persistent = models.BooleanField(default=False)
 
@@ -113,6 +182,21 @@ class Task(AmcatModel):
     def ready(self):
         return self.get_async_result().ready()
 
+    def get_progress(self):
+        """Returns the progress of this task, see get_task_progress"""
+        return get_task_progress(str(self.uuid))
+
+
+    def save_profile(self, profile):
+        if profile is not None:
+            self.profile = profiling.serialize_profile(profile)
+            self.save(update_fields=["profile"])
+
+    def get_profile(self):
+        """Return the profile of this task as a dict, or None if it was not profiled"""
+        if self.profile is None:
+            return None
+        return profiling.deserialize_profile(self.profile)
 
     def log_usage(self, type, action, **extra):
         duration = datetime.datetime.now() - self.issued_at
@@ -141,9 +225,10 @@ class TaskHandler(object):
         self.task = task
 
     @classmethod
-    def call(cls, target_class, arguments, user, project=None):
+    def call(cls, target_class, arguments, user, project=None, profile=False):
         """
         Create a new task object and start it using this class as handler
+        @param profile: profile the task run (see amcat.tools.profiling)
         @return: an handler object instantiated with the created task
         """
         if not isinstance(target_class, str):
@@ -155,7 +240,7 @@ class TaskHandler(object):
         task = Task.objects.create(
             handler_class_name=classtools.get_qualified_name(cls),
             class_name=target_class, user=user, project=project,
-            arguments=cls.serialise_arguments(arguments)
+            arguments=cls.serialise_arguments(arguments), profiling=profile
         )
 
         amcat_task.apply_async(task_id=str(task.uuid))
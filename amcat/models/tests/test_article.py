@@ -16,12 +16,15 @@
 # You should have received a copy of the GNU Affero General Public        #
 # License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
+import binascii
 import html
 
 from iso8601.iso8601 import UTC
 
 from amcat.models import Article, word_len
 from amcat.models import PropertyMapping
+from amcat.models.signature import ArticleSignature, hash_filter, save_signatures, get_article_signature
+from amcat.tools.bloom import BloomFilter
 from amcat.tools import amcattest
 from amcat.tools import amcates
 from amcat.tools.amcattest import create_test_article
@@ -205,6 +208,46 @@ class TestArticle(amcattest.AmCATTestCase):
         self.assertEqual(a1.id, a2.id)
         self.assertEqual(len(_q(title='internaldupe')), 1)
 
+    @amcattest.use_elastic
+    def test_hash_filter(self):
+        """Are duplicates found if the hash filter misses an article?"""
+        a1 = amcattest.create_test_article()
+        hash_filter.build()
+        hash_filter.reset()
+        hash_filter.refresh()
+        self.assertIn(binascii.unhexlify(a1.hash), hash_filter)
+        self.assertNotIn(b"\x00" * 28, hash_filter)
+
+        # Simulate an article committed after the filter was updated past its id
+        hash_filter.reset()
+        hash_filter.bloom, hash_filter.watermark = BloomFilter(1000), a1.id
+        a2 = amcattest.create_test_article(project=a1.project, title=a1.title, text=a1.text, date=a1.date)
+        self.assertEqual(a2.id, a1.id)
+        self.assertIn(binascii.unhexlify(a1.hash), hash_filter)
+        hash_filter.reset()
+
+    @amcattest.use_elastic
+    def test_near_deduplication(self):
+        text = " ".join("word{}".format(i) for i in range(200))
+        s = amcattest.create_test_set()
+        a1 = amcattest.create_test_article(articleset=s, title="near", text=text)
+        save_signatures({a1.id: get_article_signature(a1.title, a1.text)})
+
+        s2 = amcattest.create_test_set(project=s.project)
+        a2, a3 = [Article(project=s.project, title="near", text=t, date=a1.date)
+                  for t in (text.replace("word100", "other"), "something completely different")]
+        Article.create_articles([a2, a3], articleset=s2, near_duplicate_threshold=0.8)
+        self.assertEqual(a2.id, a1.id)
+        self.assertNotEqual(a3.id, a1.id)
+        self.assertEqual(set(s2.get_article_ids()), {a1.id, a3.id})
+
+        # New articles are signed, articles in other projects are not considered
+        other = Article(project=amcattest.create_test_project(), title="near", text=text + " more", date=a1.date)
+        Article.create_articles([other], articleset=amcattest.create_test_set(project=other.project),
+                                near_duplicate_threshold=0.8)
+        self.assertNotEqual(other.id, a1.id)
+        self.assertTrue(ArticleSignature.objects.filter(article_id=a3.id).exists())
+
     def test_unicode_word_len(self):
         """Does the word counter eat unicode??"""
         u = u'Kim says: \u07c4\u07d0\u07f0\u07cb\u07f9'
@@ -17,6 +17,7 @@
 # License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 from amcat.models import CodedArticle, Article, ArticleSet
+from amcat.models.articleset import ArticleSetChange, log_index_changes, apply_index_changes, get_index_lag
 
 from amcat.tools import amcattest
 from amcat.tools.amcates import ES
@@ -60,6 +61,31 @@ class TestArticleSet(amcattest.AmCATTestCase):
         self.assertEqual(len(arts), s2.get_count())
         print(s2.get_count())
 
+    @amcattest.use_elastic
+    def test_index_changes(self):
+        """Are changes logged, and can the index be repaired using them?"""
+        s = amcattest.create_test_set(3)
+        self.assertEqual(0, ArticleSetChange.objects.count())
+
+        # Simulate add and remove without updating index
+        a1, a2, a3 = s.articles.all()
+        a4 = amcattest.create_test_article()
+        s.add_articles([a4], add_to_index=False)
+        s.remove_articles([a1], remove_from_index=False)
+        log_index_changes(s.id, [a1.id, a4.id])
+        self.assertEqual(2, get_index_lag()[0])
+
+        self.assertEqual(2, apply_index_changes())
+        ES().refresh()
+        self.assertEqual({a2.id, a3.id, a4.id}, s.get_article_ids_from_elastic())
+        self.assertEqual((0, 0.0), get_index_lag())
+
+        # Logged changes are applied immediately if index is updated
+        s.remove_articles([a2])
+        ES().refresh()
+        self.assertEqual({a3.id, a4.id}, s.get_article_ids_from_elastic())
+        self.assertEqual(0, ArticleSetChange.objects.count())
+
     @amcattest.use_elastic
     def test_add_codedarticles(self):
         """Does add() also update codingjobs?"""
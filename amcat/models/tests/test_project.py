@@ -19,11 +19,13 @@
 from datetime import datetime
 
 from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import PermissionDenied
 from django.test import RequestFactory
 
 from amcat.models import ROLE_PROJECT_READER, ROLE_PROJECT_METAREADER, Role, ROLE_PROJECT_WRITER, \
     ROLE_PROJECT_ADMIN
-from amcat.models import RecentProject, User
+from amcat.models import ArticleSet, RecentProject, User, ProjectRole
+from amcat.models.authorisation import get_resolver
 from amcat.tools import amcattest
 from django.db.models.query import QuerySet
 
@@ -80,6 +82,38 @@ class TestProject(amcattest.AmCATTestCase):
 
 
 
+    def test_permission_resolver(self):
+        reader_role = Role.objects.get(id=ROLE_PROJECT_READER)
+        user = amcattest.create_test_user()
+        p1 = amcattest.create_test_project(guest_role=None)
+        p2 = amcattest.create_test_project(guest_role=reader_role)
+        p3 = amcattest.create_test_project(guest_role=None)
+        s1, s2, s3 = [amcattest.create_test_set(project=p) for p in (p1, p2, p3)]
+        a1, a2, a3 = [amcattest.create_test_article(articleset=s) for s in (s1, s2, s3)]
+        ProjectRole.objects.create(project=p1, user=user, role_id=ROLE_PROJECT_WRITER)
+
+        resolver = get_resolver(user)
+        self.assertIs(resolver, get_resolver(user))
+        self.assertEqual(resolver.get_role_ids([p1.id, p2.id, p3.id]),
+                         {p1.id: ROLE_PROJECT_WRITER, p2.id: ROLE_PROJECT_READER, p3.id: None})
+
+        # Roles are memoized, sets and articles are checked in bulk
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.filter_projects([p1, p2, p3], ROLE_PROJECT_WRITER), {p1.id})
+        self.assertEqual(resolver.filter_articlesets([s1.id, s2.id, s3.id]), {s1.id, s2.id})
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver.filter_articles([a1.id, a2.id, a3.id]), {a1.id, a2.id})
+        self.assertRaises(PermissionDenied, resolver.check_read_access, [a1.id, a3.id])
+
+        # Changing roles invalidates the memoized roles
+        ProjectRole.objects.create(project=p3, user=user, role_id=ROLE_PROJECT_READER)
+        resolver.check_read_access([a1.id, a3.id])
+        self.assertTrue(p3.has_role(user, ROLE_PROJECT_READER))
+
+        # So does deleting a set
+        ArticleSet.objects.filter(pk=s2.id).delete()
+        self.assertEqual(resolver.filter_articlesets([s1.id, s2.id]), {s1.id})
+
     def test_all_articles(self):
         """Does getting all articles work?"""
 
@@ -0,0 +1,47 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+from unittest import mock
+
+from django.test import override_settings
+
+from amcat.models.task import set_task_progress, get_task_progress, IN_PROGRESS
+from amcat.tools import amcattest
+from amcat.tools.progress import ProgressMonitor
+from navigator.views.scriptview import CeleryProgressUpdater
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class TestTaskProgress(amcattest.AmCATTestCase):
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_without_redis(self):
+        self.assertFalse(set_task_progress("task-id", 10, "busy"))
+
+        # Progress is stored in the result backend on every update instead
+        with mock.patch("navigator.views.scriptview.app") as app:
+            monitor = ProgressMonitor(total=10, log=False)
+            monitor.add_listener(CeleryProgressUpdater("task-id", min_interval=0, min_delta=0).update)
+            monitor.update(1, "one")
+            monitor.update(1, "two")
+        self.assertEqual([c[0][1]["message"] for c in app.backend.store_result.call_args_list], ["one", "two"])
+
+        with mock.patch("amcat.models.task.AsyncResult") as result:
+            result.return_value.status = IN_PROGRESS
+            result.return_value.result = {"completed": 20, "message": "two"}
+            self.assertEqual(get_task_progress("task-id"), {"completed": 20, "message": "two", "updated": None})
@@ -20,6 +20,7 @@
 # License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import binascii
 import collections
 import logging
 from itertools import chain
@@ -29,9 +30,11 @@ from hashlib import sha224 as hash_class
 from django import forms
 
 from amcat.forms.widgets import BootstrapMultipleSelect
-from amcat.models import ArticleSet
+from amcat.models import ArticleSet, ArticleSetArticle
+from amcat.models.signature import update_signatures, get_near_duplicate_pairs
 from amcat.scripts.script import Script
 from amcat.tools import amcates
+from amcat.tools.minhash import DisjointSet
 
 log = logging.getLogger(__name__)
 
@@ -39,7 +42,9 @@ STATIC_FIELDS = ["text", "title", "date", "url"]
 
 class DeduplicateSet(Script):
     """
-    Deduplicate an articleset, optionally using a limited set of fields
+    Deduplicate an articleset, optionally using a limited set of fields. If near_duplicates
+    is set, articles with (almost) the same title and text are considered duplicates, and
+    ignore_fields is not used.
     """
 
     class options_form(forms.Form):
@@ -53,6 +58,13 @@ class DeduplicateSet(Script):
         dry_run = forms.BooleanField(initial=False, required=False,
                                      help_text="Prints all duplicates but doesn't remove them")
 
+        near_duplicates = forms.BooleanField(initial=False, required=False,
+                                             help_text="Also remove articles whose title and text are very similar")
+        similarity = forms.FloatField(initial=0.8, required=False, min_value=0.5, max_value=1,
+                                      help_text="Minimum (estimated) similarity of near-duplicates")
+        compare_to = forms.ModelChoiceField(queryset=ArticleSet.objects.all(), required=False,
+                                            help_text="Also remove near-duplicates of articles in this set")
+
         def __init__(self, *args, articleset=None, **kwargs):
             super().__init__(*args, **kwargs)
             articleset = articleset or kwargs.get('data', {}).get('articleset')
@@ -61,7 +73,28 @@ class DeduplicateSet(Script):
             properties = articleset.get_used_properties()
             self.fields['ignore_fields'].choices = [(f, f) for f in chain(STATIC_FIELDS, properties)]
 
-    def _run(self, articleset, save_duplicates_to, dry_run, ignore_fields, **_):
+    def _run(self, articleset, save_duplicates_to, dry_run, ignore_fields, near_duplicates=False,
+             similarity=None, compare_to=None, **_):
+        if near_duplicates or compare_to:
+            to_remove = self.get_near_duplicates(articleset, similarity or 0.8, compare_to, dry_run)
+        else:
+            to_remove = self.get_duplicates(articleset, ignore_fields, dry_run)
+
+        n = len(to_remove)
+        if not to_remove:
+            logging.info("No duplicates found!")
+        else:
+            if dry_run:
+                logging.info("{n} duplicate articles found, run without dry_run to remove".format(**locals()))
+            else:
+                logging.info("Removing {n} articles from set".format(**locals()))
+                articleset.remove_articles(to_remove)
+            if save_duplicates_to:
+                dupes_article_set = ArticleSet.create_set(articleset.project, save_duplicates_to, to_remove)
+        return n, dry_run
+
+    def get_duplicates(self, articleset, ignore_fields, dry_run):
+        """Return the ids of all articles that are an exact duplicate of an article with a lower id"""
         hashes = collections.defaultdict(set)
         for i, (id, h) in enumerate(self.hash_articles(articleset, set(ignore_fields))):
             if not i % 100000:
@@ -80,22 +113,41 @@ class DeduplicateSet(Script):
             if not i % 100000:
                 logging.info("Iterating over hashes {i}/{n}, |to_remove|={m}".format(n=len(hashes), m=len(to_remove),
                                                                                      **locals()))
+        return to_remove
 
-        n = len(to_remove)
-        if not to_remove:
-            logging.info("No duplicates found!")
-        else:
+    def get_near_duplicates(self, articleset, similarity, compare_to=None, dry_run=False):
+        """
+        Return the ids of all articles that are a near-duplicate of an article with a lower id
+        in the same set, or of any article in compare_to (if given) that is not in the set itself.
+        Duplicates are clustered transitively, and the article with the lowest id in each cluster
+        is kept.
+        """
+        for aset in filter(None, [articleset, compare_to]):
+            article_ids = (ArticleSetArticle.objects.filter(articleset=aset)
+                           .values_list("article_id", flat=True).iterator())
+            n = update_signatures(article_ids)
+            logging.info("Computed {n} signatures for articleset {aset.id}".format(**locals()))
+
+        clusters = DisjointSet()
+        for a, b, score in get_near_duplicate_pairs(articleset.id, threshold=similarity):
             if dry_run:
-                logging.info("{n} duplicate articles found, run without dry_run to remove".format(**locals()))
-            else:
-                logging.info("Removing {n} articles from set".format(**locals()))
-                articleset.remove_articles(to_remove)
-            if save_duplicates_to:
-                dupes_article_set = ArticleSet.create_set(articleset.project, save_duplicates_to, to_remove)
-        return n, dry_run
+                logging.info("Near-duplicates: {a}, {b} ({score:.2f})".format(**locals()))
+            clusters.union(a, b)
+        to_remove = {aid for members in clusters.clusters().values() for aid in sorted(members)[1:]}
+
+        if compare_to is not None and compare_to != articleset:
+            # Articles in both sets were already compared (and clustered) above
+            in_set = articleset.get_article_ids()
+            for a, b, score in get_near_duplicate_pairs(articleset.id, compare_to.id, threshold=similarity):
+                if b in in_set:
+                    continue
+                if dry_run:
+                    logging.info("Near-duplicate of {b} in set {compare_to.id}: {a} ({score:.2f})".format(**locals()))
+                to_remove.add(a)
+        return to_remove
 
     @classmethod
-    def hash_articles(cls, articleset: ArticleSet, ignore_fields: set) -> Iterable[Tuple[int, str]]:
+    def hash_articles(cls, articleset: ArticleSet, ignore_fields: set) -> Iterable[Tuple[int, bytes]]:
         """
         Finds all articles in an articleset, and hashes articles as a tuple of field values, ordered alphabetically
         by field name. Fields in ignore_fields will not affect the hash.
@@ -105,7 +157,7 @@ class DeduplicateSet(Script):
         @param articleset       The articleset that is to be searched
         @param ignore_fields    A set of fields that should not be included in the calculated hashes
 
-        @return                 An iterable of (<article_id>, <hash>) tuples.
+        @return                 An iterable of (<article_id>, <hash>) tuples, with binary hash digests.
         """
         all_fields = STATIC_FIELDS + list(articleset.get_used_properties())
 
@@ -119,10 +171,10 @@ class DeduplicateSet(Script):
         for x in amcates.ES().scan(query={"query": {"constant_score": {"filter": {"term": {"sets": articleset.id}}}}},
                                    fields=fields):
             if not ignore_fields:
-                yield int(x['_id']), x['fields']['hash'][0]
+                yield int(x['_id']), binascii.unhexlify(x['fields']['hash'][0])
                 continue
             art_tuple = tuple(str(x['fields'].get(k, [None])[0]) for k in fields)
-            hash = hash_class(repr(art_tuple).encode()).hexdigest()
+            hash = hash_class(repr(art_tuple).encode()).digest()
             yield int(x['_id']), hash
 
 
@@ -1,6 +1,19 @@
+"""
+Import an article set from a remote AmCAT server using the API.
+
+The ids of the remote articles are listed first. The articles are then fetched in batches of
+ids by a pool of threads, while the main thread inserts the fetched batches (in order of
+id). After every batch the last imported id is stored as checkpoint in the cache, so
+running the import again with the same options resumes an interrupted import.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 from amcatclient.amcatclient import AmcatAPI, APIError
 from django import forms
+from django.core.cache import cache
 from django.utils.html import format_html
 
 from amcat.forms.widgets import add_bootstrap_classes as bt
@@ -17,6 +30,26 @@ API_ERRORS = {
 
 COPY_SET_FIELDS = {"name", "provenance", "featured"}
 
+log = logging.getLogger(__name__)
+
+# Number of ids per request when listing the remote set, and number of articles per request
+# when fetching articles (the ids are part of the url, so this cannot be very large)
+ID_PAGE_SIZE = 10000
+FETCH_PAGE_SIZE = 100
+
+# Number of articles fetched by one fetch job and inserted in one go
+BATCH_SIZE = 1000
+
+# Number of concurrent fetch jobs
+FETCH_WORKERS = 4
+
+# Number of attempts for a fetch job, and the delay (in seconds) before the first retry
+FETCH_ATTEMPTS = 5
+RETRY_DELAY = 2
+
+CHECKPOINT_KEY = "remote-import:{host}:{project}:{articleset}:{local_project}"
+CHECKPOINT_SECONDS = 7 * 24 * 60 * 60
+
 # article fields to be retrieved from the server
 ARTICLE_FIELDS = {"date", "title", "url", "text", "hash", "parent_hash", "properties"}
 
@@ -52,20 +85,38 @@ class RemoteArticleSetImportForm(forms.Form):
     local_project = forms.ModelChoiceField(queryset=Project.objects.all(), widget=forms.HiddenInput)
 
 
+def _is_transient(error: Exception) -> bool:
+    """Is error worth retrying, i.e. a connection problem or server error?"""
+    if isinstance(error, APIError):
+        return error.http_status is None or error.http_status >= 500
+    return isinstance(error, requests.RequestException)
+
+
 class RemoteQuery:
-    def __init__(self, host: str, token: str, project: int, articleset: int, page_size: int = 100):
+    def __init__(self, host: str, token: str, project: int, articleset: int, page_size: int = FETCH_PAGE_SIZE):
         self.api = AmcatAPI(host, token=token)
         self.project = project
         self.page_size = page_size
-        self.session = requests.Session()
         self.articleset = articleset
 
-    def __iter__(self):
-        yield from self.api.get_articles(project=self.project,
-                                         articleset=self.articleset,
-                                         page_size=self.page_size,
-                                         columns=",".join(ARTICLE_FIELDS | LEGACY_ARTICLE_FIELDS),
-                                         yield_pages=True)
+    def get_article_ids(self):
+        """Return the (sorted) ids of the articles in the remote set"""
+        articles = self.api.get_articles(project=self.project, articleset=self.articleset,
+                                         page_size=ID_PAGE_SIZE, columns=["date"])
+        return sorted({int(a["id"]) for a in articles})
+
+    def get_articles(self, ids, attempts=FETCH_ATTEMPTS):
+        """Fetch the articles with the given ids, retrying on transient errors"""
+        columns = ",".join(ARTICLE_FIELDS | LEGACY_ARTICLE_FIELDS)
+        for attempt in range(attempts):
+            try:
+                return list(self.api.get_articles_by_id(ids, columns=columns, page_size=self.page_size))
+            except Exception as e:
+                if attempt == attempts - 1 or not _is_transient(e):
+                    raise
+                delay = RETRY_DELAY * 2 ** attempt
+                log.warning("Error fetching articles, retrying in {delay}s: {e}".format(**locals()))
+                time.sleep(delay)
 
     def get_articleset(self):
         return self.api.get_set(self.project, self.articleset)
@@ -81,25 +132,79 @@ class RemoteArticleSetImport(Script):
 
     def _run(self, local_project, remote_host, remote_token, remote_project_id, remote_articleset_id):
         try:
-            page_size = 1000
-            query = RemoteQuery(remote_host, remote_token, remote_project_id, remote_articleset_id, page_size=page_size)
-            set = {k: v for k, v in query.get_articleset().items() if k in COPY_SET_FIELDS}
-            set.update(project=local_project)
-            set = ArticleSet.objects.create(**set)
-            for page in query:
-                articles_hashes = [(self.create_article(x, local_project), x["hash"]) for x in page]
-                hashmap = {old_hash: article.hash for article, old_hash in articles_hashes}
-                articles, _ = zip(*articles_hashes)
-                articles = list(articles)
-                for article in articles:
-                    if article.parent_hash in hashmap:
-                        article.parent_hash = hashmap[article.parent_hash]
-
-                Article.create_articles(articles, articleset=set)
-            return set.id
+            query = RemoteQuery(remote_host, remote_token, remote_project_id, remote_articleset_id)
+            checkpoint_key = CHECKPOINT_KEY.format(host=remote_host, project=remote_project_id,
+                                                   articleset=remote_articleset_id, local_project=local_project.id)
+            aset, last_id = self._get_checkpoint(checkpoint_key, local_project)
+            if aset is None:
+                aset = {k: v for k, v in query.get_articleset().items() if k in COPY_SET_FIELDS}
+                aset.update(project=local_project)
+                aset = ArticleSet.objects.create(**aset)
+                last_id = 0
+            else:
+                log.info("Resuming import into set {aset.id} after remote article {last_id}".format(**locals()))
+
+            ids = [aid for aid in query.get_article_ids() if aid > last_id]
+            batches = [ids[i:i+BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)]
+            monitor = self.progress_monitor.submonitor(len(batches) + 1, weight=self.progress_monitor.total)
+            monitor.update(message="Importing {n} articles in {b} batches".format(n=len(ids), b=len(batches)))
+
+            for i, (batch, page) in enumerate(self._fetch_batches(query, batches)):
+                self.save_articles(page, aset, local_project)
+                cache.set(checkpoint_key, {"articleset": aset.id, "last_id": batch[-1]}, CHECKPOINT_SECONDS)
+                monitor.update(message="Imported batch {}/{}".format(i + 1, len(batches)))
+
+            cache.delete(checkpoint_key)
+            return aset.id
         except APIError as e:
             self.handleError(e)
 
+    def _get_checkpoint(self, key, local_project):
+        """Return the (local) set and last imported remote id of an interrupted import, or (None, None)"""
+        checkpoint = cache.get(key)
+        if checkpoint is not None:
+            try:
+                return ArticleSet.objects.get(pk=checkpoint["articleset"], project=local_project), checkpoint["last_id"]
+            except ArticleSet.DoesNotExist:
+                cache.delete(key)
+        return None, None
+
+    def _fetch_batches(self, query, batches, workers=FETCH_WORKERS):
+        """
+        Fetch the given batches of ids using a pool of threads, yielding (batch, articles) pairs
+        in order. At most workers + 1 batches are fetched or waiting to be consumed at any time.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = []
+            batches = iter(batches)
+            for batch in batches:
+                pending.append((batch, executor.submit(query.get_articles, batch)))
+                if len(pending) > workers:
+                    break
+            while pending:
+                batch, future = pending.pop(0)
+                for next_batch in batches:
+                    pending.append((next_batch, executor.submit(query.get_articles, next_batch)))
+                    break
+                try:
+                    yield batch, future.result()
+                except BaseException:
+                    for _, f in pending:
+                        f.cancel()
+                    raise
+
+    def save_articles(self, page, articleset, project):
+        articles_hashes = [(self.create_article(x, project), x["hash"]) for x in page]
+        if not articles_hashes:
+            return
+        hashmap = {old_hash: article.hash for article, old_hash in articles_hashes}
+        articles = [article for (article, _) in articles_hashes]
+        for article in articles:
+            if article.parent_hash in hashmap:
+                article.parent_hash = hashmap[article.parent_hash]
+
+        Article.create_articles(articles, articleset=articleset)
+
     def _map_es_type(self, key, value):
         if key in ARTICLE_FIELDS:
             return key, value
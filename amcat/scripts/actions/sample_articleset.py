@@ -20,7 +20,7 @@
 ###########################################################################
 
 """
-Script to get queries for a codebook
+Script to create a new set with a random sample of the articles in a set
 """
 
 import logging
@@ -31,6 +31,7 @@ from django import forms
 
 from amcat.scripts.script import Script
 from amcat.models import ArticleSet, Project
+from amcat.tools import sampling
 
 PLUGINTYPE_PARSER = 1
 
@@ -41,6 +42,17 @@ class SampleSet(Script):
         sample = forms.CharField(help_text="Sample in absolute number or percentage")
         target_articleset_name = forms.CharField(help_text="Name for the new articleset")
         target_project = forms.ModelChoiceField(queryset=Project.objects.all())
+        strategy = forms.ChoiceField(choices=[(s, s) for s in sampling.STRATEGIES], initial="ids", required=False,
+                                     help_text="Sampling method. 'reservoir' does not keep all ids of the set "
+                                               "in memory, which is useful for very large sets")
+        stratify_by = forms.CharField(required=False,
+                                      help_text="If given, draw a stratified sample by 'date' or a property "
+                                                "such as 'medium'")
+        date_interval = forms.ChoiceField(choices=[(i, i) for i in ("year", "quarter", "month", "week", "day")],
+                                          initial="month", required=False,
+                                          help_text="Size of the strata when stratifying by date")
+        seed = forms.IntegerField(required=False, help_text="Random seed, use the same seed to repeat a sample")
+
         def __init__(self, project=None, **kwargs):
             super(self.__class__, self).__init__(**kwargs)
 
@@ -61,22 +73,22 @@ class SampleSet(Script):
             self.cleaned_data["sample"] = result
             return result
 
-    def _run(self, articleset, sample, target_articleset_name, target_project):
+    def _run(self, articleset, sample, target_articleset_name, target_project, strategy=None, stratify_by=None,
+             date_interval=None, seed=None):
         log.info("Sampling {sample} from {articleset}".format(**locals()))
-        if not isinstance(sample, int):
-            n = articleset.articles.count()
-            sample = int(round(n * sample))
-            log.info("Sampling {sample} of {n} articles".format(**locals()))
-
-        selected = articleset.articles.order_by('?')[:sample]
-        ids = [x for (x,) in selected.values_list("pk")]
+        if stratify_by:
+            ids = sampling.stratified_sample_articleset(articleset, sample, stratify_by,
+                                                        date_interval=date_interval or "month", seed=seed)
+        else:
+            ids = sampling.sample_articleset(articleset, sample, strategy=strategy or "ids", seed=seed)
 
         target_set = ArticleSet.objects.create(name=target_articleset_name, project=target_project)
         log.info(
             "Created set {target_set.id}:{target_set} in project {target_set.project_id}:{target_set.project}!".format(
                 **locals()))
 
-        target_set.add_articles(ids)
+        # The sampled articles exist and the new set is empty, so there is nothing to verify
+        target_set.add_articles(ids, verify=False)
 
         log.info("Done!")
 
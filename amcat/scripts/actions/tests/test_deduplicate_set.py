@@ -2,10 +2,12 @@ import uuid
 import datetime
 from collections import Hashable
 
-from amcat.models import ArticleSet
+from amcat.models import ArticleSet, ArticleSignatureBand
+from amcat.models.signature import update_signatures
 from amcat.scripts.actions.deduplicate_set import DeduplicateSet
 from amcat.tools import amcattest
 from amcat.tools.amcates import ES
+from amcat.tools.minhash import DisjointSet
 
 
 class TestDeduplicateSet(amcattest.AmCATTestCase):
@@ -93,6 +95,43 @@ class TestDeduplicateSet(amcattest.AmCATTestCase):
         unique_hashes = set(hashes[self.articles[i].id] for i in range(5))
         self.assertEqual(len(unique_hashes), 5)
 
+    def test_disjoint_set(self):
+        clusters = DisjointSet()
+        clusters.union(2, 1)
+        self.assertEqual(clusters.clusters(), {1: {1, 2}})
+
+        clusters.union(5, 4)
+        clusters.union(3, 2)
+        self.assertEqual(clusters.clusters(), {1: {1, 2, 3}, 4: {4, 5}})
+
+    @amcattest.use_elastic
+    def test_near_duplicates(self):
+        text = " ".join("word{}".format(i) for i in range(200))
+        near = text.replace("word100", "something")
+        other = " ".join("other{}".format(i) for i in range(200))
+        aset = amcattest.create_test_set()
+        a1, a2, a3 = [amcattest.create_test_article(articleset=aset, project=aset.project, title="t", text=t)
+                      for t in (text, near, other)]
+        cmpset = amcattest.create_test_set(project=aset.project)
+        amcattest.create_test_article(articleset=cmpset, project=aset.project, title="t", text=other + " x")
+        options = dict(articleset=aset.id, ignore_fields=set(), save_duplicates_to=None, dry_run=True,
+                       near_duplicates=True, similarity=0.8)
+
+        self.assertEqual(DeduplicateSet(options=options).get_near_duplicates(aset, 0.8), {a2.id})
+
+        # Signatures are stored, so a second run does not compute them again
+        self.assertEqual(update_signatures([a1.id, a2.id, a3.id]), 0)
+        self.assertTrue(all(ArticleSignatureBand.objects.filter(article_id=a.id).exists() for a in (a1, a2, a3)))
+
+        # Near-duplicates in both sets are only removed once, keeping the lowest id
+        cmpset.add_articles([a1, a2])
+        self.assertEqual(DeduplicateSet(options=options).get_near_duplicates(aset, 0.8, compare_to=cmpset),
+                         {a2.id, a3.id})
+
+        n, _ = DeduplicateSet(options=dict(options, dry_run=False, compare_to=cmpset.id)).run()
+        self.assertEqual(n, 2)
+        self.assertEqual(set(aset.articles.values_list("id", flat=True)), {a1.id})
+
     def _get_es_like_articles(self, articles):
         """
         @param articles: A list of {field: value} dicts
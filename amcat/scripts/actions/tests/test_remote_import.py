@@ -0,0 +1,49 @@
+##########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+from unittest import mock
+
+import requests
+
+from amcat.scripts.actions import remote_import
+from amcat.scripts.actions.remote_import import RemoteArticleSetImport, RemoteQuery
+from amcat.tools import amcattest
+
+
+class TestRemoteImport(amcattest.AmCATTestCase):
+    def test_fetch_batches(self):
+        class Query:
+            def get_articles(self, ids):
+                return [{"id": i} for i in ids]
+
+        batches = [[i, i + 1] for i in range(0, 20, 2)]
+        script = RemoteArticleSetImport.__new__(RemoteArticleSetImport)
+        result = list(script._fetch_batches(Query(), batches, workers=3))
+        self.assertEqual([batch for (batch, _) in result], batches)
+        self.assertEqual([[a["id"] for a in page] for (_, page) in result], batches)
+
+    @mock.patch.object(remote_import, "RETRY_DELAY", 0)
+    def test_retry(self):
+        query = RemoteQuery.__new__(RemoteQuery)
+        query.page_size = 10
+        query.api = mock.Mock()
+        query.api.get_articles_by_id.side_effect = [requests.ConnectionError(), [{"id": 1}]]
+        self.assertEqual(query.get_articles([1]), [{"id": 1}])
+
+        query.api.get_articles_by_id.side_effect = ValueError()
+        self.assertRaises(ValueError, query.get_articles, [1])
@@ -38,7 +38,7 @@ from django.forms.widgets import HiddenInput
 
 from amcat.models import Article, ArticleSet, Project
 from amcat.models.articleset import create_new_articleset
-from amcat.tools import amcates
+from amcat.tools import amcates, telemetry
 from amcat.tools.progress import NullMonitor
 
 log = logging.getLogger(__name__)
@@ -103,6 +103,10 @@ class UploadForm(forms.Form):
         required=False)
 
     encoding = forms.ChoiceField(choices=[(x, x) for x in ["Autodetect", "ISO-8859-15", "UTF-8", "Latin-1"]])
+    near_duplicate_threshold = forms.FloatField(
+        required=False, min_value=0.5, max_value=1,
+        help_text="If given, articles that are at least this similar to an article in this project "
+                  "are considered duplicates (e.g. 0.9)")
     field_map = JSONField(validators=[validate_field_map],
                           help_text='json dict with property names (title, date, etc.) as keys, and field settings as values. '
                                     'Field settings should have the form {"type": "field"/"literal", "value": "field_name_or_literal"}')
@@ -209,15 +213,28 @@ class UploadScript(ActionForm):
         """
         if file.endswith(".zip"):
             path = os.path.dirname(file)
-            zf = zipfile.ZipFile(file)
-            for member in zf.namelist():
-                fn = os.path.join(path, member)
-                if not os.path.exists(fn):
-                    zf.extract(member, path=path)
-                yield cls._get_preprocessed(fn, encoding)
+            with zipfile.ZipFile(file) as zf:
+                # Members are extracted one at a time, when the previous member has been processed
+                for member in cls._get_zip_members(zf):
+                    fn = os.path.join(path, member)
+                    if not os.path.exists(fn):
+                        zf.extract(member, path=path)
+                    yield cls._get_preprocessed(fn, encoding)
         else:
             yield cls._get_preprocessed(file, encoding)
 
+    @classmethod
+    def _get_zip_members(cls, zf: zipfile.ZipFile) -> Sequence[str]:
+        return [member for member in zf.namelist() if not member.endswith("/")]
+
+    @classmethod
+    def _count_files(cls, file: str) -> int:
+        """Return the number of files _get_files will yield, without extracting anything"""
+        if file.endswith(".zip"):
+            with zipfile.ZipFile(file) as zf:
+                return len(cls._get_zip_members(zf))
+        return 1
+
     def __init__(self, form=None, file=None, **kargs):
         if form is None:
             form = self.form_class(data=kargs, files={"file": file})
@@ -259,11 +276,11 @@ class UploadScript(ActionForm):
 
         articles = []
         encoding = self.options['encoding']
-        files = list(self._get_files(filename, encoding))
-        nfiles = len(files)
-        for i, (file, encoding, data) in enumerate(files):
-            monitor.update(20 / nfiles, "Parsing file {i}/{nfiles}: {file}".format(**locals()))
-            articles += list(self.parse_file(file, encoding, data))
+        nfiles = self._count_files(filename)
+        with telemetry.stage("parse"):
+            for i, (file, encoding, data) in enumerate(self._get_files(filename, encoding)):
+                monitor.update(20 / nfiles, "Parsing file {i}/{nfiles}: {file}".format(**locals()))
+                articles += list(self.parse_file(file, encoding, data))
 
         for article in articles:
             _set_project(article, self.project)
@@ -271,8 +288,11 @@ class UploadScript(ActionForm):
         if self.errors:
             raise ParseError(" ".join(map(str, self.errors)))
         monitor.update(10, "All files parsed, saving {n} articles".format(n=len(articles)))
-        Article.create_articles(articles, articleset=self.get_or_create_articleset(),
-                                monitor=monitor.submonitor(40))
+        with telemetry.stage("save"):
+            Article.create_articles(articles, articleset=self.get_or_create_articleset(),
+                                    near_duplicate_threshold=self.options.get("near_duplicate_threshold"),
+                                    monitor=monitor.submonitor(40))
+        telemetry.count("articles", len(articles))
 
         if not articles:
             raise Exception("No articles were imported")
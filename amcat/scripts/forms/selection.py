@@ -125,6 +125,8 @@ class SelectionForm(forms.Form):
     codebook = ModelChoiceFieldWithIdLabel(queryset=Codebook.objects.all(), required=False, label="Use Codebook")
 
     query = forms.CharField(widget=forms.Textarea, required=False)
+    sentence_level = forms.BooleanField(label="Keywords must occur within a single sentence", required=False,
+                                        initial=False)
 
     codingschemafield_1 = ModelChoiceFieldWithIdLabel(queryset=CodingSchemaField.objects.none(), required=False)
     codingschemafield_value_1 = ModelMultipleChoiceFieldWithIdLabel(queryset=Code.objects.none(), required=False)
@@ -69,15 +69,7 @@ class AssignAsCodingjobAction(QueryAction):
         if job_size == 0:
             job_size = len(article_ids)
 
-        n_batches = len(article_ids) // job_size
-        n_batches += 1 if len(article_ids) % job_size else 0
-        
-        for i, cid in enumerate(_create_codingjob_batches(cj, article_ids, job_size)):
-            progress = int((i / float(n_batches)) * (100 // 2))
-            msg = "Creating codingjob {} of {}..".format(i+1, n_batches)
-            print(50 + progress)
-            self.monitor.update(50 + progress, msg)
-
+        for cid in _create_codingjob_batches(cj, article_ids, job_size, monitor=self.monitor.submonitor(1, weight=40)):
             if provenance:
                 cj = CodingJob.objects.get(id=cid)
                 cj.provenance = provenance
@@ -27,6 +27,7 @@ import hashlib
 from amcat.models import Project, ArticleSet, TaskHandler, CodingJob
 from amcat.models.authorisation import ROLE_PROJECT_METAREADER
 from amcat.scripts.forms import SelectionForm
+from amcat.tools import telemetry
 from amcat.tools.caching import cached
 from amcat.tools.progress import ProgressMonitor
 from django import forms
@@ -108,6 +109,7 @@ class QueryActionHandler(TaskHandler):
             form = query_action.get_form()
             query_action.before_run(form)
             result = query_action.run(form)
+            telemetry.annotate(cache_hit=query_action.cache_hit)
             cache_key = query_action.get_cache_key() if query_action.cache_hit else None
             return cache_key, result
         except Exception as e:
@@ -259,10 +261,12 @@ class QueryAction(object):
         @type form: (subclass of) QueryActionForm"""
         raise NotImplementedError
 
-    def run_delayed(self):
+    def run_delayed(self, profile=False):
         """
         Put this task in celery queue. Returns a task handler.
 
+        @param profile: profile the task run (see amcat.tools.profiling)
+
         @raises: django.core.exceptions.ValidationError if form invalid
         @rtype: QueryActionHandler
         """
@@ -278,7 +282,7 @@ class QueryAction(object):
                 "user": self.user, "project": self.project,
                 "data": self.data, "articlesets": self.articlesets,
                 "codingjobs": self.codingjobs
-            }
+            }, profile=profile
         )
 
     def check_permission(self, form):
@@ -23,45 +23,56 @@ now
 import functools
 import json
 import os
-import re
+import queue
+import select
+import subprocess
+import sys
+import threading
 import logging
 
 from collections import OrderedDict
-from threading import Lock
 
 import datetime
 from django import forms
+from django.conf import settings
 from django.db.models import QuerySet, Model
 from rest_framework.authtoken.models import Token
 
-from rpy2 import robjects
 from rpy2.robjects import r
-from rpy2.robjects.packages import importr
 
 from amcat.scripts.query import QueryActionForm, QueryAction
 from amcat.scripts.query import QueryActionHandler
-from amcat.tools.toolkit import synchronized_with
+from amcat.scripts.query import r_worker
 
-R_STRING_RE = re.compile(r'^\[1\] "(?P<str>.*)"$')
+log = logging.getLogger(__name__)
 
+# Directory from which R loads packages and where R stores new packages (install
+# can be called from within R plugins)
+R_PACKAGE_LIBRARY = os.path.join(os.path.dirname(__file__), 'r_plugins', 'package_library')
+R_FORMFIELD_FUNCTIONS = os.path.join(os.path.dirname(__file__), 'r_plugins', 'formfield_functions.r')
 
-def source_r_file(path):
-    """Executes a file in R, similar to 'include' in C or import in Python"""
+# Maximum number of seconds to wait for a new R worker to start
+R_WORKER_START_TIMEOUT = 120
+
+
+def get_r_path(path):
+    """Make a path relative to this file absolute"""
     if not os.path.isabs(path):
-        # If we got a relative path, make it absolute relative to this file
         path = os.path.join(os.path.dirname(__file__), path)
-    r('source("{path}")'.format(path=path))
+    return path
+
+
+def source_r_file(path):
+    """Executes a file in R, similar to 'include' in C or import in Python"""
+    r('source("{path}")'.format(path=get_r_path(path)))
 
 
 @functools.lru_cache()  # Only run once
 def initialize_r():
     """Sets up R environment. Will be called a the end of this module."""
-    # set path from which R loads packages and where R stores new packages (install
-    # can be called from within R plugins)
-    pkgdir = os.path.join(os.path.dirname(__file__), 'r_plugins', 'package_library')
-    os.makedirs(pkgdir, exist_ok=True)
-    r(".libPaths('{pkgdir}')".format(pkgdir=pkgdir))
-    source_r_file('r_plugins/formfield_functions.r')
+    os.makedirs(R_PACKAGE_LIBRARY, exist_ok=True)
+    r(".libPaths('{pkgdir}')".format(pkgdir=R_PACKAGE_LIBRARY))
+    source_r_file(R_FORMFIELD_FUNCTIONS)
 
 try:
     initialize_r()
@@ -84,6 +95,120 @@ def cleaned_data_to_r_primitives(cdata: dict) -> dict:
     return {k: _to_r_primitive(v) for k, v in cdata.items()}
 
 
+class RWorkerError(Exception):
+    pass
+
+
+class RWorkerTimeout(RWorkerError):
+    pass
+
+
+class RPoolBusy(RWorkerError):
+    pass
+
+
+class RWorker(object):
+    """A process running r_worker.py, which has its own R interpreter"""
+    def __init__(self, preload=()):
+        cmd = [sys.executable, r_worker.__file__, "--lib", R_PACKAGE_LIBRARY, "--source", R_FORMFIELD_FUNCTIONS]
+        for path in preload:
+            cmd += ["--preload", path]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        status, self.pid = self._receive(R_WORKER_START_TIMEOUT)
+        log.info("Started R worker {self.pid}".format(**locals()))
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def _receive(self, timeout):
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise RWorkerTimeout("R worker did not respond within {} seconds".format(timeout))
+        try:
+            return r_worker.receive(self.process.stdout)
+        except EOFError:
+            raise RWorkerError("R worker stopped unexpectedly (exit code {})".format(self.process.wait()))
+
+    def call(self, path, arguments, timeout):
+        r_worker.send(self.process.stdin, (path, arguments))
+        status, result = self._receive(timeout)
+        if status == "error":
+            raise RWorkerError(result)
+        return result
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class RWorkerPool(object):
+    """
+    A pool of at most `size` R workers, which are started when needed. At most `queue_size`
+    calls can wait for a free worker, further calls raise RPoolBusy. Workers which do not
+    finish a call within `timeout` seconds are killed and replaced.
+    """
+    def __init__(self, size, queue_size, timeout, preload=()):
+        self.size = size
+        self.timeout = timeout
+        self.preload = list(preload)
+        self._idle = queue.LifoQueue()
+        self._nworkers = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size + queue_size)
+
+    def _get_worker(self, timeout):
+        with self._lock:
+            start = self._idle.empty() and self._nworkers < self.size
+            if start:
+                self._nworkers += 1
+        if start:
+            try:
+                return RWorker(self.preload)
+            except Exception:
+                self._discard(None)
+                raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise RPoolBusy("No R worker became available within {} seconds".format(timeout))
+
+    def _discard(self, worker):
+        if worker is not None:
+            worker.kill()
+        with self._lock:
+            self._nworkers -= 1
+
+    def call(self, path, arguments, timeout=None):
+        """Call the run function of the given R file in a worker, and return its (string) result"""
+        timeout = timeout or self.timeout
+        if not self._slots.acquire(blocking=False):
+            raise RPoolBusy("All R workers are busy, please try again later")
+        try:
+            worker = self._get_worker(timeout)
+            try:
+                result = worker.call(get_r_path(path), arguments, timeout)
+            except Exception as e:
+                if isinstance(e, RWorkerTimeout) or not worker.alive:
+                    log.warning("Killing R worker {worker.pid}: {e}".format(**locals()))
+                    self._discard(worker)
+                else:
+                    self._idle.put(worker)
+                raise
+            self._idle.put(worker)
+            return result
+        finally:
+            self._slots.release()
+
+
+@functools.lru_cache()
+def get_r_pool():
+    """Return the R worker pool of this process, which preloads all R query action plugins"""
+    from amcat.scripts.query.r import get_r_queryactions
+    preload = [get_r_path(action.r_file) for action in get_r_queryactions()]
+    return RWorkerPool(settings.R_POOL_SIZE, settings.R_POOL_QUEUE_SIZE, settings.R_POOL_TIMEOUT, preload)
+
+
 class RQueryActionHandler(QueryActionHandler):
     pass
 
@@ -130,20 +255,9 @@ class RQueryAction(QueryAction):
         fieldinfo = json.loads(r("formfields")[0], object_pairs_hook=OrderedDict)
         return type("{}Form".format(my_name), (RQueryActionForm,), {"fieldinfo": fieldinfo})
 
-    @synchronized_with(Lock())  # We only have one R interpreter
     def _run(self, cdata):
-        # Execute script using R
-        r_json_arguments = robjects.StrVector([json.dumps(cdata, indent=4)])
-        r_arguments = importr("rjson").fromJSON(r_json_arguments)
-        source_r_file(self.r_file)
-        result = str(r['do.call']('run', r_arguments)).encode("utf-8").decode("unicode_escape")
-
-        # Interpret results as string
-        match = R_STRING_RE.match(result)
-        if not match:
-            err_msg = "Expected a string as return value from R script. Got: {}"
-            raise ValueError(err_msg.format(result))
-        return match.groupdict()["str"]
+        # Execute script in one of the R worker processes
+        return get_r_pool().call(self.r_file, cdata)
 
     def run(self, form):
         cleaned_data = cleaned_data_to_r_primitives(form.cleaned_data)
@@ -0,0 +1,167 @@
+##########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+Worker process for R query actions, see queryaction_r.RWorkerPool. Each worker embeds its
+own R interpreter, so R query actions can run in parallel. Plugin files are sourced once
+into their own environment, and sourced again only if they are changed.
+
+Parent and worker exchange length-prefixed pickles over the stdin and stdout of the worker.
+Output of R itself is redirected to stderr. Arguments are converted to R vectors directly
+(lists of numbers or strings become a single numeric or character vector), rather than
+being serialised as JSON and parsed again in R.
+
+This module is started as a script and should not import django or amcat.
+"""
+import argparse
+import datetime
+import os
+import pickle
+import re
+import struct
+import sys
+
+if __name__ == "__main__":
+    # Do not let modules next to this file (e.g. statistics.py) shadow standard library modules
+    sys.path.pop(0)
+
+_HEADER = struct.Struct("!I")
+
+R_STRING_RE = re.compile(r'^\[1\] "(?P<str>.*)"$')
+
+
+def send(stream, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(_HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def _read(stream, n):
+    data = b""
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            raise EOFError("R worker pipe closed")
+        data += chunk
+    return data
+
+
+def receive(stream):
+    size, = _HEADER.unpack(_read(stream, _HEADER.size))
+    return pickle.loads(_read(stream, size))
+
+
+def to_r(value):
+    """Convert a (cleaned) form value to an R value, equivalent to rjson::fromJSON(toJSON(value))"""
+    from rpy2 import robjects
+
+    if value is None:
+        return robjects.NULL
+    if isinstance(value, bool):
+        return robjects.BoolVector([value])
+    if isinstance(value, (int, float)):
+        return robjects.FloatVector([value])
+    if isinstance(value, str):
+        return robjects.StrVector([value])
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return robjects.StrVector([value.isoformat()])
+    if isinstance(value, dict):
+        return robjects.ListVector([(str(k), to_r(v)) for (k, v) in value.items()])
+    if isinstance(value, (list, tuple, set)):
+        value = list(value)
+        if value and all(isinstance(v, bool) for v in value):
+            return robjects.BoolVector(value)
+        if value and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value):
+            return robjects.FloatVector(value)
+        if value and all(isinstance(v, str) for v in value):
+            return robjects.StrVector(value)
+        return robjects.r["list"](*map(to_r, value))
+    raise TypeError("Cannot convert {} to R".format(type(value)))
+
+
+class Worker(object):
+    def __init__(self, lib_path=None, sources=(), preload=()):
+        """
+        @param lib_path: directory where R loads and installs packages
+        @param sources: R files sourced into the global environment (e.g. helper functions)
+        @param preload: plugin files to source in advance
+        """
+        from rpy2.robjects import r
+        self.r = r
+        self.environments = {}  # path -> (mtime, environment)
+
+        if lib_path is not None:
+            os.makedirs(lib_path, exist_ok=True)
+            r(".libPaths")(lib_path)
+        for path in sources:
+            r["source"](path)
+        for path in preload:
+            self.get_environment(path)
+
+    def get_environment(self, path):
+        """Return the environment in which the given plugin file was sourced"""
+        mtime = os.path.getmtime(path)
+        cached = self.environments.get(path)
+        if cached is None or cached[0] != mtime:
+            environment = self.r("new.env(parent=globalenv())")
+            self.r["sys.source"](path, envir=environment)
+            cached = self.environments[path] = (mtime, environment)
+        return cached[1]
+
+    def call(self, path, arguments):
+        """Call the run function of the given plugin file, which should return a string"""
+        from rpy2 import robjects
+        run = self.r["get"]("run", envir=self.get_environment(path))
+        arguments = robjects.ListVector([(k, to_r(v)) for (k, v) in arguments.items()])
+        result = str(self.r["do.call"](run, arguments)).encode("utf-8").decode("unicode_escape")
+
+        match = R_STRING_RE.match(result)
+        if not match:
+            err_msg = "Expected a string as return value from R script. Got: {}"
+            raise ValueError(err_msg.format(result))
+        return match.groupdict()["str"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lib", help="R package library directory")
+    parser.add_argument("--source", action="append", default=[], help="Source file in the global environment")
+    parser.add_argument("--preload", action="append", default=[], help="Source plugin file in advance")
+    args = parser.parse_args()
+
+    # Keep the original stdout for messages, and send everything else written to it to stderr
+    requests = sys.stdin.buffer
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    worker = Worker(args.lib, args.source, args.preload)
+    send(responses, ("ready", os.getpid()))
+
+    while True:
+        try:
+            path, arguments = receive(requests)
+        except EOFError:
+            break
+        try:
+            send(responses, ("ok", worker.call(path, arguments)))
+        except Exception as e:
+            send(responses, ("error", "{}: {}".format(e.__class__.__name__, e)))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,12 +17,17 @@
 # License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 import json
+import os
+import tempfile
+import threading
+import time
 
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 
 from amcat.models import ArticleSet
 from amcat.scripts.query import DemoPluginAction
+from amcat.scripts.query.queryaction_r import RWorkerPool, RWorkerTimeout, RPoolBusy
 from amcat.tools import amcattest
 
 
@@ -57,3 +62,32 @@ class TestRDemoPlugin(amcattest.AmCATTestCase):
 
         result = self._run_action(is_json=False, data={"field1": r'"', "field2": 10})
         self.assertEqual(result, r'Hello " ( 10 )')
+
+
+class TestRWorkerPool(amcattest.AmCATTestCase):
+    def _write_plugin(self, body):
+        fd, path = tempfile.mkstemp(suffix=".r")
+        with os.fdopen(fd, "w") as f:
+            f.write(body)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_pool(self):
+        echo = self._write_plugin('run = function(x, ids, ...) paste(x, sum(ids))')
+        sleep = self._write_plugin('run = function(seconds, ...) {Sys.sleep(seconds); "done"}')
+        pool = RWorkerPool(size=1, queue_size=0, timeout=5, preload=[echo])
+
+        self.assertEqual(pool.call(echo, {"x": "sum", "ids": [1, 2, 3]}), "sum 6")
+
+        # Calls that take too long are aborted, and the worker is replaced
+        self.assertRaises(RWorkerTimeout, pool.call, sleep, {"seconds": 5}, timeout=0.5)
+        self.assertEqual(pool.call(echo, {"x": "again", "ids": [1]}), "again 1")
+
+        # With one worker and no queue, concurrent calls are refused
+        t = threading.Thread(target=pool.call, args=(sleep, {"seconds": 1}))
+        t.start()
+        time.sleep(0.2)
+        try:
+            self.assertRaises(RPoolBusy, pool.call, echo, {"x": "", "ids": [0]})
+        finally:
+            t.join()
@@ -191,7 +191,7 @@ class TermCategory(Category):
     @property
     def bodies(self):
         from amcat.tools.amcates import build_body
-        return (dict(build_body(t.query)) for t in self.terms.values())
+        return (dict(build_body(t.get_terms())) for t in self.terms.values())
 
     def get_aggregation(self):
         for label, body in zip(self.terms.keys(), self.bodies):
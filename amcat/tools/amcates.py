@@ -32,10 +32,10 @@ from typing import Union
 
 from django.conf import settings
 from elasticsearch import Elasticsearch, NotFoundError
-from elasticsearch.helpers import scan, bulk
+from elasticsearch.helpers import scan, bulk, reindex
 
 import amcat.models
-from amcat.tools import queryparser, toolkit
+from amcat.tools import queryparser, toolkit, telemetry
 from amcat.tools.caching import cached
 from amcat.tools.progress import NullMonitor
 from amcat.tools.toolkit import multidict, splitlist
@@ -116,16 +116,65 @@ def get_article_dict(article, sets=None):
     d["sets"] = sets
     return d
 
+
+def _get_raw_dict(article):
+    d = {field_name: getattr(article, field_name) for field_name in ARTICLE_FIELDS}
+    d.update(article.properties)
+    return d
+
+
+def _clean_and_hash(raw):
+    d = {k: _clean(v) for (k, v) in raw.items()}
+    d['hash'] = _hash_dict(d)
+    return d
+
+
+def get_article_dicts(articles, sets=None):
+    """
+    Return get_article_dict(article, sets) for all articles
+    """
+    dicts = [_clean_and_hash(_get_raw_dict(a)) for a in articles]
+    for article, d in zip(articles, dicts):
+        d['id'] = article.id
+        d['sets'] = sets
+    return dicts
+
+def get_sentence_dict(sentence):
+    """Return the document of a sentence, which is indexed as child of its article"""
+    return {
+        "id": sentence.id,
+        "article_id": sentence.article_id,
+        "parnr": sentence.parnr,
+        "sentnr": sentence.sentnr,
+        "sentence": _clean(sentence.sentence),
+    }
+
 def _escape_bytes(b):
     return b.replace(b"\\", b"\\\\").replace(b",", b"\\,")
 
+@functools.lru_cache(maxsize=1024)
+def _encode_key(field_name):
+    return _escape_bytes(_encode_field(field_name))
+
+def _encode_value(value):
+    # Escaping before encoding is equivalent to _escape_bytes(_encode_field(value)), as utf-8
+    # never uses the bytes of '\\' and ',' in multibyte sequences
+    if not isinstance(value, str):
+        value = _encode_field(value).decode("utf-8")
+    if "\\" in value or "," in value:
+        value = value.replace("\\", "\\\\").replace(",", "\\,")
+    return value.encode("utf-8")
+
+def _get_hash_payload(d):
+    """Return the bytes that are hashed to get the hash of article dict d"""
+    return b"".join(_encode_key(fn) + _encode_value(d[fn]) + b"," for fn in sorted(d.keys()))
+
+def hash_digest(d) -> bytes:
+    """Return the hash of article dict d as (binary) digest, as stored in the database"""
+    return hash_class(_get_hash_payload(d)).digest()
+
 def _hash_dict(d):
-    c = hash_class()
-    for fn in sorted(d.keys()):
-        c.update(_escape_bytes(_encode_field(fn)))
-        c.update(_escape_bytes(_encode_field(d[fn])))
-        c.update(b",")
-    return c.hexdigest()
+    return hash_digest(d).hex()
 
 def _encode_field(object, encoding="utf-8"):
     if isinstance(object, datetime.datetime):
@@ -265,6 +314,7 @@ class _ES(object):
         self.port = port
         self.index = index
         self.doc_type = doc_type
+        args.setdefault("connection_class", telemetry.ESConnection)
         self.es = Elasticsearch(hosts=[{"host": self.host, "port": self.port}, ], timeout=timeout, **args)
 
     def check_properties(self, properties):
@@ -336,7 +386,8 @@ class _ES(object):
         body = {
             "settings": es_settings,
             "mappings": {
-                settings.ES_ARTICLE_DOCTYPE: settings.ES_MAPPING
+                settings.ES_ARTICLE_DOCTYPE: settings.ES_MAPPING,
+                settings.ES_SENTENCE_DOCTYPE: settings.ES_SENTENCE_MAPPING
             }
         }
 
@@ -537,6 +588,35 @@ class _ES(object):
             monitor.update(message="Adding batch {iplus}/{nbatches}..".format(iplus=i+1, nbatches=nbatches))
             self.bulk_update(batch, UPDATE_SCRIPT_ADD_TO_SET, params={'set' : setid})
 
+    def add_to_sets(self, set_article_ids, monitor=NullMonitor()):
+        """Add articles to multiple sets in a single pass. Bulk requests are filled with
+        updates regardless of the set they belong to, so many small sets do not result in
+        many small requests. Each article may only occur once in set_article_ids.
+
+        @param set_article_ids: mapping of set id to a sequence of article ids
+        @type set_article_ids: dict"""
+        payloads = {}
+        for setid, article_ids in set_article_ids.items():
+            payload = serialize({"script": {"file": UPDATE_SCRIPT_ADD_TO_SET, "params": {'set': setid}}})
+            payloads.update((aid, payload) for aid in article_ids)
+
+        if not payloads:
+            if monitor:
+                monitor.update()
+            return
+
+        batches = list(splitlist(payloads.items(), itemsperbatch=1000))
+        monitor = monitor.submonitor(total=len(batches))
+
+        nbatches = len(batches)
+        for i, batch in enumerate(batches):
+            monitor.update(message="Adding batch {iplus}/{nbatches}..".format(iplus=i+1, nbatches=nbatches))
+            body = get_bulk_body(dict(batch), action="update")
+            resp = self.es.bulk(body=body, index=self.index, doc_type=settings.ES_ARTICLE_DOCTYPE)
+
+            if resp["errors"]:
+                raise ElasticSearchError(resp)
+
     def get_tokens(self, aid: int, fields=["text", "title"]):
         """
         Get a list of all tokens (words and their positions) in the given document
@@ -600,12 +680,29 @@ class _ES(object):
 
     def synchronize_articleset(self, aset, full_refresh=False):
         """
-        Make sure the given articleset is correctly stored in the index
+        Make sure the given articleset is correctly stored in the index. After applying
+        pending changes (see ArticleSetChange), the number of articles in the index and
+        database are compared; only if they differ are all ids compared.
         @param full_refresh: if true, re-add all articles to the index. Use this
                              after changing properties of articles
         """
+        from amcat.models.articleset import apply_index_changes, ArticleSetArticle
+
         self.check_index()  # make sure index exists and is at least 'yellow'
 
+        log.debug("Applying pending changes")
+        apply_index_changes(articleset_ids=[aset.id])
+
+        if not full_refresh:
+            # Pending changes are applied, so in the common case verifying counts suffices
+            self.refresh()
+            nes = self.count(filters={"sets": aset.id})
+            ndb = ArticleSetArticle.objects.filter(articleset=aset).count()
+            if nes == ndb:
+                log.info("Index of set {aset.id} verified: {ndb} articles".format(**locals()))
+                return
+            log.warning("Index of set {aset.id} has {nes} articles, database {ndb}".format(**locals()))
+
         log.debug("Getting SOLR ids from set")
         solr_set_ids = set(self.query_ids(filters=dict(sets=[aset.id])))
         log.debug("Getting DB ids")
@@ -821,8 +918,8 @@ class _ES(object):
         hash = get_article_dict(article).hash
         return self.query(filters={'hashes': hash}, fields=["sets"], score=False)
 
-    def _get_purge_actions(self, query):
-        for id in self.query_ids(body=query):
+    def _get_purge_actions(self, article_ids):
+        for id in article_ids:
             yield {
                 "_op_type": "delete",
                 "_id": id,
@@ -831,9 +928,11 @@ class _ES(object):
             }
 
     def purge_orphans(self):
-        """Remove all articles without set from the index"""
+        """Remove all articles without set (and their sentences) from the index"""
         query =  {"query": {"constant_score": {"filter": {"missing": {"field": "sets"}}}}}
-        return bulk(self.es, self._get_purge_actions(query))
+        article_ids = list(self.query_ids(body=query))
+        self.delete_sentences(article_ids)
+        return bulk(self.es, self._get_purge_actions(article_ids))
 
     def get_child_type_counts(self, **filters):
         """Get the number of child documents per type"""
@@ -853,6 +952,152 @@ class _ES(object):
         body = {"filter": {"bool" : {"must" : [filter, nochild]}}}
         return self.query_ids(body=body, limit=limit)
 
+    ### Sentences ###
+
+    @cached
+    def check_sentence_mapping(self):
+        """
+        Check whether the index has the sentence doctype. As elastic does not allow adding a
+        child type to an existing parent type, indices created before sentences were indexed
+        need to be copied into a new index with `manage.py upgrade_elastic --reindex-into`.
+        """
+        if not self.exists_type(settings.ES_SENTENCE_DOCTYPE):
+            raise ElasticSearchError("Index {self.index} has no {settings.ES_SENTENCE_DOCTYPE} mapping, "
+                                     "run upgrade_elastic --reindex-into to create a new index"
+                                     .format(settings=settings, **locals()))
+        return True
+
+    def reindex_into(self, index, chunk_size=500):
+        """
+        Create index with the current mappings and copy all articles into it
+
+        @return: the number of articles copied
+        """
+        target = ES(index=index, doc_type=self.doc_type, host=self.host, port=self.port)
+        target.create_index()
+        query = {"query": {"match_all": {}}}
+        ncopied, _errors = reindex(self.es, self.index, index, query=query, chunk_size=chunk_size,
+                                   scan_kwargs={"doc_type": self.doc_type})
+        return ncopied
+
+    def bulk_insert_sentences(self, sentences, batch_size=1000, monitor=NullMonitor()):
+        """
+        Index the given Sentence objects as children of their articles, in batches of batch_size
+        """
+        self.check_sentence_mapping()
+        batches = list(toolkit.splitlist(sentences, itemsperbatch=batch_size)) if batch_size else [sentences]
+        monitor = monitor.submonitor(total=len(batches))
+        nbatches = len(batches)
+        for i, batch in enumerate(batches):
+            monitor.update(1, "Adding sentence batch {iplus}/{nbatches}".format(iplus=i+1, **locals()))
+            if not batch:
+                continue
+            body = "".join("{}\n{}\n".format(serialize({"index": {"_id": s.id, "_parent": s.article_id}}),
+                                               serialize(get_sentence_dict(s)))
+                           for s in batch)
+            resp = self.es.bulk(body=body, index=self.index, doc_type=settings.ES_SENTENCE_DOCTYPE)
+            if resp["errors"]:
+                raise ElasticSearchError(resp)
+
+    def _get_sentence_purge_actions(self, article_ids, batch_size=1000):
+        for batch in splitlist(article_ids, itemsperbatch=batch_size):
+            query = {"query": {"constant_score": {"filter": {"terms": {"article_id": batch}}}}}
+            hits = scan(self.es, index=self.index, doc_type=settings.ES_SENTENCE_DOCTYPE, query=query,
+                        fields=["article_id"])
+            for hit in hits:
+                yield {
+                    "_op_type": "delete",
+                    "_id": hit["_id"],
+                    "_parent": hit["fields"]["article_id"][0],
+                    "_index": self.index,
+                    "_type": settings.ES_SENTENCE_DOCTYPE
+                }
+
+    def delete_sentences(self, article_ids):
+        """Remove the indexed sentences of the given articles"""
+        if article_ids and self.exists_type(settings.ES_SENTENCE_DOCTYPE):
+            bulk(self.es, self._get_sentence_purge_actions(article_ids))
+
+    def add_sentences(self, article_ids, batch_size=1000):
+        """
+        Index the sentences of the given articles. Articles which are not yet split
+        into sentences are split (and their sentences saved) first.
+        """
+        from amcat.models import Article, Sentence
+        from amcat.tools import sbd
+
+        for batch in splitlist(article_ids, itemsperbatch=batch_size):
+            sentences = list(Sentence.objects.filter(article_id__in=batch))
+            unsplit = set(batch) - {s.article_id for s in sentences}
+            for article in Article.objects.filter(pk__in=unsplit).only("id", "title", "text"):
+                sentences.extend(sbd.create_sentences(article, index=False))
+            self.bulk_insert_sentences(sentences, batch_size=None)
+
+    def backfill_sentences(self, batch_size=1000, monitor=NullMonitor(), **filters):
+        """
+        Index sentences of all articles matching filters (e.g. sets=123) of which no
+        sentences are indexed yet. Batches are committed to the index one by one, so
+        an interrupted backfill continues where it stopped when called again.
+
+        @return: the number of articles processed
+        """
+        self.check_sentence_mapping()
+        article_ids = list(self.get_articles_without_child(settings.ES_SENTENCE_DOCTYPE, **filters))
+
+        batches = list(splitlist(article_ids, itemsperbatch=batch_size))
+        monitor = monitor.submonitor(total=len(batches))
+        nbatches = len(batches)
+        for i, batch in enumerate(batches):
+            monitor.update(1, "Indexing sentences of batch {iplus}/{nbatches}".format(iplus=i+1, **locals()))
+            self.add_sentences(batch, batch_size=None)
+        return len(article_ids)
+
+    def _get_sentence_body(self, query=None, filters=None):
+        """Build a body matching sentences. Filters are applied to the (parent) articles."""
+        clauses = []
+        article_filter = dict(build_body(filters=filters or EMPTY_RO_DICT)).get("filter")
+        if article_filter is not None:
+            clauses.append({"has_parent": {"parent_type": settings.ES_ARTICLE_DOCTYPE, "filter": article_filter}})
+        if query:
+            terms = queryparser.parse_to_terms(query) if isinstance(query, str) else query
+            clauses.append(terms.get_filter_dsl())
+        return {"query": {"constant_score": {"filter": combine_filters(clauses) or {"match_all": {}}}}}
+
+    def count_sentences(self, query=None, filters=None):
+        """Count the sentences matching query in articles matching filters"""
+        body = self._get_sentence_body(query, filters)
+        return self.es.count(index=self.index, doc_type=settings.ES_SENTENCE_DOCTYPE, body=body)["count"]
+
+    def query_sentences(self, query=None, filters=None, highlight=False, size=10, from_=0):
+        """
+        Return the sentences matching query in articles matching filters, which can be
+        used as keyword in context at sentence level.
+
+        @param highlight: if True, add the sentence with query terms marked as 'highlight'
+        @return: SearchResult with id, article_id, parnr, sentnr and sentence
+        """
+        body = self._get_sentence_body(query, filters)
+        body["sort"] = ["article_id", "parnr", "sentnr"]
+        if highlight and query:
+            terms = queryparser.parse_to_terms(query) if isinstance(query, str) else query
+            body["highlight"] = {
+                "pre_tags": HIGHLIGHT_OPTIONS["pre_tags"], "post_tags": HIGHLIGHT_OPTIONS["post_tags"],
+                "fields": {"sentence": {"number_of_fragments": 0, "highlight_query": terms.get_dsl()}}
+            }
+
+        fields = ["article_id", "parnr", "sentnr", "sentence"]
+        result = self.es.search(index=self.index, doc_type=settings.ES_SENTENCE_DOCTYPE, body=body,
+                                fields=fields, size=size, from_=from_)
+        return SearchResult(result, fields, False, body, query=query)
+
+    def sentence_counts(self, query=None, filters=None):
+        """Return a mapping of article id to the number of sentences matching query"""
+        body = self._get_sentence_body(query, filters)
+        body["aggregations"] = {"articles": {"terms": {"field": "article_id", "size": 0}}}
+        result = self.es.search(index=self.index, doc_type=settings.ES_SENTENCE_DOCTYPE, body=body,
+                                search_type="count")
+        return {b["key"]: b["doc_count"] for b in result["aggregations"]["articles"]["buckets"]}
+
 
 _singletons = {}
 def ES(index:str=None, doc_type:str=None, host:str=None, port:int=None) -> _ES:
@@ -931,6 +1176,25 @@ def get_filter_clauses(start_date=None, end_date=None, on_date=None, **filters):
 
 
 
+class SentenceQuery(object):
+    """
+    Wraps a parsed query (see queryparser), such that it matches articles with at least
+    one sentence matching the query. It can be passed to all _ES methods accepting a
+    query instead of a query string.
+    """
+    def __init__(self, terms):
+        self.terms = terms
+
+    def __str__(self):
+        return "SENTENCE[{self.terms}]".format(**locals())
+
+    def get_dsl(self):
+        return {"has_child": {"type": settings.ES_SENTENCE_DOCTYPE, "query": self.terms.get_dsl()}}
+
+    def get_filter_dsl(self):
+        return {"has_child": {"type": settings.ES_SENTENCE_DOCTYPE, "filter": self.terms.get_filter_dsl()}}
+
+
 def combine_filters(filters):
     if len(filters) == 0:
         return None
@@ -949,13 +1213,14 @@ def build_body(query=None, filters=EMPTY_RO_DICT, query_as_filter=False):
     """
     Construct the query body from the query and/or filter(s)
     (call with dict(build_body)
-    @param query: an elastic query string (i.e. lucene syntax, e.g. 'piet AND (ja* OR klaas)')
+    @param query: an elastic query string (i.e. lucene syntax, e.g. 'piet AND (ja* OR klaas)'),
+                  or a query already parsed by queryparser (see SearchQuery.get_terms)
     @param filters: field filter DSL query dict, defaults to build_filter(**filters)
     @param query_as_filter: if True, use the query as a filter (faster but not score/relevance)
     """
     filters = list(get_filter_clauses(**filters))
     if query:
-        terms = queryparser.parse_to_terms(query)
+        terms = queryparser.parse_to_terms(query) if isinstance(query, str) else query
         if query_as_filter:
             filters.append(terms.get_filter_dsl())
         else:
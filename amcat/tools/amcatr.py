@@ -2,55 +2,122 @@
 Useful functions for interfacing with R
 """
 
+import datetime
+import decimal
+import zlib
+from collections import OrderedDict
+
 from rpy2 import robjects, rinterface
 from rpy2.rlike.container import OrdDict
 
+# Size of the chunks yielded by iter_rda
+RDA_CHUNK_SIZE = 1024 * 1024
+
+
+def _get_vector_type(values):
+    """
+    Determine the R vector type for a column of python values in a single pass.
+    Returns a (vector class, NA value, python conversion function or None) tuple.
+    """
+    types = {type(x) for x in values if x is not None}
+    if not types or types == {bool}:
+        return robjects.BoolVector, rinterface.NA_Logical, None
+    if types == {int}:
+        return robjects.IntVector, rinterface.NA_Integer, None
+    if types <= {bool, int, float, decimal.Decimal}:
+        return robjects.FloatVector, rinterface.NA_Real, float
+    if types <= {datetime.date, datetime.datetime}:
+        return robjects.StrVector, rinterface.NA_Character, lambda d: d.isoformat()
+    if types == {str}:
+        return robjects.StrVector, rinterface.NA_Character, None
+    if all(issubclass(t, (str, int, float, bool, decimal.Decimal, datetime.date)) for t in types):
+        return robjects.StrVector, rinterface.NA_Character, str
+    raise TypeError("Don't know how to convert {} to R".format(", ".join(t.__name__ for t in types)))
+
+
 def to_r(values):
     """
     Convert primitive python value(s) into an R vector
 
-    values should be a object or tuple/list of a primitive type (bool, int, str)
-    If values is already an R vector, it is returned unmodified
+    values should be a object or tuple/list of primitive values (bool, int, float, str, date).
+    Columns of mixed numbers become numeric vectors, other mixed columns character vectors.
+    Dicts are converted to named lists. If values is already an R vector, it is returned unmodified
     """
     if isinstance(values, rinterface.SexpVector):
         return values
+    if isinstance(values, dict):
+        return robjects.ListVector([(str(k), to_r(v)) for (k, v) in values.items()])
     if not isinstance(values, (tuple, list)):
         values = [values]
-    val = next((x for x in values if x is not None), None)
-    if isinstance(val, bool):
-        vtype, natype = robjects.BoolVector, rinterface.NA_Integer        
-    elif isinstance(val, int) or (val is None):
-        vtype, natype = robjects.IntVector, rinterface.NA_Integer
-    elif isinstance(val, (str, unicode)):
-        vtype, natype = robjects.StrVector, rinterface.NA_Character
-    else:
-        raise TypeError("Don't know how to convert {} to R".format(type(val)))
 
-    values = [natype if x is None else x for x in values]
+    vtype, natype, convert = _get_vector_type(values)
+    if convert is None:
+        values = [natype if x is None else x for x in values]
+    else:
+        values = [natype if x is None else convert(x) for x in values]
     return vtype(values)
-    
+
+
+def rows_to_columns(rows):
+    """
+    Pivot a sequence of dicts to an ordered mapping of column name -> list of values. Columns
+    are ordered by first occurrence, missing values are None.
+    """
+    names = OrderedDict()
+    for row in rows:
+        for name in row:
+            if name not in names:
+                names[name] = None
+    return OrderedDict((name, [row.get(name) for row in rows]) for name in names)
+
 
 def create_dataframe(columns):
     """
-    Create a data frame from [(name, values), ..] columns (e.g. from a dict.iteritems())
+    Create a data frame from [(name, values), ..] columns (e.g. from a dict.items())
     """
     result = OrdDict()
     for name, values in columns:
         result[name] = to_r(values)
     return robjects.DataFrame(result)
 
+
+def _raw_to_bytes(raw):
+    if hasattr(raw, "memoryview"):
+        return raw.memoryview().tobytes()
+    return bytes(bytearray(x if isinstance(x, int) else ord(x) for x in raw))
+
+
+def serialize_rda(**objects):
+    """Serialise one or more objects to the (uncompressed) .rda format, in-memory"""
+    env = robjects.r["new.env"]()
+    for name, val in objects.items():
+        env[str(name)] = to_r(val)
+    con = robjects.r["rawConnection"](robjects.r["raw"](0), "wb")
+    try:
+        robjects.r["save"](list=robjects.StrVector(list(map(str, objects))), file=con, envir=env)
+        return _raw_to_bytes(robjects.r["rawConnectionValue"](con))
+    finally:
+        robjects.r["close"](con)
+
+
+def iter_rda(chunk_size=RDA_CHUNK_SIZE, **objects):
+    """Yield a gzip compressed .rda file containing the given objects in chunks"""
+    data = serialize_rda(**objects)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for i in range(0, len(data), chunk_size):
+        chunk = compressor.compress(data[i:i+chunk_size])
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
 def save(filename, **objects):
     """Save one or more R objects as .rda file"""
-    for name, val in objects.iteritems():
-        robjects.rinterface.globalenv[str(name)]=to_r(val)
-    robjects.r.save(file=filename, *objects.keys())
+    with open(filename, "wb") as f:
+        for chunk in iter_rda(**objects):
+            f.write(chunk)
+
 
 def save_to_bytes(**objects):
     """Save R objects to an .rda, returned as bytes (i.e. in-memory)"""
-    import os, tempfile
-    from tempfile import NamedTemporaryFile
-    with NamedTemporaryFile() as f:
-        save(f.name, **objects)
-        result = f.read()
-    return result
-    
+    return b"".join(iter_rda(**objects))
@@ -0,0 +1,467 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+Benchmarks of the search, aggregation, upload and export hot paths.
+
+A benchmark run first generates a synthetic corpus (see create_corpus): a project with
+article sets, a codebook and coded codingjobs. Texts are drawn from a generated vocabulary
+with a Zipf-like distribution, so the corpus is identical for the same parameters and seed.
+Every benchmark is then called once to count its sql queries and elastic calls, and timed
+`repeat` times.
+
+The result is a report: a json-serialisable dict with the parameters, the environment and
+the timings of each benchmark. Reports can be compared with compare() to find regressions.
+
+Benchmarks fill the database and elastic index they are run against, so they should not
+be run on a production database: the benchmark management command creates a throwaway
+database and index.
+"""
+import bisect
+import collections
+import datetime
+import itertools
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+
+from django.utils.datastructures import MultiValueDict
+
+import amcat
+from amcat.models import Article, ArticleSet, Codebook, Code, Language
+from amcat.models.coding.codedarticle import bulk_replace_codings
+from amcat.tools import amcattest, telemetry
+from amcat.tools.amcates import ES
+from amcat.tools.djangotoolkit import list_queries
+from amcat.tools.progress import NullMonitor
+
+log = logging.getLogger(__name__)
+
+# Increase if the layout of a report changes
+REPORT_VERSION = 1
+
+# Relative change of the median duration considered a regression (or improvement) by compare()
+DEFAULT_THRESHOLD = 0.2
+
+SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "ta", "be", "so", "di", "ga", "po", "ve", "an", "el", "or", "us")
+MEDIA = ("Telegraaf", "NRC", "Volkskrant", "Trouw", "AD", "Parool", "Metro", "Spits")
+START_DATE = datetime.datetime(2015, 1, 1)
+DATE_RANGE_DAYS = 730
+
+LEXISNEXIS_FILE = os.path.join(os.path.dirname(amcat.__file__), "scripts", "article_upload", "tests",
+                               "test_files", "lexisnexis", "test.txt")
+
+# Corpus parameters and their defaults, see create_corpus
+DEFAULT_PARAMETERS = collections.OrderedDict((
+    ("articles", 2000),
+    ("sets", 2),
+    ("words", 200),
+    ("vocabulary", 5000),
+    ("codes", 50),
+    ("jobs", 2),
+    ("batch", 500),
+    ("lexisnexis", 500),
+    ("seed", 1),
+))
+
+
+class Corpus(object):
+    """Synthetic corpus generated by create_corpus"""
+
+    def __init__(self, parameters, rng, vocabulary, project, articlesets, codebook, fields, codingjobs):
+        self.parameters = parameters
+        self.rng = rng
+        self.vocabulary = vocabulary
+        self.project = project
+        self.articlesets = articlesets
+        self.codebook = codebook
+        self.fields = fields
+        self.codingjobs = codingjobs
+        self._cumulative_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+    def get_articleset_ids(self):
+        return [s.id for s in self.articlesets]
+
+    def get_queries(self, n=6):
+        """Return n single-word queries, the most frequent words of the vocabulary"""
+        return self.vocabulary[:n]
+
+    def get_words(self, n):
+        """Draw n words from the vocabulary, with a frequency inversely proportional to their rank"""
+        total = self._cumulative_weights[-1]
+        weights = self._cumulative_weights
+        return [self.vocabulary[bisect.bisect(weights, self.rng.random() * total)] for _ in range(n)]
+
+    def get_articles(self, n):
+        """Generate n (unsaved) articles in the project of this corpus"""
+        nwords = self.parameters["words"]
+        for _ in range(n):
+            words = self.get_words(self.rng.randint(nwords // 2, nwords * 3 // 2))
+            date = START_DATE + datetime.timedelta(days=self.rng.randrange(DATE_RANGE_DAYS),
+                                                   seconds=self.rng.randrange(86400))
+            article = Article(title=" ".join(words[:8]).capitalize(), text=_get_text(words), date=date,
+                              url="http://example.com/{}".format(self.rng.getrandbits(64)), project=self.project)
+            article.properties.update({"medium": self.rng.choice(MEDIA), "page_int": self.rng.randint(1, 40)})
+            yield article
+
+
+def _get_text(words, sentence_length=15):
+    sentences = (" ".join(words[i:i+sentence_length]) for i in range(0, len(words), sentence_length))
+    return " ".join(s.capitalize() + "." for s in sentences)
+
+
+def get_vocabulary(size, rng):
+    """Generate `size` distinct words of two to four syllables"""
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def create_codebook(project, ncodes, rng):
+    """Create a codebook with ncodes codes, a tenth of which are roots of the others"""
+    language = Language.objects.get(pk=1)
+    codebook = Codebook.objects.create(project=project, name="benchmark codebook")
+    codes = [Code.create("code {}".format(i), language) for i in range(ncodes)]
+    roots = codes[:max(1, ncodes // 10)]
+    codebook.add_codes([(code, None) for code in roots] + [(code, rng.choice(roots)) for code in codes[len(roots):]])
+    return codebook
+
+
+def create_codings(codingjob, fields, codes, rng):
+    """Code every article in codingjob with random values for the text, number and code fields"""
+    strf, intf, codef = fields
+    coding_dicts = {}
+    for coded_article_id in codingjob.coded_articles.order_by("id").values_list("id", flat=True):
+        values = [{"codingschemafield_id": strf.id, "intval": None, "strval": rng.choice(MEDIA)},
+                  {"codingschemafield_id": intf.id, "intval": rng.randint(-5, 5), "strval": None},
+                  {"codingschemafield_id": codef.id, "intval": rng.choice(codes).id, "strval": None}]
+        coding_dicts[coded_article_id] = [{"sentence_id": None, "start": None, "end": None, "values": values}]
+    bulk_replace_codings(codingjob, coding_dicts)
+
+
+def create_corpus(monitor=NullMonitor(), **parameters):
+    """
+    Create a synthetic corpus in the database and elastic index
+
+    @param parameters: overrides of DEFAULT_PARAMETERS: the number of articles (divided over `sets`
+                       article sets), the average number of words per article, the vocabulary
+                       size, the number of codes, the number of codingjobs (each coding one of
+                       the sets), the number of articles created in the create_articles benchmark
+                       and parsed in the lexisnexis benchmark, and the random seed
+    @rtype: Corpus
+    """
+    unknown = set(parameters) - set(DEFAULT_PARAMETERS)
+    if unknown:
+        raise ValueError("Unknown corpus parameter(s): {}".format(", ".join(sorted(unknown))))
+    parameters = collections.OrderedDict(DEFAULT_PARAMETERS, **parameters)
+    monitor = monitor.submonitor(2 + parameters["sets"] + parameters["jobs"])
+
+    rng = random.Random(parameters["seed"])
+    project = amcattest.create_test_project(name="benchmark")
+    corpus = Corpus(parameters, rng, get_vocabulary(parameters["vocabulary"], rng), project,
+                    articlesets=[], codebook=None, fields=None, codingjobs=[])
+
+    narticles = parameters["articles"] // parameters["sets"]
+    for i in range(parameters["sets"]):
+        monitor.update(message="Creating article set {} of {}".format(i + 1, parameters["sets"]))
+        articleset = ArticleSet.objects.create(project=project, name="benchmark set {}".format(i))
+        Article.create_articles(list(corpus.get_articles(narticles)), articleset=articleset)
+        corpus.articlesets.append(articleset)
+
+    monitor.update(message="Creating codebook")
+    corpus.codebook = create_codebook(project, parameters["codes"], rng)
+    schema, _, strf, intf, codef, _, _ = amcattest.create_test_schema_with_fields(
+        codebook=corpus.codebook, project=project, isarticleschema=True)
+    corpus.fields = (strf, intf, codef)
+    codes = sorted(corpus.codebook.get_codes(), key=lambda c: c.id)
+
+    for i in range(parameters["jobs"]):
+        monitor.update(message="Coding codingjob {} of {}".format(i + 1, parameters["jobs"]))
+        articleset = corpus.articlesets[i % len(corpus.articlesets)]
+        codingjob = amcattest.create_test_job(project=project, articleset=articleset, articleschema=schema)
+        create_codings(codingjob, corpus.fields, codes, rng)
+        corpus.codingjobs.append(codingjob)
+
+    monitor.update(message="Refreshing index")
+    ES().refresh()
+    return corpus
+
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The decorated function is called with a Corpus, and returns the
+    function to time. It can also return a (setup, function) pair, in which case setup is
+    called (untimed) before every call, and its result passed to the function.
+    """
+    def inner(func):
+        BENCHMARKS[name] = func
+        return func
+    return inner
+
+
+def _get_query_action(corpus, action_class, data):
+    action = action_class(user=corpus.project.owner, project=corpus.project,
+                          articlesets=ArticleSet.objects.filter(id__in=corpus.get_articleset_ids()), data=data)
+    form = action.get_form()
+    form.full_clean()
+    if not form.is_valid():
+        raise ValueError("Invalid benchmark form: {}".format(form.errors))
+    return action, form
+
+
+@benchmark("create_articles")
+def bench_create_articles(corpus):
+    def setup():
+        articleset = ArticleSet.objects.create(project=corpus.project, name="benchmark upload")
+        return articleset, list(corpus.get_articles(corpus.parameters["batch"]))
+
+    def create_articles(args):
+        articleset, articles = args
+        Article.create_articles(articles, articleset=articleset)
+
+    return setup, create_articles
+
+
+@benchmark("lexisnexis")
+def bench_lexisnexis(corpus):
+    from amcat.scripts.article_upload.plugins.lexisnexis import split_header, split_file, parse_article
+
+    # The body of the test file contains four documents, which is repeated to get a large file
+    with open(LEXISNEXIS_FILE, encoding="utf-8") as f:
+        header, body = split_header(f.read())
+    text = "\n\n".join([header] + [body] * max(1, corpus.parameters["lexisnexis"] // 4))
+
+    def parse():
+        query, fragments = split_file(text)
+        return [parse_article(fragment) for fragment in fragments]
+
+    return parse
+
+
+def _bench_selection_aggregate(corpus, data):
+    from amcat.scripts.query import AggregationAction
+    from amcat.tools.keywordsearch import SelectionSearch
+
+    data = dict({"output_type": "text/json+aggregation+table"}, **data)
+    _, form = _get_query_action(corpus, AggregationAction, data)
+    categories = list(filter(None, [form.cleaned_data["primary"], form.cleaned_data["secondary"]]))
+
+    def aggregate():
+        return list(SelectionSearch(form).get_aggregate(categories, flat=False))
+
+    return aggregate
+
+
+@benchmark("aggregate_date")
+def bench_aggregate_date(corpus):
+    return _bench_selection_aggregate(corpus, {"primary": "date_month"})
+
+
+@benchmark("aggregate_medium_term")
+def bench_aggregate_medium_term(corpus):
+    query = "\n".join(corpus.get_queries())
+    return _bench_selection_aggregate(corpus, {"primary": "medium_str", "secondary": "term", "query": query})
+
+
+@benchmark("association")
+def bench_association(corpus):
+    from amcat.tools.association import Association
+    from amcat.tools.keywordsearch import SearchQuery
+
+    queries = [SearchQuery.from_string(q) for q in corpus.get_queries()]
+    filters = {"sets": corpus.get_articleset_ids()}
+
+    def association():
+        return list(Association(queries, filters, interval="month").get_conditional_probabilities())
+
+    return association
+
+
+@benchmark("clustermap")
+def bench_clustermap(corpus):
+    from amcat.scripts.query import ClusterMapAction
+
+    data = {"output_type": "application/json+clustermap+table", "query": "\n".join(corpus.get_queries())}
+    action, form = _get_query_action(corpus, ClusterMapAction, data)
+    return lambda: action.run(form)
+
+
+@benchmark("orm_aggregate")
+def bench_orm_aggregate(corpus):
+    from amcat.tools.aggregate_orm import ORMAggregate, SchemafieldCategory, ArticleFieldCategory
+    from amcat.tools.aggregate_orm import CountArticlesValue, AverageValue
+
+    article_ids = list(set(itertools.chain.from_iterable(s.get_article_ids() for s in corpus.articlesets)))
+    codingjob_ids = [job.id for job in corpus.codingjobs]
+    _, intf, codef = corpus.fields
+
+    def aggregate():
+        aggregate = ORMAggregate.from_articles(article_ids, codingjob_ids)
+        categories = [SchemafieldCategory(codef, prefix="A"), ArticleFieldCategory.from_field_name("date", interval="month")]
+        values = [CountArticlesValue(), AverageValue(intf, prefix="B")]
+        return list(aggregate.get_aggregate(categories, values))
+
+    return aggregate
+
+
+@benchmark("codingjob_export")
+def bench_codingjob_export(corpus):
+    from amcat.forms import validate
+    from amcat.scripts.actions.get_codingjob_results import CodingJobResultsForm, GetCodingJobResults
+    from amcat.scripts.actions.get_codingjob_results import _get_field_prefix
+
+    data = {
+        "codingjobs": [job.id for job in corpus.codingjobs],
+        "export_format": ["csv"],
+        "export_level": ["0"],
+        "meta_article_title": ["1"],
+        "meta_article_date": ["1"],
+        "date_format": ["%Y-%m-%d"],
+        "aggregation_medium_language": [Language.objects.get(pk=1).id],
+    }
+    for field in corpus.fields:
+        data[_get_field_prefix(field) + "_included"] = ["1"]
+
+    def setup():
+        form = CodingJobResultsForm(data=MultiValueDict(data), project=corpus.project)
+        validate(form)
+        return GetCodingJobResults(form)
+
+    return setup, lambda script: script.run()
+
+
+def time_function(func, setup=None, repeat=5, clock=time.perf_counter):
+    """
+    Call func `repeat` times and return the durations in seconds. If setup is given, it is
+    called before every call (untimed) and its result is passed to func.
+    """
+    durations = []
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = clock()
+        func(*args)
+        durations.append(clock() - start)
+    return durations
+
+
+def count_calls(func, setup=None):
+    """Call func once (see time_function), and return the number of sql queries and elastic calls"""
+    args = () if setup is None else (setup(),)
+    es_calls = []
+    with list_queries() as queries, telemetry.record_es_calls(es_calls):
+        func(*args)
+    return len(queries), len(es_calls)
+
+
+def measure(func, setup=None, repeat=5):
+    """
+    Measure a function, see time_function. The first call is a warmup call, which counts
+    the sql queries and elastic calls and is not timed.
+    @return: a dict with the number of calls and sql queries and elastic calls per call, and the
+             min, median, mean and max duration in seconds
+    """
+    sql_queries, es_calls = count_calls(func, setup)
+    durations = time_function(func, setup, repeat)
+    return collections.OrderedDict((
+        ("repeat", repeat), ("sql_queries", sql_queries), ("es_calls", es_calls),
+        ("min", min(durations)), ("median", statistics.median(durations)),
+        ("mean", statistics.mean(durations)), ("max", max(durations)),
+    ))
+
+
+def get_commit():
+    """Return the git commit of the working directory of AmCAT, or None if it cannot be determined"""
+    try:
+        output = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(amcat.__file__),
+                                         stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode("ascii").strip()
+
+
+def run_benchmarks(corpus, names=None, repeat=5, monitor=NullMonitor()):
+    """
+    Run the given benchmarks (default: all) on the given corpus
+    @type corpus: Corpus
+    @return: a report (json-serialisable dict)
+    """
+    names = list(BENCHMARKS) if names is None else list(names)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError("Unknown benchmark(s): {}".format(", ".join(sorted(unknown))))
+
+    monitor = monitor.submonitor(len(names))
+    results = collections.OrderedDict()
+    for name in names:
+        monitor.update(0, "Running benchmark {name}".format(**locals()))
+        prepared = BENCHMARKS[name](corpus)
+        setup, func = prepared if isinstance(prepared, tuple) else (None, prepared)
+        results[name] = measure(func, setup, repeat)
+        log.info("{name}: median {median:.3f}s".format(name=name, **results[name]))
+        monitor.update()
+
+    return collections.OrderedDict((
+        ("version", REPORT_VERSION),
+        ("timestamp", datetime.datetime.now().isoformat()),
+        ("amcat_version", amcat.__version__),
+        ("commit", get_commit()),
+        ("python", platform.python_version()),
+        ("host", platform.node()),
+        ("parameters", corpus.parameters),
+        ("benchmarks", results),
+    ))
+
+
+def compare(old, new, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare the median durations of two reports.
+    @param threshold: relative change of the median considered a regression or improvement
+    @return: a list of (name, old median, new median, ratio, status) tuples, where status is one of
+             'regression', 'improvement', 'ok', 'new' or 'removed'
+    """
+    if old.get("parameters") != new.get("parameters"):
+        log.warning("Comparing reports with different parameters: {} and {}"
+                    .format(old.get("parameters"), new.get("parameters")))
+
+    old_results, new_results = old["benchmarks"], new["benchmarks"]
+    rows = []
+    for name in list(old_results) + [n for n in new_results if n not in old_results]:
+        old_median = old_results[name]["median"] if name in old_results else None
+        new_median = new_results[name]["median"] if name in new_results else None
+        if old_median is None or new_median is None:
+            status, ratio = ("new" if old_median is None else "removed"), None
+        else:
+            ratio = new_median / old_median if old_median else float("inf")
+            if ratio > 1 + threshold:
+                status = "regression"
+            elif ratio < 1 / (1 + threshold):
+                status = "improvement"
+            else:
+                status = "ok"
+        rows.append((name, old_median, new_median, ratio, status))
+    return rows
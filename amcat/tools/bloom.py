@@ -0,0 +1,77 @@
+# ##########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+A simple Bloom filter: a compact set representation that can tell whether an element is
+definitely not in the set. Membership tests can give false positives (at most error_rate
+when no more than capacity elements are added), but never false negatives.
+"""
+
+import hashlib
+import math
+import struct
+
+_HEADER = struct.Struct("<QQQI")
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        @param capacity: the number of elements this filter is sized for
+        @param error_rate: the false positive rate when capacity elements are added
+        """
+        self.capacity = int(capacity)
+        self.nbits = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.nhashes = max(1, int(round(self.nbits / self.capacity * math.log(2))))
+        self.bits = bytearray((self.nbits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        digest = hashlib.md5(key).digest()
+        # Double hashing: position i is h1 + i*h2, see Kirsch & Mitzenmacher (2006)
+        h1, h2 = struct.unpack("<QQ", digest)
+        return ((h1 + i * h2) % self.nbits for i in range(self.nhashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def is_full(self):
+        return self.count > self.capacity
+
+    def to_bytes(self) -> bytes:
+        return _HEADER.pack(self.capacity, self.count, self.nbits, self.nhashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        data = bytes(data)
+        bloom = cls.__new__(cls)
+        bloom.capacity, bloom.count, bloom.nbits, bloom.nhashes = _HEADER.unpack_from(data)
+        bloom.bits = bytearray(data[_HEADER.size:])
+        return bloom
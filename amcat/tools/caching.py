@@ -124,10 +124,89 @@ def set_cache(obj, name, value, cache_attr=""):
 #                       O B J E C T   C A C H I N G                       #
 ###########################################################################
 
-# Setup thread-local cache for codebooks
+# Model objects are cached in a bounded, thread-local LRU cache per model (model objects are
+# mutable, so sharing them between threads is unsafe). All caches of a model are registered,
+# so that saving or deleting an object invalidates it in every thread. Optionally, objects
+# are also stored in the django cache, which is shared between processes.
+import collections
 import threading
+import time
+import weakref
+
+from django.core.cache import cache as shared_cache
+from django.db.models.signals import post_save, post_delete
+
+OBJECT_CACHE_SIZE = getattr(settings, 'OBJECT_CACHE_SIZE', 1000)
+OBJECT_CACHE_SECONDS = getattr(settings, 'OBJECT_CACHE_SECONDS', 300)
+OBJECT_CACHE_SHARED = getattr(settings, 'OBJECT_CACHE_SHARED', False)
 
 _object_cache = threading.local()
+_object_caches = collections.defaultdict(weakref.WeakSet)
+_object_caches_lock = threading.Lock()
+
+
+class ObjectCache(object):
+    """
+    LRU cache mapping primary keys to model objects, of which entries expire after
+    `timeout` seconds. Keeps track of hits, misses and evictions.
+    """
+    def __init__(self, maxsize=OBJECT_CACHE_SIZE, timeout=OBJECT_CACHE_SECONDS):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = self.misses = self.evictions = 0
+        self._objects = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pk):
+        """Return cached object or raise KeyError"""
+        with self._lock:
+            try:
+                expires, obj = self._objects[pk]
+            except KeyError:
+                self.misses += 1
+                raise
+
+            if expires < time.time():
+                del self._objects[pk]
+                self.misses += 1
+                raise KeyError(pk)
+
+            self._objects.move_to_end(pk)
+            self.hits += 1
+            return obj
+
+    def set(self, pk, obj):
+        with self._lock:
+            self._objects[pk] = (time.time() + self.timeout, obj)
+            self._objects.move_to_end(pk)
+            while len(self._objects) > self.maxsize:
+                self._objects.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, pk):
+        with self._lock:
+            self._objects.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+
+    def __len__(self):
+        return len(self._objects)
+
+
+def _get_shared_cache_key(model, pk):
+    return "object-cache.{}".format(_get_cache_key(model, pk))
+
+
+def _invalidate_object(sender, instance, **kwargs):
+    """Signal receiver removing a saved or deleted object from all caches"""
+    with _object_caches_lock:
+        caches = list(_object_caches[sender])
+    for cache in caches:
+        cache.invalidate(instance.pk)
+    if OBJECT_CACHE_SHARED:
+        shared_cache.delete(_get_shared_cache_key(sender, instance.pk))
 
 
 def _get_object_cache(model):
@@ -135,45 +214,92 @@ def _get_object_cache(model):
     try:
         return getattr(_object_cache, key)
     except AttributeError:
-        cache = {}
+        cache = ObjectCache()
         setattr(_object_cache, key, cache)
+        with _object_caches_lock:
+            _object_caches[model].add(cache)
+        uid = CACHE_PREFIX + model._meta.label
+        post_save.connect(_invalidate_object, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(_invalidate_object, sender=model, weak=False, dispatch_uid=uid)
         return cache
 
 
+def _get_cached_object(model, cache, pk):
+    """Get object from local cache, falling back to the shared cache. Raises KeyError."""
+    try:
+        return cache.get(pk)
+    except KeyError:
+        if not OBJECT_CACHE_SHARED:
+            raise
+
+    obj = shared_cache.get(_get_shared_cache_key(model, pk))
+    if obj is None:
+        raise KeyError(pk)
+    cache.set(pk, obj)
+    return obj
+
+
+def _set_cached_object(model, cache, pk, obj):
+    cache.set(pk, obj)
+    if OBJECT_CACHE_SHARED:
+        shared_cache.set(_get_shared_cache_key(model, pk), obj, OBJECT_CACHE_SECONDS)
+
+
 def get_object(model, pk, create_if_needed=True, pkname='pk'):
     """Create the model object with the given pk, possibly retrieving it
     from cache"""
     cache = _get_object_cache(model)
     try:
-        return cache[pk]
+        return _get_cached_object(model, cache, pk)
     except KeyError:
         if create_if_needed:
-            cache[pk] = model.objects.get(**{pkname: pk})
-            return cache[pk]
+            obj = model.objects.get(**{pkname: pk})
+            _set_cached_object(model, cache, pk, obj)
+            return obj
 
 
 def get_objects(model, pks):
     """
-    Get or create the model objects, using one query for all creates
-    Does not preserve the order of objects in pks!
+    Get or create the model objects, using one query for all objects not
+    in the cache. Objects are yielded in the order of pks, non-existing pks
+    are skipped.
     """
-    todo = set()
-    for pk in pks:
-        obj = get_object(model, pk, create_if_needed=False)
-        if obj is None:
-            todo.add(pk)
-        else:
-            yield obj
-    if not todo: return
+    pks = list(pks)
     cache = _get_object_cache(model)
-    for obj in model.objects.filter(pk__in=todo):
-        cache[obj.id] = obj
-        yield obj
+
+    objects = {}
+    for pk in pks:
+        try:
+            objects[pk] = _get_cached_object(model, cache, pk)
+        except KeyError:
+            pass
+
+    todo = set(pks) - set(objects)
+    if todo:
+        for obj in model.objects.filter(pk__in=todo):
+            _set_cached_object(model, cache, obj.pk, obj)
+            objects[obj.pk] = obj
+
+    for pk in pks:
+        if pk in objects:
+            yield objects[pk]
+
+
+def get_cache_stats(model):
+    """Return hits, misses, evictions and size of the object caches of model, summed over all threads"""
+    with _object_caches_lock:
+        caches = list(_object_caches[model])
+    return {
+        "hits": sum(c.hits for c in caches),
+        "misses": sum(c.misses for c in caches),
+        "evictions": sum(c.evictions for c in caches),
+        "size": sum(len(c) for c in caches),
+    }
+
 
 def clear_cache(model):
     """Clear the local codebook cache manually, ie in between test runs"""
-    key = CACHE_PREFIX + model.__name__
-    setattr(_object_cache, key, {})
+    _get_object_cache(model).clear()
 
 
 ###########################################################################
@@ -22,6 +22,7 @@ Useful functions for dealing with django (models)x
 """
 
 import collections
+import io
 import re
 import time
 
@@ -68,6 +69,48 @@ def bulk_insert_returning_ids(new_objects, fields=None):
     return new_objects
 
 
+def _copy_escape(value):
+    """Serialise a single value to the postgres COPY text format"""
+    if value is None:
+        return r"\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def copy_insert(new_objects, batch_size=None):
+    """Insert objects using COPY on postgres, which is considerably faster than
+    INSERT for large numbers of rows. Objects are not assigned ids. On other
+    databases this falls back to bulk_create.
+
+    @param new_objects: (unsaved) model instances, all of the same model
+    @returns: the list of inserted objects
+    """
+    new_objects = list(new_objects)
+
+    if not new_objects:
+        return new_objects
+
+    model = new_objects[0].__class__
+
+    if connection.vendor != "postgresql":
+        return model.objects.bulk_create(new_objects, batch_size=batch_size)
+
+    fields = [f for f in model._meta.concrete_fields if not isinstance(f, models.AutoField)]
+    columns = [f.column for f in fields]
+
+    data = io.StringIO()
+    for obj in new_objects:
+        row = (f.get_db_prep_save(getattr(obj, f.attname), connection) for f in fields)
+        data.write("\t".join(map(_copy_escape, row)))
+        data.write("\n")
+    data.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.copy_from(data, model._meta.db_table, columns=columns)
+
+    return new_objects
+
+
 def distinct_args(*fields):
     """
     return fields if the db supports distinct on, otherwise an empty list
@@ -22,8 +22,10 @@ Utility module for keyword searches. This module is full of misnomers, maybe
 move it to 'queryparser'?
 """
 
+import copy
 import logging
 import re
+import weakref
 from itertools import chain
 
 from dateutil.relativedelta import relativedelta
@@ -31,13 +33,21 @@ from django.core.exceptions import ValidationError
 
 from amcat.models import Label, ArticleSet, CodingJob, Code
 from amcat.tools.aggregate_es import aggregate, TermCategory
-from amcat.tools.amcates import ES
+from amcat.tools.amcates import ES, SentenceQuery
 from amcat.tools.caching import cached
 from amcat.tools.toolkit import strip_accents
 from amcat.tools import queryparser
 
 REFERENCE_RE = re.compile(r"<(?P<reference>.*?)(?P<recursive>\+?)>")
 
+# Placeholder for compiled references while parsing a query, see _compile_query
+REFERENCE_PLACEHOLDER = "__amcat_reference_{}__"
+PLACEHOLDER_RE = re.compile(r"__amcat_reference_(\d+)__$")
+
+# Compiled recursive code references per (code_id, language_id), stored per codebook index so
+# they are discarded when the (cached) codebook changes
+_expansion_cache = weakref.WeakKeyDictionary()
+
 log = logging.getLogger(__name__)
 
 FIELD_MAP = {
@@ -122,9 +132,21 @@ class SelectionSearch:
         """
         return ' OR '.join('(%s)' % q.query for q in self.get_queries()) or None
 
+    @cached
+    def get_query_terms(self):
+        """
+        Get the query as parsed by the queryparser, using compiled codebook references.
+        Pass this to elastic instead of get_query() to prevent reparsing.
+        """
+        terms = [q.get_terms() for q in self.get_queries()]
+        if not terms:
+            return None
+        return terms[0] if len(terms) == 1 else queryparser.Boolean("OR", terms)
+
     @cached
     def get_queries(self):
-        """Get SearchQuery objects
+        """Get SearchQuery objects. If the selection is at sentence level, their terms
+        only match articles with a sentence matching the query (see SentenceQuery).
 
         @rtype: iterable of SearchQuery"""
         if not self.data.query:
@@ -147,12 +169,18 @@ class SelectionSearch:
             replacement_language=replacement_lan
         )
 
-        return [q for q in resolved if not q.label.startswith("_")]
+        queries = [q for q in resolved if not q.label.startswith("_")]
+
+        if getattr(self.data, "sentence_level", False):
+            for q in queries:
+                q.terms = SentenceQuery(q.get_terms())
+
+        return queries
 
     @cached
     def get_count(self):
         try:
-            return self.es.count(self.get_query(), self.get_filters())
+            return self.es.count(self.get_query_terms(), self.get_filters())
         except queryparser.QueryParseError:
             # try queries one by one
             for i, q in enumerate(self.get_queries()):
@@ -162,13 +190,13 @@ class SelectionSearch:
 
     @cached
     def get_statistics(self):
-        return self.es.statistics(self.get_query(), self.get_filters())
+        return self.es.statistics(self.get_query_terms(), self.get_filters())
 
     def get_aggregate(self, categories, flat=True, objects=True):
         # If we're aggregating on terms, we don't want a global filter
         query = None
         if not any(isinstance(c, TermCategory) for c in categories):
-            query = self.get_query()
+            query = self.get_query_terms()
 
         aggr = aggregate(query, self.get_filters(), categories, flat=flat, objects=objects)
         return sorted(aggr, key=to_sortable_tuple)
@@ -177,17 +205,40 @@ class SelectionSearch:
         return to_nested(self.get_aggregate(categories))
 
     def get_article_ids(self):
-        return ES().query_ids(self.get_query(), self.get_filters())
+        return ES().query_ids(self.get_query_terms(), self.get_filters())
 
     def _get_article_ids_per_query(self):
         for q in self.get_queries():
-            yield q, list(ES().query_ids(q.query, self.get_filters()))
+            yield q, list(ES().query_ids(q.get_terms(), self.get_filters()))
 
     def get_article_ids_per_query(self):
         return dict(self._get_article_ids_per_query())
 
     def get_articles(self, size=None, offset=0, fields=()):
-        return ES().query(self.get_query(), self.get_filters(), True, size=size, from_=offset, fields=fields)
+        return ES().query(self.get_query_terms(), self.get_filters(), True, size=size, from_=offset, fields=fields)
+
+    @cached
+    def _get_sentence_terms(self):
+        """Like get_query_terms, but to be matched against sentences rather than articles"""
+        terms = [q.get_terms() for q in self.get_queries()]
+        terms = [t.terms if isinstance(t, SentenceQuery) else t for t in terms]
+        if not terms:
+            return None
+        return terms[0] if len(terms) == 1 else queryparser.Boolean("OR", terms)
+
+    @cached
+    def get_sentence_count(self):
+        """Number of sentences matching the query in the selected articles"""
+        return self.es.count_sentences(self._get_sentence_terms(), self.get_filters())
+
+    def get_sentence_counts(self):
+        """Mapping of article id to the number of sentences matching the query"""
+        return self.es.sentence_counts(self._get_sentence_terms(), self.get_filters())
+
+    def get_sentences(self, size=None, offset=0, highlight=True):
+        """Sentences matching the query (keyword in context at sentence level)"""
+        return self.es.query_sentences(self._get_sentence_terms(), self.get_filters(), highlight,
+                                       size=size, from_=offset)
 
 
 class SearchQuery(object):
@@ -200,6 +251,14 @@ class SearchQuery(object):
         self.query = strip_accents(query)
         self.declared_label = _clean(label)
         self.label = self.declared_label or _clean(self.query)
+        # Parsed query with compiled references, set by resolve_query
+        self.terms = None
+
+    def get_terms(self):
+        """Return the parsed query (see queryparser.parse_to_terms)"""
+        if self.terms is None:
+            return queryparser.parse_to_terms(self.query)
+        return self.terms
 
     @classmethod
     def _get_label_delimiter(cls, query_string, label_delimiters):
@@ -298,47 +357,55 @@ def _clean(s):
     return s.strip()
 
 
-def _resolve_recursive(codebook, tree_item, rlanguage):
-    this = codebook.get_code(tree_item.code_id).get_label(rlanguage)
+def _resolve_recursive(codebook, code, rlanguage):
+    """Yield the labels of code and all its descendants"""
+    index = codebook.get_index(include_hidden=True)
+    code_ids = index.get_descendant_ids(code.id) if code.id in index else (code.id,)
+    for code_id in code_ids:
+        label = codebook.get_code(code_id).get_label(rlanguage)
+        if label is not None:
+            yield label
 
-    if this is not None:
-        yield this
 
-    for t in tree_item.children:
-        for child in _resolve_recursive(codebook, t, rlanguage):
-            yield child
+def _resolve_code(codebook, code, recursive, rlanguage):
+    """Return a (query, terms) tuple for a code, see _resolve_reference"""
+    if not recursive:
+        return code.get_label(rlanguage), None
 
+    expansions = _expansion_cache.setdefault(codebook.get_index(include_hidden=True), {})
+    key = (code.id, getattr(rlanguage, "id", rlanguage))
+    if key not in expansions:
+        labels = list(_resolve_recursive(codebook, code, rlanguage))
+        try:
+            terms = queryparser.compile_disjunction(labels)
+        except queryparser.QueryParseError:
+            # Leave it to the query parser to report the error in context
+            terms = None
+        expansions[key] = " OR ".join(labels), terms
+    return expansions[key]
 
-def resolve_reference(reference, recursive, queries, codebook=None, labels=None, rlanguage=None):
+
+def _resolve_reference(reference, recursive, queries, codebook=None, labels=None, rlanguage=None):
+    """
+    Resolve a reference to a (query, terms) tuple, where terms is the parsed version of
+    query or None if it has not been parsed yet.
+    """
     # Case 1: reference is numeric, so it refers to a Code
     if reference.isnumeric():
         code = codebook.get_code(int(reference))
-        if recursive:
-            tree = codebook.get_tree(roots=[code])
-            tree = list(_resolve_recursive(codebook, tree[0], rlanguage))
-            return " OR ".join(tree)
-        return code.get_label(rlanguage)
+        return _resolve_code(codebook, code, recursive, rlanguage)
 
     # Case 2: reference refers to labeled subquery
     if reference in queries:
         # This refernce might contain references, resolve it first.
-        return resolve_query(
-            queries[reference],
-            queries, codebook, labels
-        ).query
+        query = resolve_query(queries[reference], queries, codebook, labels)
+        return query.query, query.terms
 
     # Case 3: reference refers to code in codebook, refered to by its label
     try:
         log.debug("Finding {reference} in {rlanguage} in {labels}, rec={recursive}".format(**locals()))
         code = labels[reference]
-
-        if recursive:
-            tree = codebook.get_tree(roots=[code])
-            log.warn("Tree: {tree}".format(**locals()))
-            tree = list(_resolve_recursive(codebook, tree[0], rlanguage))
-            return " OR ".join(tree)
-        else:
-            return code.get_label(rlanguage)
+        return _resolve_code(codebook, code, recursive, rlanguage)
     except Label.DoesNotExist:
         raise QueryValidationError(
             "Code with label '{reference}' has no label in replacement-language."
@@ -357,6 +424,44 @@ def resolve_reference(reference, recursive, queries, codebook=None, labels=None,
         )
 
 
+def resolve_reference(reference, recursive, queries, codebook=None, labels=None, rlanguage=None):
+    return _resolve_reference(reference, recursive, queries, codebook, labels, rlanguage)[0]
+
+
+def _substitute(term, references, substituted):
+    """Replace placeholder terms in term by the corresponding compiled references"""
+    if isinstance(term, queryparser.Span):
+        # Spans cannot contain compiled references
+        return term
+    elif isinstance(term, queryparser.Boolean):
+        term.terms = [_substitute(t, references, substituted) for t in term.terms]
+    elif isinstance(term, queryparser.Term) and term.field is None:
+        match = PLACEHOLDER_RE.match(term.text)
+        if match:
+            substituted.add(int(match.group(1)))
+            # references are cached, so make sure they are not modified by simplify
+            return copy.deepcopy(references[int(match.group(1))])
+    return term
+
+
+def _compile_query(template, references):
+    """
+    Parse a query in which references are replaced by placeholders and substitute
+    the compiled references for them. Returns None if this is not possible (for
+    example, because a reference is used in a proximity query).
+    """
+    try:
+        terms = queryparser.parse_to_terms(template)
+    except queryparser.QueryParseError:
+        return None
+
+    substituted = set()
+    terms = _substitute(terms, references, substituted)
+    if len(substituted) != len(references):
+        return None
+    return queryparser.simplify(terms)
+
+
 def resolve_query(query, queries, codebook=None, labels=None, rlanguage=None):
     """
     Take a query and parse and solve all references, marked as <reference>. Each
@@ -366,13 +471,18 @@ def resolve_query(query, queries, codebook=None, labels=None, rlanguage=None):
       2a) A reference to a code in the given codebook by id
       2b) A reference to a code in the given codebook by label
 
+    References which are already parsed (i.e. recursive code references) are
+    substituted in the parsed query, which is stored in query.terms.
+
     @type query: SearchQuery
     @type queries:
     """
+    template, references = query.query, []
+
     for mo in REFERENCE_RE.finditer(query.query):
         recursive = bool(mo.group("recursive"))
         reference = mo.group("reference")
-        replacement = resolve_reference(
+        replacement, terms = _resolve_reference(
             reference, recursive, queries,
             codebook, labels, rlanguage
         )
@@ -380,6 +490,14 @@ def resolve_query(query, queries, codebook=None, labels=None, rlanguage=None):
             raise QueryValidationError("Empty replacement: {query.label}: {query.query} -> {replacement!r}".format(**locals()))
 
         query.query = query.query.replace(mo.group(0), "(%s)" % replacement, 1)
+        if terms is None:
+            template = template.replace(mo.group(0), "(%s)" % replacement, 1)
+        else:
+            template = template.replace(mo.group(0), REFERENCE_PLACEHOLDER.format(len(references)), 1)
+            references.append(terms)
+
+    if references:
+        query.terms = _compile_query(template, references)
 
     return query
 
@@ -0,0 +1,123 @@
+# ##########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+MinHash signatures and locality sensitive hashing (LSH) to find near-duplicate texts.
+
+A text is represented by the set of its word shingles (sequences of SHINGLE_SIZE words).
+The fraction of equal values in the MinHash signatures of two texts estimates the Jaccard
+similarity of their shingle sets. Signatures are split into BANDS bands; texts sharing
+at least one band are candidate duplicates, which are verified by comparing signatures.
+With the default settings, pairs with a similarity above 0.8 are found with a probability
+of over 99%, while pairs with a similarity below 0.5 are rarely candidates.
+"""
+
+import hashlib
+import random
+import re
+import struct
+
+# Changing any of these invalidates stored signatures, so increase SIGNATURE_VERSION as well
+SIGNATURE_VERSION = 1
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 128
+BANDS = 16
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+_rng = random.Random(SIGNATURE_VERSION)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+_FORMAT = struct.Struct("<{}I".format(NUM_PERMUTATIONS))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _hash64(s: str) -> int:
+    return int.from_bytes(hashlib.md5(s.encode("utf-8")).digest()[:8], "little")
+
+
+def get_shingles(text: str, size: int=SHINGLE_SIZE) -> set:
+    """Return the set of (hashed) word shingles in text. Short texts are a single shingle."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {_hash64(" ".join(words))} if words else set()
+    return {_hash64(" ".join(words[i:i+size])) for i in range(len(words) - size + 1)}
+
+
+def get_signature(text: str):
+    """
+    Return the MinHash signature of text as a tuple of NUM_PERMUTATIONS ints, or None
+    if the text contains no words.
+    """
+    shingles = get_shingles(text)
+    if not shingles:
+        return None
+    return tuple(min((a * x + b) % _PRIME for x in shingles) & _MASK for (a, b) in _PERMUTATIONS)
+
+
+def pack(signature) -> bytes:
+    return _FORMAT.pack(*signature)
+
+
+def unpack(data: bytes) -> tuple:
+    return _FORMAT.unpack(bytes(data))
+
+
+def get_bands(signature):
+    """
+    Yield a (band, bucket) tuple for each band of the signature. The bucket is a signed
+    64 bit hash of the values in the band, so it fits in a bigint column.
+    """
+    rows = NUM_PERMUTATIONS // BANDS
+    for band in range(BANDS):
+        values = _FORMAT.pack(*signature)[band*rows*4:(band+1)*rows*4]
+        yield band, int.from_bytes(hashlib.md5(values).digest()[:8], "little", signed=True)
+
+
+def similarity(signature1, signature2) -> float:
+    """Estimate the Jaccard similarity of the texts with the given signatures"""
+    return sum(a == b for (a, b) in zip(signature1, signature2)) / NUM_PERMUTATIONS
+
+
+class DisjointSet(object):
+    """Union-find structure used to cluster duplicate pairs"""
+    def __init__(self):
+        self.parents = {}
+
+    def find(self, x):
+        root = x
+        while self.parents.get(root, root) != root:
+            root = self.parents[root]
+        # Path compression
+        while x != root:
+            self.parents[x], x = root, self.parents.get(x, x)
+        return root
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            # Use the smallest element as root, so it is kept when deduplicating
+            self.parents[max(x, y)] = min(x, y)
+
+    def clusters(self):
+        """Return a mapping of root -> set of all members (including root)"""
+        clusters = {}
+        for x in list(self.parents):
+            root = self.find(x)
+            clusters.setdefault(root, {root}).add(x)
+        return clusters
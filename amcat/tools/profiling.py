@@ -0,0 +1,174 @@
+# ##########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+Opt-in profiling of single (production) task runs.
+
+Admins can request profiling of a task by adding a 'profile' parameter to the request that
+starts it (see wants_profile). The task is then run under a SamplingProfiler, and the number
+and time of all sql queries (see telemetry.QueryObserver) and elastic calls are recorded,
+together with the slowest ones (see SlowestCalls). The resulting
+profile is stored (gzipped json) with the task, and can be downloaded from the
+taskprofile api.
+
+The stacks in a profile are 'folded': frames are separated by semicolons, from the
+outermost to the innermost frame, which is the input format of flamegraph tools.
+"""
+import collections
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+
+from amcat.tools import telemetry
+
+log = logging.getLogger(__name__)
+
+# Seconds between samples
+SAMPLE_INTERVAL = 0.005
+
+# Maximum number of stacks, sql queries and elastic calls stored in a profile (the slowest ones)
+MAX_STACKS = 5000
+MAX_QUERIES = 1000
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stack of a thread at a fixed interval from a background thread, counting how
+    often each (folded) stack occurs. The overhead does not depend on the number of function
+    calls, so it can be used on long running production tasks.
+    """
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL, max_depth=200):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.duration = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _get_label(frame):
+        code = frame.f_code
+        return "{}:{}:{}".format(code.co_filename, code.co_name, code.co_firstlineno)
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(self._get_label(frame))
+            frame = frame.f_back
+        if stack:
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.time() - self._started
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def to_dict(self):
+        return {"interval": self.interval, "samples": self.samples, "duration": self.duration,
+                "stacks": dict(self.stacks.most_common(MAX_STACKS))}
+
+
+class SlowestCalls(object):
+    """
+    Keeps the count and total time of all calls appended to it, but only stores the max_calls
+    slowest calls, so long running tasks do not accumulate all their queries in memory.
+    """
+
+    def __init__(self, key, max_calls=MAX_QUERIES):
+        self.key = key
+        self.max_calls = max_calls
+        self.count = 0
+        self.time = 0
+        self._heap = []
+        self._seq = itertools.count()
+
+    def append(self, call):
+        self.count += 1
+        self.time += call[self.key]
+        item = (call[self.key], next(self._seq), call)
+        if len(self._heap) < self.max_calls:
+            heapq.heappush(self._heap, item)
+        else:
+            heapq.heappushpop(self._heap, item)
+
+    def to_dict(self):
+        return {"count": self.count, "time": self.time,
+                "slowest": [call for (_, _, call) in sorted(self._heap, reverse=True)]}
+
+
+def profile_call(func, *args, **kwargs):
+    """
+    Call func under a SamplingProfiler, recording sql queries and elastic calls.
+    @return: a (result, profile) tuple. If func raises an exception, the profile (including the
+             queries and calls made before the error) is attached to it as the 'profile' attribute
+    """
+    queries, es_calls = SlowestCalls("time"), SlowestCalls("duration")
+    observer = telemetry.QueryObserver(lambda sql, duration: queries.append({"sql": sql, "time": duration}))
+    profiler = SamplingProfiler()
+    error = None
+    try:
+        with observer, telemetry.record_es_calls(es_calls), profiler:
+            result = func(*args, **kwargs)
+    except Exception as e:
+        error, result = e, None
+
+    profile = dict(profiler.to_dict(), sql=queries.to_dict(), elastic=es_calls.to_dict(),
+                   error=error and repr(error))
+    if error is not None:
+        error.profile = profile
+        raise error
+    return result, profile
+
+
+def serialize_profile(profile) -> bytes:
+    return gzip.compress(json.dumps(profile, default=str).encode("utf-8"))
+
+
+def deserialize_profile(data: bytes):
+    return json.loads(gzip.decompress(bytes(data)).decode("utf-8"))
+
+
+def wants_profile(request) -> bool:
+    """Should the task started by this request be profiled? Only admins can request profiling."""
+    return request.user.is_superuser and "profile" in request.GET
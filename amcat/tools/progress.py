@@ -18,6 +18,7 @@
 ###########################################################################
 
 import logging
+import time
 
 from typing import Optional
 
@@ -103,3 +104,28 @@ class NullMonitor(ProgressMonitor):
     def update(self, *args, **kargs):
         pass
 
+
+class ThrottledListener(object):
+    """
+    Listener which passes updates to another listener, but at most once every `min_interval`
+    seconds unless progress increased by at least `min_delta` (a fraction). Updates that do
+    not change progress or message, are never passed on. Completion is always passed on.
+    """
+    def __init__(self, listener, min_interval: float=1.0, min_delta: float=0.05, clock=time.monotonic):
+        self.listener = listener
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self.clock = clock
+        self.last = None  # (time, progress, message) of the last update passed on
+
+    def __call__(self, monitor):
+        now, progress, message = self.clock(), monitor.progress, monitor.message
+        if self.last is not None:
+            last_time, last_progress, last_message = self.last
+            if (progress, message) == (last_progress, last_message):
+                return
+            if (progress < 1 and now - last_time < self.min_interval
+                    and progress - last_progress < self.min_delta):
+                return
+        self.last = (now, progress, message)
+        self.listener(monitor)
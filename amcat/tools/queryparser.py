@@ -22,15 +22,30 @@ Parser to generate a elastic DSL from a lucene-style query string
 
 Decided to roll my own parser since elastic does not support complex phrases
 Also paves the way for more customization, i.e. allowing Lexis style queries
+
+The parser is a hand-written recursive descent parser. It used to be a pyparsing
+grammar, which is still available through get_pyparsing_grammar for comparison
+(see the benchmark_queryparser management command).
 """
 
 import collections
+import copy
+import functools
 import itertools
+import re
+import unicodedata
 
 from amcat.tools.toolkit import strip_accents
-from pyparsing import ParserElement, ParseException
 
-ParserElement.enablePackrat()
+# Number of parsed queries (and their DSL) to keep in memory
+QUERY_CACHE_SIZE = 1024
+
+# Maximum number of terms in a single terms query, below the elastic clause limit (1024)
+TERMS_CLAUSE_LIMIT = 1000
+
+# A single token for the unicode_letters_digits tokenizer, and a token that folded to ascii
+_SINGLE_TOKEN = re.compile(r"[^\W_]+$")
+_ASCII_TOKEN = re.compile(r"[a-z0-9]+$")
 
 
 def c(s):
@@ -102,6 +117,48 @@ class Quote(BaseTerm):
         return {"match_phrase": {self.qfield: self.text}}
 
 
+class Terms(FieldTerm):
+    """
+    Disjunction of plain (non-wildcard) single-token terms on a single field. This is
+    equivalent to OR-ing Term objects, but results in a single terms query rather than a
+    clause per term, which keeps large disjunctions below the elastic clause limit. The
+    texts should be index tokens (see get_index_token), as terms queries are not analyzed.
+    Created by compile_disjunction.
+    """
+    def __init__(self, texts, field=None):
+        super(Terms, self).__init__(field=field)
+        self.texts = list(texts)
+
+    def __str__(self):
+        texts = " ".join(self.texts)
+        return '{self.qfield}::TERMS[{texts}]'.format(**locals())
+
+    def get_dsl(self):
+        # A terms query is scored as a disjunction of term queries, i.e. like OR-ed match queries
+        # on single tokens. Larger sets are split into nested queries to stay below the clause limit.
+        queries = [{"terms": {self.qfield: self.texts[i:i+TERMS_CLAUSE_LIMIT]}}
+                   for i in range(0, len(self.texts), TERMS_CLAUSE_LIMIT)]
+        return queries[0] if len(queries) == 1 else {"bool": {"should": queries}}
+
+    def get_filter_dsl(self):
+        return {"terms": {self.qfield: self.texts}}
+
+
+def get_index_token(text):
+    """
+    Return the token the default analyzer (see settings.elastic) produces for text: lowercased
+    and without accents. Returns None if text is not a single token, or if its token cannot be
+    determined reliably because it does not fold to ascii letters and digits.
+    """
+    if not _SINGLE_TOKEN.match(text):
+        return None
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    token = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    if not _ASCII_TOKEN.match(token):
+        return None
+    return token
+
+
 class Boolean(object):
     def __init__(self, operator, terms, implicit=False):
         self.operator = operator
@@ -237,13 +294,279 @@ def lucene_span(quote, field, slop):
     return Span(clause.terms, slop, field)
 
 
+def pprint(q, indent=0):
+    i = "  " * indent
+    if isinstance(q, Boolean):
+        print(i, "Boolean", q.operator, "[")
+        for t in q.terms:
+            pprint(t, indent + 1)
+        print(i, "]")
+    else:
+        print(i, type(q).__name__, q)
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Terms consist of any non-space character except for a few special ones
+_TERM_CHARS = r"[^\s\":()~\U00010000-\U0010FFFF]"
+_TERM = re.compile(_TERM_CHARS + "+")
+_END_OF_WORD = "(?!" + _TERM_CHARS + ")"
+_FIELD = re.compile(r"([A-Za-z]+)[ \t\n\r]*:")
+_QUOTE = re.compile(r'"([^"\n\r]*)"')
+_SLOP = re.compile(r"~[ \t\n\r]*([0-9]+)")
+_NOT = re.compile("NOT" + _END_OF_WORD)
+_OPERATOR = re.compile(r"(?:AND|OR|NOT|W/[ \t\n\r]*(?P<slop>[0-9]+))" + _END_OF_WORD)
+
+
+class ParseFailure(Exception):
+    """Raised by QueryParser if the query does not conform to the grammar"""
+    def __init__(self, query, loc, expected):
+        self.query = query
+        self.loc = loc
+        self.expected = expected
+
+    def __str__(self):
+        lineno = self.query.count("\n", 0, self.loc) + 1
+        col = self.loc - self.query.rfind("\n", 0, self.loc)
+        return "Expected {self.expected} (at char {self.loc}), (line:{lineno}, col:{col})".format(**locals())
+
+
+def _memoize(method):
+    """
+    Memoize the result (or ParseFailure) of a parse method per position ('packrat parsing'),
+    so backtracking over nested expressions does not parse the same text again
+    """
+    @functools.wraps(method)
+    def inner(self, pos):
+        key = (method.__name__, pos)
+        if key not in self._memo:
+            try:
+                self._memo[key] = method(self, pos)
+            except ParseFailure as e:
+                self._memo[key] = e
+        result = self._memo[key]
+        if isinstance(result, ParseFailure):
+            raise result
+        return result
+    return inner
+
+
+class QueryParser(object):
+    """
+    Recursive descent parser for lucene-style queries. In order of precedence:
+
+        expression := unary ([operator] unary)*
+        unary      := "NOT" unary | atom
+        atom       := term | "(" expression ")"
+        term       := [field ":"] (quote ["~" slop] | word)
+        operator   := "AND" | "OR" | "NOT" | "W/" slop
+
+    Binary operators are not nested according to precedence: all operands of a
+    (parenthesized) expression are combined using the last operator, i.e.
+    `a AND b OR c` means `a OR b OR c`. Operators without an operand following
+    them are an error, but words equal to an operator can be used as terms where
+    no operator is expected (e.g. `AND OR b` means `"AND" OR b`).
+    """
+    def __init__(self, query, default_fieldname=None):
+        self.query = query
+        self.default_fieldname = default_fieldname
+        self._memo = {}
+
+    def skip(self, pos):
+        return _WHITESPACE.match(self.query, pos).end()
+
+    def parse(self):
+        term, pos = self.parse_expression(0)
+        pos = self.skip(pos)
+        if pos != len(self.query):
+            raise ParseFailure(self.query, pos, "end of text")
+        return term
+
+    @_memoize
+    def parse_expression(self, pos):
+        term, pos = self.parse_unary(pos)
+        terms, operator, slop = [term], None, None
+
+        while True:
+            opstart = self.skip(pos)
+            match = _OPERATOR.match(self.query, opstart)
+            op = match.group() if match else "implicit_OR"
+
+            try:
+                term, newpos = self.parse_unary(match.end() if match else pos)
+            except ParseFailure:
+                break
+
+            terms.append(term)
+            pos = newpos
+            if match and match.group("slop"):
+                operator, slop = "W/", match.group("slop")
+            else:
+                operator = op
+
+        if operator is None:
+            return terms[0], pos
+        elif operator == "W/":
+            return Span(terms, slop), pos
+        elif operator == "implicit_OR":
+            return Boolean("OR", terms, implicit=True), pos
+        return Boolean(operator, terms), pos
+
+    @_memoize
+    def parse_unary(self, pos):
+        pos = self.skip(pos)
+        match = _NOT.match(self.query, pos)
+        if match:
+            try:
+                term, pos2 = self.parse_unary(match.end())
+            except ParseFailure as e:
+                error = e
+            else:
+                return Boolean("NOT", [term]), pos2
+        else:
+            error = ParseFailure(self.query, pos, '"NOT"')
+
+        try:
+            return self.parse_atom(pos)
+        except ParseFailure as e:
+            raise e if e.loc > error.loc else error
+
+    @_memoize
+    def parse_atom(self, pos):
+        try:
+            return self.parse_term(pos)
+        except ParseFailure as e:
+            error = e
+
+        if not self.query.startswith("(", pos):
+            raise error
+
+        try:
+            term, pos = self.parse_expression(pos + 1)
+        except ParseFailure as e:
+            raise e if e.loc > error.loc else error
+
+        pos = self.skip(pos)
+        if not self.query.startswith(")", pos):
+            raise ParseFailure(self.query, pos, '")"')
+        return term, pos + 1
+
+    def parse_term(self, pos):
+        field = ""
+        match = _FIELD.match(self.query, pos)
+        if match:
+            field = match.group(1)
+            pos = self.skip(match.end())
+
+        match = _QUOTE.match(self.query, pos)
+        if match:
+            quote, pos = match.group(1), match.end()
+            slop = _SLOP.match(self.query, self.skip(pos))
+            if slop:
+                return lucene_span(quote, field, slop.group(1)), slop.end()
+            # this is where it gets weird: phrase queries don't support general
+            # prefixes, but span (=slop) queries do. So, make a span query
+            # with slop=0 and in_order=True if a non-final wildcard is present
+            if "*" in quote or "?" in quote:
+                return lucene_span(quote, field, 0), pos
+            if not quote:
+                return Term(quote, field or self.default_fieldname), pos
+            return Quote(quote, field), pos
+
+        match = _TERM.match(self.query, pos)
+        if match:
+            return Term(match.group(), field or self.default_fieldname), match.end()
+
+        raise ParseFailure(self.query, pos, "term or quoted string")
+
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _parse_to_terms(s, default_fieldname):
+    """Parse query, caching results. Do not modify the returned terms"""
+    return QueryParser(s, default_fieldname).parse()
+
+
+def simplify(term):
+    if isinstance(term, Boolean):
+        new_terms = []
+        for t in term.terms:
+            t = simplify(t)
+            if isinstance(t, Boolean) and term.operator in ("OR", "AND") and t.operator == term.operator:
+                new_terms += t.terms
+            else:
+                new_terms.append(t)
+        term.terms = new_terms
+    return term
+
+# validationerror changes the message into a list (probably per field?), so raise a valueerror here
+class QueryParseError(ValueError):
+    pass
+
+def parse_to_terms(s, simplify_terms=True, default_fieldname=None, context=""):
+    s = strip_accents(s)
+    if " *" in s.strip():
+        raise QueryParseError("Error in query '{context}': Can only use wildcard (*) as suffix or at beginning of query".format(**locals()))
+    try:
+        terms = copy.deepcopy(_parse_to_terms(s, default_fieldname))
+    except ParseFailure as e:
+        msg = "Error in query '{context}': {e}\n{s}".format(**locals())
+        msg += "\n{space}^".format(space=" "*e.loc)
+        raise QueryParseError(msg)
+    except Exception as e:
+        raise QueryParseError("Error parsing query '{context}': {e.__class__.__name__}: {e}\n{s}".format(**locals()))
+    if simplify_terms:
+        terms = simplify(terms)
+    return terms
+
+
+def compile_disjunction(queries, default_fieldname=None):
+    """
+    Parse a sequence of query strings into a single query matching any of them. Plain
+    single-token terms are collected into a Terms object per field, other queries (quotes,
+    wildcards, terms containing punctuation, conjunctions, etc.) are kept as separate clauses.
+
+    @param queries: sequence of query strings
+    @return: Terms/Boolean object, or None if queries is empty
+    """
+    texts, clauses = collections.OrderedDict(), []
+    for query in queries:
+        term = parse_to_terms(query, default_fieldname=default_fieldname)
+        if isinstance(term, Boolean) and not isinstance(term, Span) and term.operator == "OR":
+            disjuncts = term.terms
+        else:
+            disjuncts = [term]
+
+        for t in disjuncts:
+            token = None
+            if isinstance(t, Term) and not ("*" in t.text or "?" in t.text):
+                token = get_index_token(t.text)
+            if token is not None:
+                texts.setdefault(t.field, collections.OrderedDict())[token] = None
+            else:
+                clauses.append(t)
+
+    clauses = [Terms(ts, field) for field, ts in texts.items()] + clauses
+    if len(clauses) > 1:
+        return Boolean("OR", clauses)
+    return clauses[0] if clauses else None
+
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _parse(s, default_fieldname):
+    return parse_to_terms(s, default_fieldname=default_fieldname).get_dsl()
+
+
+def parse(s, default_fieldname=None):
+    return copy.deepcopy(_parse(s, default_fieldname))
+
+
+###########################################################################
+#                    L E G A C Y   G R A M M A R                          #
+###########################################################################
+
 def get_term(tokens, default_fieldname=None):
     if 'slop' in tokens:
         return lucene_span(tokens.quote, tokens.field, tokens.slop)
     elif 'quote' in tokens:
-        # this is where it gets weird: phrase queries don't support general
-        # prefixes, but span (=slop) queries do. So, make a span query
-        # with slop=0 and in_order=True if a non-final wildcard is present
         if "*" in tokens.quote or "?" in tokens.quote:
             return lucene_span(tokens.quote, tokens.field, 0)
         else:
@@ -268,32 +591,16 @@ def get_boolean_or_term(tokens):
             return Boolean(op, terms, implicit)
 
 
-def pprint(q, indent=0):
-    i = "  " * indent
-    if isinstance(q, Boolean):
-        print(i, "Boolean", q.operator, "[")
-        for t in q.terms:
-            pprint(t, indent + 1)
-        print(i, "]")
-    else:
-        print(i, type(q).__name__, q)
-
-
-_grammar = {}
-
-def get_grammar(default_fieldname=None):
-    if default_fieldname not in _grammar:
-        _grammar[default_fieldname] = _get_grammar(default_fieldname)
-    return _grammar[default_fieldname]
-
-def _get_grammar(default_fieldname):
+@functools.lru_cache()
+def get_pyparsing_grammar(default_fieldname=None):
     """
-
-    @param default_fieldname:
-    @return:
+    Return the pyparsing grammar this module used before QueryParser. It is slow
+    to build and parse with, and kept only for comparison. Use
+    grammar.parseString(s, parseAll=True)[0] to parse s.
     """
     from pyparsing import (Literal, Word, QuotedString, Optional, operatorPrecedence,
-                           nums, alphas, opAssoc)
+                           nums, alphas, opAssoc, ParserElement)
+    ParserElement.enablePackrat()
 
     # literals
     AND = Literal("AND")
@@ -324,46 +631,3 @@ def _get_grammar(default_fieldname):
     ])
     boolean_expr.setParseAction(get_boolean_or_term)
     return boolean_expr
-
-# Cache on startup
-get_grammar()
-
-def simplify(term):
-    if isinstance(term, Boolean):
-        new_terms = []
-        for t in term.terms:
-            t = simplify(t)
-            if isinstance(t, Boolean) and term.operator in ("OR", "AND") and t.operator == term.operator:
-                new_terms += t.terms
-            else:
-                new_terms.append(t)
-        term.terms = new_terms
-    return term
-
-# validationerror changes the message into a list (probably per field?), so raise a valueerror here
-class QueryParseError(ValueError):
-    pass
-
-def parse_to_terms(s, simplify_terms=True, default_fieldname=None, context=""):
-    s = strip_accents(s)
-    if " *" in s.strip():
-        raise QueryParseError("Error in query '{context}': Can only use wildcard (*) as suffix or at beginning of query".format(**locals()))
-    try:
-        terms = get_grammar(default_fieldname).parseString(s, parseAll=True)[0]
-    except ParseException as e:
-        msg = "Error in query '{context}': {e}\n{s}".format(**locals())
-        if hasattr(e, "loc"):
-            msg += "\n{space}^".format(space=" "*e.loc)
-        raise QueryParseError(msg) 
-    except Exception as e:
-        raise QueryParseError("Error parsing query '{context}': {e.__class__.__name__}: {e}\n{s}".format(**locals()))
-    if simplify_terms:
-        terms = simplify(terms)
-    return terms
-
-
-def parse(s, default_fieldname=None):
-    terms = parse_to_terms(s, default_fieldname=default_fieldname)
-    dsl = terms.get_dsl()
-    return dsl
-
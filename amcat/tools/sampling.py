@@ -0,0 +1,231 @@
+# ##########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+Random sampling of (the articles in) article sets.
+
+All sampling functions take a seed, so a sample can be reproduced by using the same seed
+on the same set. The following strategies are available for simple random samples:
+
+ - ids: draw from the ids of the set (see ArticleSet.get_article_ids). This is exact and
+        fast, but keeps all ids of the set in memory.
+ - reservoir: stream the ids from the database, keeping only the sample in memory
+
+Stratified samples use elastic aggregations to determine the size of each stratum, and
+sample each stratum separately (using reservoir sampling), allocating the sample size
+to the strata proportionally.
+"""
+import heapq
+import itertools
+import logging
+import math
+import random
+
+from django.conf import settings
+from django.db import connection
+
+from amcat.tools import amcates
+
+log = logging.getLogger(__name__)
+
+STRATEGIES = ("ids", "reservoir")
+
+# Number of rows fetched at once when streaming ids from the database
+FETCH_SIZE = 10000
+
+
+def _get_random(seed=None) -> random.Random:
+    return seed if isinstance(seed, random.Random) else random.Random(seed)
+
+
+def _uniform(rng):
+    """Return a random float in the open interval (0, 1)"""
+    u = rng.random()
+    while u == 0:
+        u = rng.random()
+    return u
+
+
+def sample_ids(ids, n, seed=None):
+    """
+    Draw a simple random sample of n ids from the given collection of ids
+    @param ids: collection (e.g. set) of ids
+    @param n: size of the sample; if larger than len(ids), all ids are returned
+    @param seed: seed or random.Random instance
+    @return: a list of ids
+    """
+    # Sort to make the outcome independent of the (arbitrary) order of the ids
+    ids = sorted(ids)
+    if n >= len(ids):
+        return ids
+    return _get_random(seed).sample(ids, n)
+
+
+def reservoir_sample(iterable, n, seed=None):
+    """
+    Draw a simple random sample of n items from an iterable of unknown length in a single
+    pass, keeping only the sample in memory (Li's 'algorithm L').
+    @return: a list of (at most) n items
+    """
+    rng = _get_random(seed)
+    iterator = iter(iterable)
+    reservoir = list(itertools.islice(iterator, n))
+    if len(reservoir) < n or n <= 0:
+        return reservoir[:max(n, 0)]
+
+    w = math.exp(math.log(_uniform(rng)) / n)
+    while True:
+        # Skip the items that would not be selected, and replace a random item by the next one
+        skip = int(math.log(_uniform(rng)) / math.log(1 - w))
+        for item in itertools.islice(iterator, skip, skip + 1):
+            reservoir[rng.randrange(n)] = item
+            break
+        else:
+            return reservoir
+        w *= math.exp(math.log(_uniform(rng)) / n)
+
+
+def allocate(sizes, n):
+    """
+    Allocate a sample of n proportionally to strata with the given sizes, using the largest
+    remainder method. No stratum is allocated more than its size.
+    @param sizes: mapping of stratum -> size
+    @return: mapping of stratum -> sample size
+    """
+    total = sum(sizes.values())
+    if n >= total:
+        return dict(sizes)
+    quotas = {stratum: n * size / total for stratum, size in sizes.items()}
+    allocation = {stratum: int(quota) for stratum, quota in quotas.items()}
+    remaining = n - sum(allocation.values())
+    by_remainder = heapq.nlargest(remaining, quotas, key=lambda s: (quotas[s] - allocation[s], sizes[s]))
+    for stratum in by_remainder:
+        allocation[stratum] += 1
+    return allocation
+
+
+def _stream_ids(articleset_id):
+    """Yield the ids of the articles in the given set, in order, without fetching them all at once"""
+    with connection.cursor() as c:
+        c.execute("SELECT article_id FROM articlesets_articles WHERE articleset_id = %s ORDER BY article_id",
+                  [articleset_id])
+        while True:
+            rows = c.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for (aid,) in rows:
+                yield aid
+
+
+def _count(articleset_id):
+    with connection.cursor() as c:
+        c.execute("SELECT COUNT(*) FROM articlesets_articles WHERE articleset_id = %s", [articleset_id])
+        return c.fetchone()[0]
+
+
+def _get_sample_size(sample, total):
+    """Return the absolute size of sample (an int, or a float 0..1 as fraction of total)"""
+    return sample if isinstance(sample, int) else int(round(total * sample))
+
+
+def sample_articleset(articleset, sample, strategy="ids", seed=None):
+    """
+    Draw a simple random sample from the articles in the given set
+    @param sample: number of articles, or a float 0..1 for a fraction of the set
+    @param strategy: one of STRATEGIES (see module docstring)
+    @return: a list of article ids
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown sampling strategy: {strategy!r}".format(**locals()))
+
+    if strategy == "ids":
+        ids = articleset.get_article_ids()
+        total = len(ids)
+    else:
+        total = _count(articleset.id)
+    n = _get_sample_size(sample, total)
+
+    log.info("Sampling {n} of {total} articles from set {articleset.id} using {strategy}".format(**locals()))
+    if strategy == "ids":
+        return sample_ids(ids, n, seed)
+    else:
+        return reservoir_sample(_stream_ids(articleset.id), n, seed)
+
+
+def _get_stratum_field(name):
+    """
+    Return the elastic field to stratify on: the not analyzed 'raw' subfield for (default) string
+    properties, as the analyzed field would split values into (lowercased) tokens
+    """
+    if "_" in name:
+        mapping = settings.ES_MAPPING_TYPES.get(name.rsplit("_", 1)[1], {})
+    else:
+        mapping = settings.ES_MAPPING["properties"].get(name, settings.ES_MAPPING_TYPES["default"])
+    return name + ".raw" if "raw" in mapping.get("fields", {}) else name
+
+
+def get_strata(articleset, stratify_by, date_interval="month"):
+    """
+    Determine the strata of the articles in the set using an elastic aggregation.
+    @param stratify_by: 'date' or the name of an (indexed) property, e.g. 'medium'. Articles without
+                        a value for the property form a separate stratum.
+    @return: a list of (filter, size) pairs, where filter is an elastic filter selecting the articles
+             in that stratum within the set. For multi-valued (tag) properties, strata can overlap.
+    """
+    es = amcates.ES()
+    filters = {"sets": [articleset.id]}
+    if stratify_by == "date":
+        # Date buckets only contain non-empty intervals, so each bucket ends where the next one starts
+        buckets = sorted(es.aggregate_query(filters=filters, group_by=["date"], date_interval=date_interval))
+        ends = [date for (date, _) in buckets[1:]] + [None]
+        return [(amcates.combine_filters(list(amcates.get_filter_clauses(start_date=start, end_date=end))), count)
+                for (start, count), end in zip(buckets, ends)]
+
+    field = _get_stratum_field(stratify_by)
+    buckets = es.search_aggregate({"terms": {"field": field, "size": 999999}}, filters=filters)["buckets"]
+    strata = [({"term": {field: bucket["key"]}}, bucket["doc_count"]) for bucket in buckets]
+    missing = es.search_aggregate({"missing": {"field": field}}, filters=filters)["doc_count"]
+    if missing:
+        strata.append(({"missing": {"field": field}}, missing))
+    return strata
+
+
+def stratified_sample_articleset(articleset, sample, stratify_by, date_interval="month", seed=None):
+    """
+    Draw a stratified random sample from the articles in the given set. See get_strata for
+    stratify_by and date_interval, and sample_articleset for the other arguments. If strata
+    overlap, articles are only drawn once, so the sample can be slightly smaller than requested.
+    @return: a list of article ids
+    """
+    rng = _get_random(seed)
+    strata = get_strata(articleset, stratify_by, date_interval)
+    sizes = {i: size for i, (_, size) in enumerate(strata)}
+    n = _get_sample_size(sample, _count(articleset.id))
+    allocation = allocate(sizes, n)
+    log.info("Sampling {n} articles from set {articleset.id} in {k} strata of {stratify_by}"
+             .format(k=len(strata), **locals()))
+
+    es = amcates.ES()
+    set_filter = {"terms": {"sets": [articleset.id]}}
+    result = []
+    for i, (stratum_filter, size) in enumerate(strata):
+        if allocation[i]:
+            body = {"query": {"constant_score": {"filter": amcates.combine_filters([set_filter, stratum_filter])}}}
+            ids = set(es.query_ids(body=body)).difference(result)
+            result += sample_ids(ids, allocation[i], rng)
+    return result
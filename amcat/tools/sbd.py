@@ -27,6 +27,7 @@ import re
 
 from amcat.models import Article
 from amcat.models.sentence import Sentence
+from amcat.tools.djangotoolkit import bulk_insert_returning_ids
 
 abbrevs = ["ir", "mr", "dr", "dhr", "ing", "drs", "mrs", "sen", "sens", "gov", "st",
            "jr", "rev", "vs", "gen", "adm", "sr", "lt", "sept"]
@@ -51,7 +52,7 @@ def get_split_regex():
     return re.compile(expr)
 
 
-def get_or_create_sentences(article):
+def get_or_create_sentences(article, index=False):
     """
     Split the given article object into sentences and save the sentences models
     to the database. Returns a list of the resulting Sentence objects.
@@ -60,7 +61,7 @@ def get_or_create_sentences(article):
     is already split.
     """
     if not article.sentences.exists():
-        create_sentences(article)
+        create_sentences(article, index=index)
     return article.sentences.all()
 
 
@@ -78,15 +79,27 @@ def _create_sentences(article: Article):
             yield Sentence(parnr=parnr + 1, sentnr=sentnr + 1, article=article, sentence=sent)
 
 
-def create_sentences(article):
+def create_sentences(article, index=False):
     """
     Split the given article object into sentences and save the sentences models
     to the database. Returns a list of the resulting Sentence objects.
 
     If you can, cache properties title, text.
+
+    @param index: also add the sentences to the index (as children of the article). Sentences
+                  which are not indexed here are indexed by ES().backfill_sentences
+                  (see manage.py index_sentences)
     """
     sents = tuple(_create_sentences(article))
-    Sentence.objects.bulk_create(sents)
+
+    # Ids are needed to index the sentences
+    for sent, saved in zip(sents, bulk_insert_returning_ids(sents) or ()):
+        sent.id = saved.id
+
+    if index and sents:
+        from amcat.tools.amcates import ES
+        ES().bulk_insert_sentences(sents)
+
     return sents
 
 
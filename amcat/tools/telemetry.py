@@ -0,0 +1,365 @@
+# ##########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+Structured performance telemetry for tasks and requests.
+
+While a task or request runs, a Collector keeps its (nested) stage timings and counters. These
+include the number of SQL queries and elastic calls, and the number of bytes transferred. When
+the task or request finishes, an event with these statistics is written as a json line to
+settings.TELEMETRY_FILE (if configured). Events are written in batches, see EventWriter.
+
+Use the telemetry_summary management command to summarize the durations per task class or
+api endpoint. Code can add its own stage timings and counters using stage() and count(),
+which do nothing if no collector is active.
+"""
+import atexit
+import collections
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.utils import CursorWrapper
+from elasticsearch import Urllib3HttpConnection
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Collector(object):
+    """Collects stage timings and counters of a single task or request"""
+
+    def __init__(self, kind, name, clock=time.monotonic, **extra):
+        self.kind = kind
+        self.name = name
+        self.extra = extra
+        self.clock = clock
+        self.timestamp = time.time()
+        self.started = clock()
+        self.duration = None
+        self.stages = collections.OrderedDict()
+        self.counters = collections.defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + self.clock() - start
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def count_query(self, sql, duration):
+        self.count("sql_queries")
+        self.count("sql_time", duration)
+
+    def finish(self):
+        self.duration = self.clock() - self.started
+
+    def to_dict(self):
+        return {"kind": self.kind, "name": self.name, "timestamp": self.timestamp, "duration": self.duration,
+                "stages": self.stages, "counters": self.counters, "extra": self.extra}
+
+
+class _TimedCursorWrapper(CursorWrapper):
+    """Thin wrapper around a cursor (wrapper) that reports the sql and duration of each execute"""
+
+    def __init__(self, cursor, db, callback):
+        super().__init__(cursor, db)
+        self.callback = callback
+
+    def _timed(self, method, sql, params):
+        start = time.monotonic()
+        try:
+            return method(sql, params)
+        finally:
+            self.callback(sql, time.monotonic() - start)
+
+    def execute(self, sql, params=None):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+
+class QueryObserver(object):
+    """
+    Calls callback(sql, duration) for each query executed on the default database connection of
+    this thread while started, by wrapping the cursors it creates. Unlike connection.queries, this
+    does not need DEBUG (or a debug cursor) and does not keep the queries itself.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.db = None
+
+    def _wrap(self, make_cursor):
+        return lambda cursor: _TimedCursorWrapper(make_cursor(cursor), self.db, self.callback)
+
+    def start(self):
+        self.db = connections[DEFAULT_DB_ALIAS]
+        self._make_cursor, self._make_debug_cursor = self.db.make_cursor, self.db.make_debug_cursor
+        self.db.make_cursor = self._wrap(self._make_cursor)
+        self.db.make_debug_cursor = self._wrap(self._make_debug_cursor)
+
+    def stop(self):
+        self.db.make_cursor, self.db.make_debug_cursor = self._make_cursor, self._make_debug_cursor
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class ESConnection(Urllib3HttpConnection):
+    """Elasticsearch connection class counting calls and transferred bytes in the active collector"""
+
+    def _count(self, method, url, body, response, duration):
+        collector = get_collector()
+        if collector is not None:
+            collector.count("es_calls")
+            collector.count("es_time", duration)
+            collector.count("es_bytes_sent", len(body or ""))
+            collector.count("es_bytes_received", len(response or ""))
+        es_calls = getattr(_local, "es_calls", None)
+        if es_calls is not None:
+            es_calls.append({"method": method, "url": url, "duration": duration, "body": body[:1000] if body else body,
+                             "bytes_received": len(response or "")})
+
+    def log_request_success(self, method, full_url, path, body, status_code, response, duration):
+        self._count(method, full_url, body, response, duration)
+        super().log_request_success(method, full_url, path, body, status_code, response, duration)
+
+    def log_request_fail(self, method, full_url, body, duration, status_code=None, exception=None):
+        self._count(method, full_url, body, None, duration)
+        super().log_request_fail(method, full_url, body, duration, status_code=status_code, exception=exception)
+
+
+@contextmanager
+def record_es_calls(dest):
+    """Append all elastic calls made in this thread while in this context to dest, as dicts"""
+    previous = getattr(_local, "es_calls", None)
+    _local.es_calls = dest
+    try:
+        yield dest
+    finally:
+        _local.es_calls = previous
+
+
+def get_collector():
+    """Return the active collector of this thread, or None if there is none"""
+    return getattr(_local, "collector", None)
+
+
+def start(kind, name, **extra):
+    """
+    Start collecting telemetry for a task or request in this thread. Returns the collector,
+    which should be passed to finish(), or None if telemetry is disabled or already active.
+    """
+    if get_writer() is None or get_collector() is not None:
+        return None
+    collector = Collector(kind, name, **extra)
+    collector._queries = QueryObserver(collector.count_query)
+    collector._queries.start()
+    _local.collector = collector
+    return collector
+
+
+def finish(collector):
+    """Stop collecting in this thread, and write the event of the given collector"""
+    if collector is None:
+        return
+    collector.finish()
+    _local.collector = None
+    collector._queries.stop()
+    try:
+        get_writer().write(collector.to_dict())
+    except Exception:
+        log.exception("Could not write telemetry event")
+
+
+@contextmanager
+def collect(kind, name, **extra):
+    """Collect telemetry for the code in this context, see start()"""
+    collector = start(kind, name, **extra)
+    try:
+        yield collector
+    finally:
+        finish(collector)
+
+
+@contextmanager
+def stage(name):
+    """Time the code in this context as stage of the active collector (if any)"""
+    collector = get_collector()
+    if collector is None:
+        yield
+    else:
+        with collector.stage(name):
+            yield
+
+
+def count(name, value=1):
+    """Increase a counter of the active collector (if any)"""
+    collector = get_collector()
+    if collector is not None:
+        collector.count(name, value)
+
+
+def annotate(**extra):
+    """Add extra information to the event of the active collector (if any)"""
+    collector = get_collector()
+    if collector is not None:
+        collector.extra.update(extra)
+
+
+class EventWriter(object):
+    """
+    Appends events as json lines to a file. Events are buffered, and written with a single
+    write when batch_size events are buffered or the oldest event is flush_interval seconds old.
+    As the file is opened in append mode, multiple processes can write to the same file.
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=10, clock=time.monotonic):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.buffer = []
+        self.oldest = None
+        self.lock = threading.Lock()
+
+    def write(self, event):
+        line = json.dumps(event, separators=(",", ":"), default=str) + "\n"
+        with self.lock:
+            if not self.buffer:
+                self.oldest = self.clock()
+            self.buffer.append(line)
+            if len(self.buffer) >= self.batch_size or self.clock() - self.oldest >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        data = "".join(self.buffer).encode("utf-8")
+        self.buffer = []
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+@functools.lru_cache()
+def get_writer():
+    """Return the EventWriter for settings.TELEMETRY_FILE, or None if telemetry is disabled"""
+    path = getattr(settings, "TELEMETRY_FILE", None)
+    if not path:
+        return None
+    writer = EventWriter(path, settings.TELEMETRY_BATCH_SIZE, settings.TELEMETRY_FLUSH_INTERVAL)
+    atexit.register(writer.flush)
+    return writer
+
+
+class TelemetryMiddleware(object):
+    """Collects telemetry for each request. The event name is the name of the view (or the path)."""
+
+    def process_request(self, request):
+        request._telemetry = start("request", request.path, method=request.method)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        collector = getattr(request, "_telemetry", None)
+        if collector is not None and request.resolver_match is not None:
+            collector.name = request.resolver_match.view_name or collector.name
+
+    def process_response(self, request, response):
+        collector = getattr(request, "_telemetry", None)
+        if collector is not None:
+            if not response.streaming:
+                collector.count("response_bytes", len(response.content))
+            collector.extra["status"] = response.status_code
+            finish(collector)
+        return response
+
+
+def read_events(path, since=None):
+    """
+    Yield the events in the given file as dicts, skipping lines that cannot be parsed
+    @param since: if given, only yield events after this datetime
+    """
+    since = since.timestamp() if since is not None else None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if since is None or event["timestamp"] >= since:
+                yield event
+
+
+def percentile(values, p):
+    """Return the p-th percentile (0..100) of the given sorted values, using the nearest rank"""
+    if not values:
+        return None
+    rank = math.ceil(p * len(values) / 100)
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def summarize(events, fields=("duration",)):
+    """
+    Summarize events per (kind, name). Fields are taken from the event, its stages or its counters.
+    @return: a list of dicts with kind, name, n, and for each field the p50, p95 and total
+             (if the field occurred in an event of that group), ordered by total duration
+    """
+    groups = collections.defaultdict(lambda: collections.defaultdict(list))
+    for event in events:
+        group = groups[event["kind"], event["name"]]
+        group["n"].append(1)
+        for field in fields:
+            value = event.get(field)
+            if value is None:
+                value = event.get("stages", {}).get(field, event.get("counters", {}).get(field))
+            if value is not None:
+                group[field].append(value)
+
+    result = []
+    for (kind, name), group in groups.items():
+        row = {"kind": kind, "name": name, "n": len(group.pop("n"))}
+        for field, values in group.items():
+            values.sort()
+            row.update({field + "_p50": percentile(values, 50), field + "_p95": percentile(values, 95),
+                        field + "_total": sum(values)})
+        result.append(row)
+    return sorted(result, key=lambda r: r.get("duration_total") or 0, reverse=True)
@@ -23,8 +23,8 @@ import iso8601
 from django.conf import settings
 
 from amcat.models import Article
-from amcat.tools import amcattest
-from amcat.tools.amcates import ES, get_article_dict, ALL_FIELDS, get_property_primitive_type
+from amcat.tools import amcattest, queryparser
+from amcat.tools.amcates import ES, get_article_dict, get_article_dicts, hash_digest, ALL_FIELDS, get_property_primitive_type, SentenceQuery
 from amcat.tools.amcattest import create_test_project
 from amcat.tools.keywordsearch import SearchQuery
 
@@ -379,6 +379,19 @@ class TestAmcatES(amcattest.AmCATTestCase):
         self.assertEqual({paul.id, adam.id}, q("* NOT eve"))
         self.assertEqual({eve.id}, q("NOT (NOT eve)"))
 
+    def test_get_article_dicts(self):
+        """Does batch hashing give the same results as get_article_dict?"""
+        project = create_test_project()
+        articles = [Article(title="a,b\\c {}".format(i), text="\u6f22\u5b57 \x0C {}".format(i), url="http://x",
+                            date=datetime.date(2015, 1, i + 1), project=project, properties={"n_int": i})
+                    for i in range(4)]
+        expected = [get_article_dict(a, sets=[1]) for a in articles]
+        self.assertEqual(get_article_dicts(articles, sets=[1]), expected)
+
+        d = dict(expected[0])
+        del d["id"], d["sets"], d["hash"]
+        self.assertEqual(hash_digest(d).hex(), expected[0]["hash"])
+
     @amcattest.use_elastic
     def test_elastic_hash(self):
         """Can we reproduce a hash from elastic data alone?"""
@@ -468,4 +481,34 @@ class TestAmcatES(amcattest.AmCATTestCase):
         self.assertEqual(es_date, '1992-12-31T23:59:00')
         self.assertEqual(iso8601.parse_date(es_date, None), date)
 
+    @amcattest.use_elastic
+    def test_sentences(self):
+        s1, s2, a, b, c, d, e = self.setup()
 
+        # Backfill indexes each article once
+        self.assertEqual(ES().backfill_sentences(sets=s1.id), 4)
+        ES().refresh()
+        self.assertEqual(ES().backfill_sentences(sets=s1.id), 0)
+
+        self.assertEqual(ES().count_sentences(filters={"sets": s1.id}), 8)
+        self.assertEqual(ES().count_sentences("mies", filters={"sets": s1.id}), 4)
+        self.assertEqual(ES().count_sentences("mies", filters={"sets": s2.id}), 0)
+        self.assertEqual(ES().sentence_counts("m2", filters={"sets": s1.id}), {b.id: 1, c.id: 1, d.id: 1})
+
+        sentence, = ES().query_sentences("aap", filters={"sets": s1.id}, highlight=True)
+        self.assertEqual((sentence.article_id, sentence.parnr, sentence.sentence), (a.id, 2, "aap noot mies"))
+        self.assertIn("<mark>aap</mark>", sentence.highlight["sentence"][0])
+
+        # Sentence level queries match articles with a sentence matching the whole query
+        self.assertEqual(ES().count(queryparser.parse_to_terms("m2 AND zus"), filters={"sets": s1.id}), 3)
+        sentence_query = SentenceQuery(queryparser.parse_to_terms("m2 AND zus"))
+        self.assertEqual(ES().count(sentence_query, filters={"sets": s1.id}), 0)
+        sentence_query = SentenceQuery(queryparser.parse_to_terms("wim AND zus"))
+        self.assertEqual(set(ES().query_ids(sentence_query, filters={"sets": s1.id})), {b.id, c.id, d.id})
+
+        # Sentences are removed with their articles
+        self.assertGreater(ES().count_sentences(filters={"ids": [a.id]}), 0)
+        ES().delete_sentences([a.id])
+        ES().refresh()
+        self.assertEqual(ES().count_sentences(filters={"ids": [a.id]}), 0)
+        self.assertGreater(ES().count_sentences(filters={"ids": [b.id]}), 0)
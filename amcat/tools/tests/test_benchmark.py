@@ -0,0 +1,60 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+import json
+import random
+
+from django.test import TransactionTestCase
+
+from amcat.tools import amcattest, benchmark
+
+
+class TestBenchmark(TransactionTestCase):
+    # ORMAggregate uses threads (and thus other connections), so the corpus must be committed
+    fixtures = ['_initial_data.json']
+
+    def test_vocabulary(self):
+        self.assertEqual(benchmark.get_vocabulary(100, random.Random(1)), benchmark.get_vocabulary(100, random.Random(1)))
+        self.assertEqual(len(set(benchmark.get_vocabulary(100, random.Random(1)))), 100)
+
+    def test_time_function(self):
+        calls = []
+        durations = benchmark.time_function(calls.append, setup=lambda: len(calls), repeat=3)
+        self.assertEqual(len(durations), 3)
+        self.assertEqual(calls, [0, 1, 2])
+
+    def test_compare(self):
+        old = {"parameters": {}, "benchmarks": {"a": {"median": 1.0}, "b": {"median": 1.0}, "c": {"median": 1.0}}}
+        new = {"parameters": {}, "benchmarks": {"a": {"median": 1.5}, "b": {"median": 1.1}, "d": {"median": 1.0}}}
+        self.assertEqual([(name, status) for (name, _, _, _, status) in benchmark.compare(old, new)],
+                         [("a", "regression"), ("b", "ok"), ("c", "removed"), ("d", "new")])
+        self.assertEqual(benchmark.compare(new, old)[0][-1], "improvement")
+
+    @amcattest.use_elastic
+    def test_run_benchmarks(self):
+        corpus = benchmark.create_corpus(articles=20, words=30, vocabulary=100, codes=5, batch=5, lexisnexis=4)
+        self.assertEqual(sum(s.articles.count() for s in corpus.articlesets), 20)
+        self.assertEqual(corpus.codingjobs[0].coded_articles.filter(codings__isnull=False).count(), 10)
+
+        report = benchmark.run_benchmarks(corpus, repeat=1)
+        self.assertEqual(list(report["benchmarks"]), list(benchmark.BENCHMARKS))
+        self.assertEqual(json.loads(json.dumps(report))["parameters"]["articles"], 20)
+        for result in report["benchmarks"].values():
+            self.assertLessEqual(result["min"], result["max"])
+        self.assertGreater(report["benchmarks"]["aggregate_date"]["es_calls"], 0)
+        self.assertGreater(report["benchmarks"]["orm_aggregate"]["sql_queries"], 0)
@@ -1,6 +1,6 @@
 from amcat.tools import amcattest
 from amcat.tools.caching import cached, invalidates, cached_named, invalidates_named, reset, \
-    set_cache, get_object, clear_cache, get_objects
+    set_cache, get_object, clear_cache, get_objects, get_cache_stats, ObjectCache
 
 
 class TestCaching(amcattest.AmCATTestCase):
@@ -149,4 +149,50 @@ class TestCaching(amcattest.AmCATTestCase):
             ps = list(get_objects(Project, pids))
 
         with self.checkMaxQueries(0, "Get multiple cached projects one by one"):
-            ps = [get_objects(Project, pid) for pid in pids]
\ No newline at end of file
+            ps = [get_objects(Project, pid) for pid in pids]
+
+    def test_get_objects_order(self):
+        from amcat.models.project import Project
+
+        pids = [amcattest.create_test_project().id for _x in range(5)]
+        list(get_objects(Project, pids[1:3]))
+
+        with self.checkMaxQueries(1, "Get partially cached projects"):
+            ps = list(get_objects(Project, reversed(pids + [-1])))
+        self.assertEqual(list(reversed(pids)), [p.id for p in ps])
+
+    def test_object_cache_invalidation(self):
+        from amcat.models.project import Project
+
+        p = amcattest.create_test_project(name="foo")
+        self.assertEqual(get_object(Project, p.id).name, "foo")
+
+        p.name = "bar"
+        p.save()
+        self.assertEqual(get_object(Project, p.id).name, "bar")
+
+        hits = get_cache_stats(Project)["hits"]
+        get_object(Project, p.id)
+        self.assertEqual(get_cache_stats(Project)["hits"], hits + 1)
+
+    def test_object_cache_bounds(self):
+        cache = ObjectCache(maxsize=2, timeout=60)
+        for i in range(3):
+            cache.set(i, str(i))
+        self.assertEqual(2, len(cache))
+        self.assertEqual(1, cache.evictions)
+        self.assertRaises(KeyError, cache.get, 0)
+        self.assertEqual("2", cache.get(2))
+
+        # Least recently *used* item is evicted
+        cache.get(1)
+        cache.set(3, "3")
+        self.assertRaises(KeyError, cache.get, 2)
+        self.assertEqual("1", cache.get(1))
+
+        # Expired entries are misses
+        cache = ObjectCache(maxsize=2, timeout=-1)
+        cache.set(0, "0")
+        self.assertRaises(KeyError, cache.get, 0)
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+
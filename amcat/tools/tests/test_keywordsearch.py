@@ -2,7 +2,7 @@ from amcat.models import Language, Code
 from amcat.tools import amcattest
 from amcat.tools.amcattest import create_test_codebook
 from amcat.tools.keywordsearch import SearchQuery, resolve_queries
-from amcat.tools import djangotoolkit
+from amcat.tools import djangotoolkit, queryparser
 from amcat.tools.toolkit import strip_accents
 
 
@@ -57,6 +57,23 @@ class TestSearchQuery(amcattest.AmCATTestCase):
         query_words = set(result_query[1:-1].split(" OR "))
         self.assertSetEqual(query_words, expected_results)
 
+    def test_resolve_queries_compiled(self):
+        query = list(resolve_queries([SearchQuery("<root+> AND x")], self.codebook, self.l_lang, self.r_lang))[0]
+        terms = query.get_terms()
+        self.assertEqual(terms.operator, "AND")
+
+        codes, x = terms.terms
+        self.assertEqual(str(x), "_all::x")
+        self.assertIsInstance(codes.terms[0], queryparser.Terms)
+        self.assertEqual(codes.terms[0].texts[:4], ["root", "r", "code", "one"])
+        self.assertIn("eins", codes.terms[0].texts)
+        self.assertEqual(str(codes.terms[1]), "AND[_all::drei _all::drie _all::trois]")
+
+        # References in proximity queries can't be compiled, so they are parsed from the query string
+        query = list(resolve_queries([SearchQuery("<codes+> W/10 x")], self.codebook, self.l_lang, self.r_lang))[0]
+        self.assertIsNone(query.terms)
+        self.assertRaises(queryparser.QueryParseError, query.get_terms)
+
     def _get_test_codebook(self, codes, l_lang, r_lang):
         codebook = create_test_codebook()
         code_dict = {}
@@ -0,0 +1,71 @@
+##########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+import time
+
+from amcat.tools import amcattest, profiling
+
+
+def _busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class TestProfiling(amcattest.AmCATTestCase):
+    def test_sampling_profiler(self):
+        with profiling.SamplingProfiler(interval=0.001) as profiler:
+            _busy(0.1)
+        self.assertGreater(profiler.samples, 5)
+        stack, _ = max(profiler.stacks.items(), key=lambda s: s[1])
+        self.assertIn(":_busy:", stack.split(";")[-1])
+
+    def test_profile_call(self):
+        def create(n):
+            for _ in range(n):
+                amcattest.create_test_project()
+            return n
+
+        result, profile = profiling.profile_call(create, 2)
+        self.assertEqual(result, 2)
+        self.assertGreater(profile["sql"]["count"], 0)
+        self.assertEqual(profile, profiling.deserialize_profile(profiling.serialize_profile(profile)))
+
+        def fail():
+            amcattest.create_test_project()
+            raise ValueError("!")
+        try:
+            profiling.profile_call(fail)
+        except ValueError as e:
+            self.assertIn("ValueError", e.profile["error"])
+            self.assertGreater(e.profile["sql"]["count"], 0)
+        else:
+            self.fail("Error not raised")
+
+    def test_slowest_calls(self):
+        calls = profiling.SlowestCalls("time", max_calls=3)
+        for t in [5, 1, 4, 2, 3, 6]:
+            calls.append({"time": t})
+        self.assertEqual(calls.to_dict(), {"count": 6, "time": 21, "slowest": [{"time": 6}, {"time": 5}, {"time": 4}]})
+
+    def test_task_profile(self):
+        from amcat.models import Task
+        task = Task.objects.create(class_name="x", handler_class_name="y", arguments={}, profiling=True)
+        self.assertIsNone(task.get_profile())
+        task.save_profile({"stacks": {"a;b": 3}})
+        self.assertEqual(Task.objects.get(pk=task.pk).get_profile(), {"stacks": {"a;b": 3}})
@@ -18,7 +18,7 @@
 ###########################################################################
 import unittest
 
-from amcat.tools.progress import ProgressMonitor
+from amcat.tools.progress import ProgressMonitor, ThrottledListener
 
 
 class TestProgressMonitor(unittest.TestCase):
@@ -67,3 +67,23 @@ class TestProgressMonitor(unittest.TestCase):
         sm2.update()
         self.assertAlmostEqual(monitor.get_progress(), 2/5 + 1/2 * 3 * 1/5)
 
+    def test_throttle(self):
+        now = [0]
+        updates = []
+        monitor = ProgressMonitor(total=100, log=False)
+        monitor.add_listener(ThrottledListener(lambda m: updates.append(m.progress), min_interval=1,
+                                               min_delta=0.1, clock=lambda: now[0]))
+        monitor.update(1)
+        monitor.update(1)
+        monitor.update(10)
+        self.assertEqual(updates, [0.01, 0.12])
+
+        # Small updates are passed on after min_interval, unchanged progress never
+        now[0] = 2
+        monitor.update(0)
+        monitor.update(1)
+        self.assertEqual(updates, [0.01, 0.12, 0.13])
+
+        # Completion is always passed on
+        monitor.update(87)
+        self.assertEqual(updates[-1], 1)
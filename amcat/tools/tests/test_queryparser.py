@@ -1,5 +1,7 @@
+import time
+
 from amcat.tools import amcattest
-from amcat.tools.queryparser import parse_to_terms, QueryParseError, parse
+from amcat.tools.queryparser import parse_to_terms, QueryParseError, parse, compile_disjunction
 
 
 class TestQueryParser(amcattest.AmCATTestCase):
@@ -79,3 +81,75 @@ class TestQueryParser(amcattest.AmCATTestCase):
         ]}}
 
         self.assertEqual(q('a W/10 (b c)'), expected)
+
+    def test_operators(self):
+        q = lambda s: str(parse_to_terms(s))
+
+        # NOT can be used inside a chain of operators
+        self.assertEqual(q('a AND NOT b'), 'AND[_all::a NOT[_all::b]]')
+        self.assertEqual(q('NOT a b'), 'OR[NOT[_all::a] _all::b]')
+
+        # operators need to be separate words
+        self.assertEqual(q('a ANDROID'), 'OR[_all::a _all::ANDROID]')
+        self.assertEqual(q('NOTa'), '_all::NOTa')
+
+        # operator words without operands are terms
+        self.assertEqual(q('AND'), '_all::AND')
+        self.assertEqual(q('OR b'), 'OR[_all::OR _all::b]')
+
+        # the last operator in a chain wins
+        self.assertEqual(q('a AND b OR c'), 'OR[_all::a _all::b _all::c]')
+
+    def test_errors(self):
+        def error_position(s):
+            with self.assertRaises(QueryParseError) as cm:
+                parse_to_terms(s)
+            return str(cm.exception).split("\n")[-1].index("^")
+
+        self.assertEqual(error_position('(a b (c'), 5)
+        self.assertEqual(error_position('(a'), 2)
+        self.assertEqual(error_position('a AND'), 2)
+        self.assertEqual(error_position(':a'), 0)
+        self.assertEqual(error_position('a:'), 2)
+        self.assertEqual(error_position('a:b:c'), 3)
+
+    def test_nesting(self):
+        """Failing alternatives should not be parsed again, which is exponential in the nesting depth"""
+        start = time.time()
+        with self.assertRaises(QueryParseError):
+            parse_to_terms("NOT (" * 50 + "x")
+        self.assertEqual(str(parse_to_terms("NOT (" * 50 + "x" + ")" * 50)), "NOT[" * 50 + "_all::x" + "]" * 50)
+        self.assertLess(time.time() - start, 1)
+
+    def test_cache(self):
+        self.assertEqual(parse_to_terms('a b').terms[0].text, 'a')
+
+        # modifying a result should not affect the cache
+        terms = parse_to_terms('a b')
+        terms.terms.pop()
+        self.assertEqual(str(parse_to_terms('a b')), 'OR[_all::a _all::b]')
+        dsl = parse('a AND b')
+        dsl["bool"]["must"].pop()
+        self.assertEqual(len(parse('a AND b')["bool"]["must"]), 2)
+
+        self.assertEqual(str(parse_to_terms('a', default_fieldname="text")), 'text::a')
+
+    def test_compile_disjunction(self):
+        q = lambda *queries: str(compile_disjunction(queries))
+
+        self.assertEqual(q('a'), '_all::TERMS[a]')
+        self.assertEqual(q('a', 'b c', 'a', 'x:y'), 'OR[_all::TERMS[a b c] x::TERMS[y]]')
+        self.assertEqual(q('a', '"b c"', 'd*', 'e AND f'),
+                         'OR[_all::TERMS[a] _all::QUOTE[b c] _all::d* AND[_all::e _all::f]]')
+        self.assertIsNone(compile_disjunction([]))
+
+        self.assertEqual(compile_disjunction(['a', 'B']).get_filter_dsl(), {'terms': {'_all': ['a', 'b']}})
+        self.assertEqual(compile_disjunction(['a', 'B']).get_dsl(), {'terms': {'_all': ['a', 'b']}})
+
+        # Only terms that are a single token are grouped, folded like the index analyzer
+        self.assertEqual(q('anti-semitism', 'U.S.', "CDA's", 'Straße', 'ω'),
+                         "OR[_all::TERMS[strasse] _all::anti-semitism _all::U.S. _all::CDA's _all::ω]")
+
+        texts = ["t{}".format(i) for i in range(2500)]
+        dsl = compile_disjunction(texts).get_dsl()
+        self.assertEqual([len(q["terms"]["_all"]) for q in dsl["bool"]["should"]], [1000, 1000, 500])
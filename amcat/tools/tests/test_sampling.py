@@ -0,0 +1,84 @@
+##########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+from collections import Counter
+
+from amcat.tools import amcattest, sampling
+from amcat.tools.amcates import ES
+
+
+class TestSampling(amcattest.AmCATTestCase):
+    def test_reservoir_sample(self):
+        self.assertEqual(sampling.reservoir_sample(range(3), 5), [0, 1, 2])
+        self.assertEqual(sampling.reservoir_sample(range(100), 10, seed=1),
+                         sampling.reservoir_sample(range(100), 10, seed=1))
+
+        # Every item should be selected about equally often
+        counts = Counter()
+        for seed in range(2000):
+            sample = sampling.reservoir_sample(range(20), 5, seed=seed)
+            self.assertEqual(len(set(sample)), 5)
+            counts.update(sample)
+        self.assertEqual(set(counts), set(range(20)))
+        self.assertTrue(all(400 < c < 600 for c in counts.values()), counts)
+
+    def test_allocate(self):
+        self.assertEqual(sampling.allocate({"a": 10, "b": 5, "c": 1}, 7), {"a": 4, "b": 2, "c": 1})
+        self.assertEqual(sampling.allocate({"a": 10, "b": 5}, 20), {"a": 10, "b": 5})
+
+    def test_sample_articleset(self):
+        aset = amcattest.create_test_set(articles=10)
+        ids = aset.get_article_ids()
+        for strategy in ("ids", "reservoir"):
+            sample = sampling.sample_articleset(aset, 4, strategy=strategy, seed=42)
+            self.assertEqual(len(sample), 4)
+            self.assertTrue(set(sample) <= ids)
+            self.assertEqual(sample, sampling.sample_articleset(aset, 4, strategy=strategy, seed=42))
+        self.assertEqual(len(sampling.sample_articleset(aset, 0.5)), 5)
+        self.assertRaises(ValueError, sampling.sample_articleset, aset, 4, strategy="tablesample")
+
+    @amcattest.use_elastic
+    def test_stratified_sample(self):
+        aset = amcattest.create_test_set()
+        articles = [amcattest.create_test_article(articleset=aset, date="2015-0{}-01".format(m))
+                    for m in (1, 1, 1, 1, 2, 2, 2, 2, 3, 3)]
+        aset.add_articles(articles)
+        ES().refresh()
+
+        sample = sampling.stratified_sample_articleset(aset, 0.5, "date", seed=1)
+        months = Counter(a.date.month for a in articles if a.id in sample)
+        self.assertEqual(months, {1: 2, 2: 2, 3: 1})
+
+    @amcattest.use_elastic
+    def test_stratified_sample_property(self):
+        aset = amcattest.create_test_set()
+        media = ["De Krant"] * 4 + ["Het Blad"] * 4 + [None] * 2
+        articles = [amcattest.create_test_article(articleset=aset, properties={"medium": m} if m else {})
+                    for m in media]
+        aset.add_articles(articles)
+        ES().refresh()
+
+        # Strata are the (not analyzed) values, plus articles without a value
+        strata = sampling.get_strata(aset, "medium")
+        self.assertEqual(sorted(size for (_, size) in strata), [2, 4, 4])
+        self.assertIn({"term": {"medium.raw": "De Krant"}}, [f for (f, _) in strata])
+
+        sample = sampling.stratified_sample_articleset(aset, 0.5, "medium", seed=1)
+        self.assertEqual(len(set(sample)), 5)
+        counts = Counter(a.properties.get("medium") for a in articles if a.id in sample)
+        self.assertEqual(counts, {"De Krant": 2, "Het Blad": 2, None: 1})
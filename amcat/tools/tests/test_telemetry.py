@@ -0,0 +1,90 @@
+##########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+import os
+import tempfile
+
+from django.db import connection
+from django.test import override_settings
+
+from amcat.tools import amcattest, telemetry
+
+
+class TestTelemetry(amcattest.AmCATTestCase):
+    def test_event_writer(self):
+        now = [0]
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "telemetry.jsonl")
+            writer = telemetry.EventWriter(path, batch_size=3, flush_interval=10, clock=lambda: now[0])
+            writer.write({"x": 1})
+            writer.write({"x": 2})
+            self.assertFalse(os.path.exists(path))
+            writer.write({"x": 3})
+            self.assertEqual([e["x"] for e in telemetry.read_events(path)], [1, 2, 3])
+
+            # Events are also written when the oldest buffered event is too old
+            writer.write({"x": 4})
+            now[0] = 11
+            writer.write({"x": 5})
+            self.assertEqual([e["x"] for e in telemetry.read_events(path)], [1, 2, 3, 4, 5])
+
+    def test_summarize(self):
+        events = [{"kind": "task", "name": "a", "duration": d, "stages": {"parse": d / 2}, "counters": {}}
+                  for d in range(1, 101)]
+        events.append({"kind": "request", "name": "b", "duration": 1, "stages": {}, "counters": {"es_calls": 2}})
+        a, b = telemetry.summarize(events, fields=["duration", "parse", "es_calls"])
+        self.assertEqual((a["name"], a["n"], a["duration_p50"], a["duration_p95"]), ("a", 100, 50, 95))
+        self.assertEqual(a["parse_p95"], 47.5)
+        self.assertNotIn("es_calls_p50", a)
+        self.assertEqual((b["name"], b["es_calls_p50"]), ("b", 2))
+
+    def test_collect(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "telemetry.jsonl")
+            with override_settings(TELEMETRY_FILE=path, TELEMETRY_BATCH_SIZE=1, TELEMETRY_FLUSH_INTERVAL=10):
+                telemetry.get_writer.cache_clear()
+                try:
+                    with telemetry.collect("task", "test") as collector:
+                        with telemetry.stage("create"):
+                            amcattest.create_test_project()
+                        telemetry.count("projects")
+                        self.assertIs(telemetry.get_collector(), collector)
+                finally:
+                    telemetry.get_writer.cache_clear()
+
+            self.assertIsNone(telemetry.get_collector())
+            event, = telemetry.read_events(path)
+            self.assertEqual((event["kind"], event["name"]), ("task", "test"))
+            self.assertEqual(event["counters"]["projects"], 1)
+            self.assertGreater(event["counters"]["sql_queries"], 0)
+            self.assertIn("create", event["stages"])
+
+    def test_query_observer(self):
+        queries, inner = [], []
+        with telemetry.QueryObserver(lambda sql, duration: queries.append((sql, duration))):
+            amcattest.create_test_project()
+            self.assertFalse(connection.force_debug_cursor)
+            with telemetry.QueryObserver(lambda sql, duration: inner.append(sql)):
+                amcattest.create_test_user()
+        n = len(queries)
+        amcattest.create_test_user()
+
+        self.assertEqual(len(queries), n)
+        self.assertGreater(n, len(inner))
+        self.assertTrue(set(inner) <= {sql for (sql, _) in queries})
+        self.assertTrue(all(duration >= 0 for (_, duration) in queries))
@@ -2,6 +2,7 @@
 import logging
 
 from amcat.models import Project
+from amcat.tools import telemetry
 
 usage_log = logging.getLogger("amcat.usage")
 
@@ -16,6 +17,8 @@ def log_usage(username, type, action, project=None, **extra):
         "project": project,
     })
     
+    telemetry.annotate(domain=type, action=action)
+
     message = "{username}: {type} {action}".format(**locals())
     usage_log.info(message, extra=extra)
 
@@ -0,0 +1,181 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+"""
+The annotator bootstrap bundle contains everything the annotator needs to start coding
+a codingjob: the codingjob itself, its schemas and fields, the codebooks used by those
+fields (including labels), and the coding rules and actions. The list of coded articles
+is not part of the bundle, as the article table pages, sorts and searches it through the
+REST API.
+
+These models rarely change, but are expensive to serialise for large codebooks. The
+bundle is therefore serialised once and stored in the
+(shared) django cache. All stored bundles are invalidated when one of the underlying
+models is saved or deleted, by changing the bundle generation. Changes that bypass
+signals (bulk updates) become visible after BUNDLE_CACHE_SECONDS at the latest.
+"""
+import hashlib
+import json
+import logging
+import uuid
+
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.signals import post_save, post_delete
+
+from amcat.models import CodingSchema, CodingSchemaField, CodingRule, CodingRuleAction
+from amcat.models import Codebook, CodebookCode, Code, Label, CodingJob
+from amcat.models.coding import codingruletoolkit
+
+log = logging.getLogger(__name__)
+
+# Increase if the layout of the bundle changes, so clients never get a stale layout
+BUNDLE_VERSION = 3
+
+# Number of seconds a serialised bundle is kept in the cache
+BUNDLE_CACHE_SECONDS = 3600
+
+GENERATION_KEY = "annotator-bundle-generation"
+
+# Changing any of these models can change the models part of a bundle
+BUNDLE_MODELS = (CodingJob, CodingSchema, CodingSchemaField, CodingRule, CodingRuleAction,
+                 Codebook, CodebookCode, Code, Label)
+
+
+def _get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def invalidate_bundles(**kwargs):
+    """Invalidate all cached bundles. Used as signal receiver for BUNDLE_MODELS."""
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+for _model in BUNDLE_MODELS:
+    _uid = "annotator-bundle-" + _model._meta.label
+    post_save.connect(invalidate_bundles, sender=_model, weak=False, dispatch_uid=_uid)
+    post_delete.connect(invalidate_bundles, sender=_model, weak=False, dispatch_uid=_uid)
+
+
+def _dumps(obj):
+    return json.dumps(obj, cls=DjangoJSONEncoder, separators=(",", ":"))
+
+
+def _hash(*strings):
+    md5 = hashlib.md5()
+    for s in strings:
+        md5.update(s.encode("utf-8"))
+    return md5.hexdigest()
+
+
+def get_codebook_ids(codingjob):
+    """Return the ids of all codebooks used as highlighter or field codebook in `codingjob`"""
+    schema_ids = (codingjob.articleschema_id, codingjob.unitschema_id)
+    schemas = CodingSchema.objects.filter(id__in=schema_ids).prefetch_related("highlighters", "fields")
+
+    codebook_ids = set()
+    for schema in schemas:
+        codebook_ids.update(h.id for h in schema.highlighters.all())
+        codebook_ids.update(f.codebook_id for f in schema.fields.all())
+    return codebook_ids - {None}
+
+
+def _get_compiled_rules(schemas):
+    """Return mapping schema_id -> CompiledRules, skipping schemas with invalid rules"""
+    compiled = {}
+    for schema in schemas:
+        try:
+            compiled[schema.id] = codingruletoolkit.get_compiled_rules(schema)
+        except (SyntaxError, ValidationError, ObjectDoesNotExist):
+            log.warning("Could not compile codingrules of codingschema {schema.id}".format(**locals()))
+    return compiled
+
+
+def get_models(codingjob):
+    """
+    Serialise all models needed to code `codingjob`. The output
+    is identical to the output of the corresponding REST API calls, plus a mapping of
+    schema field ids to the ids of coding rules depending on them ('rule_dependencies').
+    """
+    # Lazy import: this module is imported while loading the app models (see models.py)
+    from api.rest.viewsets.coding.codebook import CodebookSerializer
+    from api.rest.viewsets.coding.codingrule import CodingRuleSerializer, CodingRuleActionSerializer
+    from api.rest.viewsets.coding.codingschema import CodingSchemaSerializer
+    from api.rest.viewsets.coding.codingschemafield import CodingSchemaFieldSerializer
+    from api.rest.serializer import AmCATModelSerializer
+
+    class CodingJobSerializer(AmCATModelSerializer):
+        class Meta:
+            model = CodingJob
+
+    schema_ids = (codingjob.articleschema_id, codingjob.unitschema_id)
+    schemas = CodingSchema.objects.filter(id__in=schema_ids).prefetch_related("highlighters")
+    fields = CodingSchemaField.objects.filter(codingschema__id__in=schema_ids)
+    rules = CodingRule.objects.filter(codingschema__id__in=schema_ids)
+    codebooks = Codebook.objects.filter(id__in=get_codebook_ids(codingjob))
+
+    # Compiled rules provide parsed conditions without parsing every rule separately
+    compiled = _get_compiled_rules(schemas)
+    parsed_conditions = {rule.id: codingruletoolkit.to_json(rule.tree, serialise=False)
+                         for schema_rules in compiled.values() for rule in schema_rules.rules}
+    rule_dependencies = {}
+    for schema_rules in compiled.values():
+        for field_id, rule_ids in schema_rules.get_dependencies_json().items():
+            rule_dependencies.setdefault(field_id, []).extend(rule_ids)
+
+    return {
+        "codingjob": CodingJobSerializer(codingjob).data,
+        "codingschemas": CodingSchemaSerializer(schemas, many=True).data,
+        "codingschemafields": CodingSchemaFieldSerializer(fields, many=True).data,
+        "codebooks": CodebookSerializer(codebooks, many=True).data,
+        "coding_rules": CodingRuleSerializer(rules, many=True, context={"parsed_conditions": parsed_conditions}).data,
+        "rule_dependencies": rule_dependencies,
+        "coding_rule_actions": CodingRuleActionSerializer(CodingRuleAction.objects.all(), many=True).data,
+    }
+
+
+def _get_serialised_models(codingjob):
+    """Return (hash, json) of the models of this codingjob, from the cache if possible"""
+    key = "annotator-bundle:{}:{}:{}".format(BUNDLE_VERSION, _get_generation(), codingjob.id)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    log.debug("Serialising annotator bundle for codingjob {codingjob.id}".format(**locals()))
+    serialised = _dumps(get_models(codingjob))
+    cached = (_hash(serialised), serialised)
+    cache.set(key, cached, BUNDLE_CACHE_SECONDS)
+    return cached
+
+
+def get_bundle(codingjob):
+    """
+    Return an (etag, json) tuple with the bundle of the given codingjob. The json is an
+    object with keys 'version' and 'models' (see get_models).
+
+    @type codingjob: CodingJob
+    """
+    models_hash, models = _get_serialised_models(codingjob)
+    etag = _hash(str(BUNDLE_VERSION), models_hash)
+    bundle = '{{"version":{},"models":{}}}'.format(BUNDLE_VERSION, models)
+    return etag, bundle
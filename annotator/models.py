@@ -1 +1,4 @@
-"""this empty file is required to run the unittests for this app specifically"""
\ No newline at end of file
+"""this empty file is required to run the unittests for this app specifically"""
+
+# Register the signals invalidating cached annotator bundles
+import annotator.bundle
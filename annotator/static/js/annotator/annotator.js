@@ -332,14 +332,8 @@ define([
     self.initialise_fields = function initialise_fields(){
         self.show_loading("Loading fields..")
 
-        self._requests = [
-            self.from_api(self.get_api_url()),
-            self.from_api(self.get_api_url() + "coding_rules"),
-            self.from_api(self.get_api_url() + "codebooks"),
-            self.from_api(self.get_api_url() + "codingschemas"),
-            self.from_api(self.get_api_url() + "codingschemafields"),
-            self.from_api(self.API_URL + "coding_rule_actions")
-        ];
+        // Everything needed to start coding is fetched in a single (cacheable) request
+        self._bootstrap = $.getJSON("bootstrap");
 
         // Fill status combobox
         $.each(self.STATUS, function(label, value){
@@ -349,23 +343,17 @@ define([
         });
 
 
-        $.when.apply(undefined, self._requests).then(function (codingjob, rules, codebooks, schemas, schemafields, actions) {
-                // Check if all request completed successfully. (If not, an
-                // error is already thrown, but we need not continue processing
-                // the data.
-                if (!all(self._requests, function (request) {
-                    return request.statusText === "OK";
-                })) {
-                    throw "Not all requests completed successfully.";
-                }
+        self._bootstrap.then(function (bundle) {
+                var models = bundle.models;
 
-                // Extract results from response
-                self.models.rules = map_ids(rules[0].results);
-                self.models.actions = map_ids(actions[0].results);
-                self.models.codebooks = map_ids(codebooks[0].results);
-                self.models.schemas = map_ids(schemas[0].results);
-                self.models.schemafields = map_ids(schemafields[0].results);
-                self.codingjob = codingjob[0];
+                // Extract models from bundle
+                self.models.rules = map_ids(models.coding_rules);
+                self.models.actions = map_ids(models.coding_rule_actions);
+                self.models.codebooks = map_ids(models.codebooks);
+                self.models.schemas = map_ids(models.codingschemas);
+                self.models.schemafields = map_ids(models.codingschemafields);
+                self.models.rule_dependencies = models.rule_dependencies;
+                self.codingjob = models.codingjob;
 
                 // Convert codebook.codes (array) to mapping code_id -> code
                 $.each(self.models.codebooks, function(codebook_id, codebook){
@@ -903,7 +891,8 @@ define([
     self.pre_serialise_coded_article = function pre_serialise_coded_article () {
         return {
             status_id : self.state.coded_article.status,
-            comments : self.state.coded_article.comments
+            comments : self.state.coded_article.comments,
+            version : self.state.coded_article.version
         }
     };
 
@@ -977,6 +966,7 @@ define([
 
             // BUG: Codings get lost sometimes. We try to detect the bug by checking the server:
             var response = JSON.parse(jqXHR.responseText);
+            self.state.coded_article.version = response.version;
             var expected_n_codings = self.get_codings().length;
             var expected_n_values = $.map(self.get_codings(), function(coding){
                 return $.grep(self.values(coding.values), self.is_empty_codingvalue, true).length;
@@ -183,6 +183,17 @@ define(["jquery"], function($){
             return self.field_codingrules;
         }
 
+        // Use the dependencies computed by the server if available
+        if (annotator.models.rule_dependencies !== undefined) {
+            self.field_codingrules = {};
+            $.each(annotator.models.rule_dependencies, function(field_id, rule_ids){
+                self.field_codingrules[field_id] = $.map(rule_ids, function(rule_id){
+                    return annotator.models.rules[rule_id];
+                });
+            });
+            return self.field_codingrules;
+        }
+
         var codingrule_fields = {};
         $.each(annotator.models.rules, function (i, rule) {
             var self = this;
@@ -0,0 +1,72 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import Client
+
+from amcat.tools import amcattest
+from annotator.bundle import get_bundle
+
+
+class TestBundle(amcattest.AmCATTestCase):
+    def setUp(self):
+        super(TestBundle, self).setUp()
+        schema, self.codebook, strf, intf, codef, _, _ = amcattest.create_test_schema_with_fields(isarticleschema=True)
+        self.coder = amcattest.create_test_user(password="test")
+        self.job = amcattest.create_test_job(articleschema=schema, narticles=3, coder=self.coder)
+
+    def test_bundle(self):
+        etag, bundle = get_bundle(self.job)
+        bundle = json.loads(bundle)
+
+        models = bundle["models"]
+        self.assertEqual(models["codingjob"]["id"], self.job.id)
+        self.assertEqual([cb["id"] for cb in models["codebooks"]], [self.codebook.id])
+        self.assertEqual(len(models["codebooks"][0]["codes"]), len(self.codebook.codebookcodes))
+        self.assertEqual(len(models["codingschemafields"]), 5)
+
+        self.assertNotIn("coded_articles", bundle)
+
+        # Serialised models are cached
+        with self.checkMaxQueries(0):
+            self.assertEqual(get_bundle(self.job)[0], etag)
+
+        # Coding an article does not change the etag, saving a codebook does
+        self.job.coded_articles.update(version=1)
+        etag2, _ = get_bundle(self.job)
+        self.assertEqual(etag, etag2)
+
+        self.codebook.name = "Changed"
+        self.codebook.save()
+        etag3, bundle = get_bundle(self.job)
+        self.assertNotEqual(etag2, etag3)
+        self.assertEqual(json.loads(bundle)["models"]["codebooks"][0]["name"], "Changed")
+
+    def test_view(self):
+        client = Client()
+        client.login(username=self.coder.username, password="test")
+        url = reverse("annotator:annotator-codingjob-bootstrap", args=(self.job.project_id, self.job.id))
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode())["models"]["codingjob"]["id"], self.job.id)
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
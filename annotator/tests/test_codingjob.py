@@ -0,0 +1,65 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+import json
+
+from django.test import Client
+
+from amcat.models import CodedArticle
+from amcat.tools import amcattest
+
+
+class TestSaveBatch(amcattest.AmCATTestCase):
+    def setUp(self):
+        super(TestSaveBatch, self).setUp()
+        schema, _, strf, self.intf, _, _, _ = amcattest.create_test_schema_with_fields(isarticleschema=True)
+        self.coder = amcattest.create_test_user(password="test")
+        self.job = amcattest.create_test_job(articleschema=schema, narticles=2, coder=self.coder)
+        self.coded_article = self.job.coded_articles.order_by("id")[0]
+        self.url = "/projects/{self.job.project_id}/codingjobs/{self.job.id}/codedarticles/save".format(**locals())
+        self.client = Client()
+        self.client.login(username=self.coder.username, password="test")
+
+    def _post(self, data):
+        return self.client.post(self.url, content_type="application/json", data=json.dumps(data))
+
+    def _coded_article(self, **kwargs):
+        value = {"codingschemafield_id": self.intf.id, "intval": 3}
+        return dict({"coded_article_id": self.coded_article.id, "status_id": 2, "comments": "x",
+                     "codings": [{"sentence_id": None, "values": [value]}]}, **kwargs)
+
+    def test_save_batch(self):
+        response = self._post([self._coded_article()])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content.decode())["saved_values"], 1)
+        self.assertEqual(CodedArticle.objects.get(pk=self.coded_article.id).comments, "x")
+
+    def test_invalid(self):
+        for data in [
+            {"coded_article_id": self.coded_article.id},
+            [self._coded_article(coded_article_id="x")],
+            [{"coded_article_id": self.coded_article.id, "codings": []}],
+            [self._coded_article(codings={})],
+            [self._coded_article(codings=[{"sentence_id": None}])],
+            [self._coded_article(codings=[{"values": [1]}])],
+        ]:
+            response = self._post(data)
+            self.assertEqual(response.status_code, 400, "{} gave {}".format(data, response.status_code))
+
+        # Nothing was saved
+        self.assertEqual(CodedArticle.objects.get(pk=self.coded_article.id).comments, None)
@@ -26,6 +26,8 @@ article_patterns = [
 
 codingjob_patterns = [
     url('^code$', codingjob.index, name="annotator-codingjob"),
+    url(r'^bootstrap$', codingjob.bootstrap, name="annotator-codingjob-bootstrap"),
+    url(r'^codedarticles/save$', codingjob.save_batch),
     url(r'^codedarticle/(?P<coded_article_id>\d+)/', include(article_patterns)),
 ]
 
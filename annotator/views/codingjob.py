@@ -20,21 +20,28 @@ from functools import partial
 
 import json
 import logging
-from django.core.exceptions import PermissionDenied
-from django.db import transaction, connection
-from django.db.models import sql
+import time
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction, connection, IntegrityError
+from django.db.models import sql, F
 
 from django.shortcuts import render
-from django.http import HttpResponseRedirect, HttpResponseBadRequest, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
 from django.core.urlresolvers import reverse
 import itertools
-from amcat.models.authorisation import ROLE_PROJECT_ADMIN
+from amcat.models.authorisation import ROLE_PROJECT_ADMIN, ROLE_PROJECT_READER
 
 
 from amcat.models import CodingJob, Project, Article, CodingValue, Coding, CodedArticle
+from amcat.models.coding.codedarticle import bulk_replace_codings
+from annotator.bundle import get_bundle
 
 log = logging.getLogger(__name__)
 
+# Number of seconds a successful permission check is remembered in the session
+PERMISSION_CACHE_SECONDS = 300
+
 
 def index(request, project_id, codingjob_id):
     """returns the HTML for the main annotator page"""
@@ -46,13 +53,59 @@ def index(request, project_id, codingjob_id):
     })
 
 
+def bootstrap(request, project_id, codingjob_id):
+    """
+    Returns the bundle with everything the annotator needs for this codingjob (see
+    annotator.bundle). Responds with 304 Not Modified if the client already has it.
+    """
+    codingjob = CodingJob.objects.get(id=codingjob_id)
+
+    if codingjob.project_id != int(project_id):
+        raise PermissionDenied("Given codingjob ({codingjob}) does not belong to project {project_id}!".format(**locals()))
+    if codingjob.coder_id != request.user.id and not codingjob.project.has_role(request.user, ROLE_PROJECT_READER):
+        raise PermissionDenied("Only {request.user} or project members can view this codingjob.".format(**locals()))
+
+    etag, bundle = get_bundle(codingjob)
+
+    if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(bundle, content_type="application/json")
+
+    # Clients may store the bundle, but must revalidate it on every use
+    response["ETag"] = quote_etag(etag)
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def _check_coder(request, codingjob):
+    if codingjob.coder_id == request.user.id:
+        return
+
+    # the user is not the assigned coder. Is s/he project admin? As checking roles is
+    # relatively expensive, remember the outcome for a while.
+    session_key = "annotator_project_admin_{codingjob.project_id}".format(**locals())
+    checked = request.session.get(session_key)
+    if checked is not None and time.time() - checked < PERMISSION_CACHE_SECONDS:
+        return
+
+    if not codingjob.project.has_role(request.user, ROLE_PROJECT_ADMIN):
+        raise PermissionDenied("Only {request.user} or project admins can edit this codingjob.".format(**locals()))
+
+    request.session[session_key] = time.time()
+
+
 def save(request, project_id, codingjob_id, coded_article_id):
     """
     Big fat warning: we don't do server side validation for the codingvalues. We
     do check if the codingjob and logged in user correspond, but it's the users
     responsibilty to send correct data (we don't care!).
+
+    Only differences with the stored codings are written (see CodedArticle.update_codings).
+    If the client sends the version of the coded article it started editing, the save is
+    refused with 409 Conflict if it was saved by someone else in the meantime.
     """
-    coded_article = CodedArticle.objects.select_related("codingjob__project", "codingjob", "article").get(id=coded_article_id)
+    coded_article = CodedArticle.objects.select_related("codingjob").get(id=coded_article_id)
 
     # sanity checks
     if coded_article.codingjob.project_id != int(project_id):
@@ -60,23 +113,110 @@ def save(request, project_id, codingjob_id, coded_article_id):
     if coded_article.codingjob_id != int(codingjob_id):
         raise PermissionDenied("CodedArticle has codingjob_id={coded_article.codingjob_id} but {codingjob_id} given in url!")
 
-    if coded_article.codingjob.coder_id != request.user.id:
-        # the user is not the assigned coder. Is s/he project admin?
-        if not  coded_article.codingjob.project.has_role(request.user, ROLE_PROJECT_ADMIN):
-            raise PermissionDenied("Only {request.user} or project admins can edit this codingjob.".format(**locals()))
+    _check_coder(request, coded_article.codingjob)
 
     try:
         codings = json.loads(request.body.decode())
     except ValueError:
         return HttpResponseBadRequest("Invalid JSON in POST body")
 
-    coded_article.status_id = codings["coded_article"]["status_id"]
-    coded_article.comments = codings["coded_article"]["comments"]
-    coded_article.save()
+    coded_articles = CodedArticle.objects.filter(id=coded_article.id)
+    version = codings["coded_article"].get("version")
+    if version is not None:
+        coded_articles = coded_articles.filter(version=version)
+
+    with transaction.atomic():
+        updated = coded_articles.update(
+            status_id=codings["coded_article"]["status_id"],
+            comments=codings["coded_article"]["comments"],
+            version=F("version") + 1
+        )
+
+        if not updated:
+            current = CodedArticle.objects.get(id=coded_article.id).version
+            return HttpResponse(status=409, content_type="application/json", content=json.dumps({
+                "error": "Coded article was saved by someone else (version {current}, you have version {version})"
+                         .format(**locals()),
+                "version": current
+            }))
+
+        new_coding_objects, new_coding_values = coded_article.update_codings(codings["codings"])
+
+    status = {
+        "saved_codings": len(new_coding_objects),
+        "saved_values": len(new_coding_values),
+        "version": version + 1 if version is not None else CodedArticle.objects.get(id=coded_article.id).version
+    }
+
+    return HttpResponse(status=201, content=json.dumps(status))
+
+
+# Keys of each object in the POST body of save_batch
+BATCH_KEYS = ("coded_article_id", "status_id", "comments", "codings")
+
+
+def _get_batch_codings(coded_articles):
+    """
+    Check the structure of the POST body of save_batch (see there)
+    @return: mapping coded_article_id -> list of coding dicts
+    @raises ValueError: if the body is not a list of objects with BATCH_KEYS
+    """
+    if not isinstance(coded_articles, list) or not all(isinstance(ca, dict) for ca in coded_articles):
+        raise ValueError("POST body must be a list of objects")
+
+    for ca in coded_articles:
+        missing = [key for key in BATCH_KEYS if key not in ca]
+        if missing:
+            raise ValueError("Coded article is missing key(s): {}".format(", ".join(missing)))
+        if not isinstance(ca["coded_article_id"], int) or not isinstance(ca["status_id"], int):
+            raise ValueError("coded_article_id and status_id must be integers")
+        if not isinstance(ca["codings"], list):
+            raise ValueError("codings must be a list")
+
+    return {ca["coded_article_id"]: ca["codings"] for ca in coded_articles}
+
+
+def save_batch(request, project_id, codingjob_id):
+    """
+    Saves codings of multiple coded articles of a codingjob in one transaction. The
+    POST body should contain a list of objects with the keys 'coded_article_id',
+    'status_id', 'comments' and 'codings' (see CodedArticle.replace_codings).
+
+    The same (lack of) validation as in save() applies, unless the parameter
+    'check_rules' is given: codings violating codingrules are then refused.
+    """
+    codingjob = CodingJob.objects.select_related("project").get(id=codingjob_id)
+
+    if codingjob.project_id != int(project_id):
+        raise PermissionDenied("Given codingjob ({codingjob}) does not belong to project ({codingjob.project})!".format(**locals()))
+
+    _check_coder(request, codingjob)
+
+    try:
+        coded_articles = json.loads(request.body.decode())
+    except ValueError:
+        return HttpResponseBadRequest("Invalid JSON in POST body")
+
+    try:
+        codings = _get_batch_codings(coded_articles)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
 
-    new_coding_objects, new_coding_values = coded_article.replace_codings(codings["codings"])
+    try:
+        with transaction.atomic():
+            check_rules = "check_rules" in request.GET
+            new_coding_objects, new_coding_values = bulk_replace_codings(codingjob, codings, check_rules)
+            for ca in coded_articles:
+                CodedArticle.objects.filter(id=ca["coded_article_id"]).update(
+                    status_id=ca["status_id"], comments=ca["comments"], version=F("version") + 1
+                )
+    except (ValueError, IntegrityError) as e:
+        return HttpResponseBadRequest(str(e))
+    except ValidationError as e:
+        return HttpResponseBadRequest("\n".join(e.messages))
 
     status = {
+        "saved_coded_articles": len(codings),
         "saved_codings": len(new_coding_objects),
         "saved_values": len(new_coding_values)
     }
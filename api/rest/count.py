@@ -22,6 +22,10 @@ This module contains helper functions for more efficient counting of
 query results.
 """
 
+import hashlib
+import json
+
+from django.core.cache import cache
 from django.db.models.query import QuerySet, EmptyResultSet
 from django.db import connection, DatabaseError
 from django.db.models.sql.where import WhereNode
@@ -38,6 +42,11 @@ SIMPLIFY = {
 }
 
 
+# Counts are keyed on the data version of all tables involved, so this timeout
+# merely serves to expire entries of old versions
+COUNT_CACHE_TIMEOUT = 60 * 60
+
+
 def _get_single_where(node):
     """
     Simplify a where clause to a single X=Y constraint, or raise a ValueError if that is impossible
@@ -107,9 +116,76 @@ def approximate_count(qs):
 
     raise ValueError("Where clause(s) applied. Cannot return approx count")
 
-def count(qs):
+def _is_postgres():
+    return connections.databases['default']["ENGINE"] == 'django.db.backends.postgresql_psycopg2'
+
+def estimate_count(qs):
+    """
+    Return the number of rows the postgres query planner expects this queryset to
+    yield. This is cheap regardless of the size of the tables involved, but can be
+    off by orders of magnitude for complex where clauses.
+    """
+    if not _is_postgres():
+        raise ValueError("Cannot estimate count on this database (!postgresql)")
+
+    sql, params = qs.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def get_data_version(tables):
+    """
+    Return a number that changes whenever rows are inserted, updated or deleted in
+    any of the given tables. It is based on the statistics collector of postgres,
+    which may lag behind (committed) changes for up to a second.
+    """
+    SQL = ("SELECT coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0) "
+           "FROM pg_stat_user_tables WHERE relname = ANY(%s)")
+
+    if not _is_postgres():
+        raise ValueError("Cannot determine data version on this database (!postgresql)")
+
+    with connection.cursor() as cursor:
+        cursor.execute(SQL, [list(tables)])
+        return int(cursor.fetchone()[0])
+
+def _get_tables(qs):
+    return sorted({qs.model._meta.db_table} | {a.table_name for a in qs.query.alias_map.values()})
+
+def get_count_cache_key(qs, counter=QuerySet.count):
+    """
+    Return a cache key based on the query of this queryset, the counter used (so exact
+    counts and estimates are cached separately) and the data version (see
+    get_data_version) of all tables involved.
+    """
+    sql, params = qs.order_by().query.sql_with_params()
+    version = get_data_version(_get_tables(qs))
+    counter_name = "{}.{}".format(counter.__module__, counter.__qualname__)
+    signature = json.dumps([sql, list(map(str, params)), version, counter_name]).encode("utf-8")
+    return "{}.count-cache".format(hashlib.sha256(signature).hexdigest())
+
+def cached_count(qs, counter=QuerySet.count, timeout=COUNT_CACHE_TIMEOUT):
+    """
+    Count queryset using `counter`, but only if the count is not cached for the
+    current version of the data.
+    """
+    cache_key = get_count_cache_key(qs, counter)
+    result = cache.get(cache_key)
+    if result is None:
+        result = counter(qs)
+        cache.set(cache_key, result, timeout)
+    return result
+
+def count(qs, estimate=False):
     """
     Selected the most efficient technique for counting this queryset
+
+    @param estimate: allow (cached) estimates of the query planner, see estimate_count
     """
     if not isinstance(qs, QuerySet):
         return len(qs)
@@ -126,4 +202,11 @@ def count(qs):
     except ValueError as e:
         log.debug("Error on approximating: {e}".format(e=e))
 
+    try:
+        return cached_count(qs, counter=estimate_count if estimate else QuerySet.count)
+    except ValueError as e:
+        log.debug("Could not use cached count: {e}".format(e=e))
+    except EmptyResultSet:
+        return 0
+
     return qs.count()
@@ -16,13 +16,19 @@
 # You should have received a copy of the GNU Affero General Public        #
 # License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
+import base64
+import binascii
+import functools
+import operator
 from collections import OrderedDict
 import json
 from django.core.paginator import Paginator, Page, InvalidPage
+from django.db.models import Q, QuerySet
 
 from rest_framework import pagination
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 from api.rest import count
 
 
@@ -41,6 +47,12 @@ class AmCATPaginator(Paginator):
     def _get_page(self, *args, **kwargs):
         return AmCATPage(*args, **kwargs)
 
+    def _get_count(self):
+        if getattr(self, "_count", None) is None:
+            self._count = count.count(self.object_list)
+        return self._count
+    count = property(_get_count)
+
 
 class AmCATPage(Page):
     def __len__(self):
@@ -101,3 +113,148 @@ class AmCATPageNumberPagination(pagination.PageNumberPagination):
             ('results', data)
         ]))
 
+
+def _reverse_ordering(field):
+    return field[1:] if field.startswith("-") else "-" + field
+
+
+def _get_column_ordering(model, field):
+    """
+    Translate an ordering on a (possibly related, using __) foreign key into an ordering on
+    its column, i.e. 'project' becomes 'project_id'. Otherwise, Django would order on the
+    default ordering of the related model, and the cursor would contain model instances.
+    """
+    desc = "-" if field.startswith("-") else ""
+    *path, name = field.lstrip("-").split("__")
+    for part in path:
+        model = model._meta.get_field(part).related_model
+    if name != "pk":
+        field = model._meta.get_field(name)
+        if field.many_to_one:
+            name = field.attname
+    return desc + "__".join(path + [name])
+
+
+def _get_field_value(obj, field):
+    """Get the value of a (possibly related, using __) field name on a model instance"""
+    return functools.reduce(getattr, field.lstrip("-").split("__"), obj)
+
+
+def get_keyset_filter(ordering, values):
+    """
+    Return a Q object selecting all rows coming strictly after the row with the given
+    values in the given ordering, i.e. (a, b) > (x, y) becomes (a > x) OR (a = x AND b > y).
+    """
+    disjuncts = []
+    for i, (field, value) in enumerate(zip(ordering, values)):
+        lookup = "{}__lt" if field.startswith("-") else "{}__gt"
+        equal = {f.lstrip("-"): v for f, v in zip(ordering[:i], values[:i])}
+        disjuncts.append(Q(**equal) & Q(**{lookup.format(field.lstrip("-")): value}))
+    return functools.reduce(operator.or_, disjuncts)
+
+
+class AmCATKeysetPagination(pagination.PageNumberPagination):
+    """
+    Alternative for AmCATPageNumberPagination which does not use OFFSET, but selects
+    rows based on the ordering values of the last (or first) row of the previous page.
+    This makes fetching a page equally fast regardless of how deep it is, provided the
+    ordering of the queryset is supported by an index.
+
+    Clients request the first page with an empty cursor parameter and should follow the
+    'next' and 'previous' links, which contain an opaque cursor. The primary key is added
+    to the ordering to make it unique. Ordering fields must not be NULL. If estimate_count
+    is set, totals are based on the row estimate of the query planner (see
+    count.estimate_count).
+    """
+    cursor_query_param = "cursor"
+    estimate_count = False
+    template = None
+
+    def get_ordering(self, queryset):
+        ordering = [o for o in (queryset.query.order_by or queryset.model._meta.ordering) if isinstance(o, str)]
+        ordering = [_get_column_ordering(queryset.model, o) for o in ordering if o != "?"]
+
+        pk = queryset.model._meta.pk.name
+        if not any(o.lstrip("-") in ("pk", pk) for o in ordering):
+            ordering.append(pk)
+
+        return ordering
+
+    def encode_cursor(self, direction, obj):
+        values = [_get_field_value(obj, field) for field in self.ordering]
+        cursor = json.dumps({direction: values}, default=str).encode("utf-8")
+        return base64.urlsafe_b64encode(cursor).decode("ascii")
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, None
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+            (direction, values), = cursor.items()
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound("Invalid cursor")
+
+        if direction not in ("after", "before") or len(values) != len(self.ordering):
+            raise NotFound("Invalid cursor")
+
+        return direction, values
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self._handle_backwards_compat(view)
+
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        if not isinstance(queryset, QuerySet):
+            raise ParseError("A cursor cannot be used with this ordering")
+
+        self.request = request
+        self.queryset = queryset
+        self.ordering = self.get_ordering(queryset)
+
+        direction, values = self.decode_cursor(request)
+        ordering = self.ordering
+        if direction == "before":
+            ordering = list(map(_reverse_ordering, ordering))
+
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(get_keyset_filter(ordering, values))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if direction == "before":
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, direction is not None
+
+        self.results = results
+        return results
+
+    def get_next_link(self):
+        if not (self.has_next and self.results):
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor("after", self.results[-1]))
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.results):
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor("before", self.results[0]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('echo', get_echo(self.request)),
+            ('total', count.count(self.queryset, estimate=self.estimate_count)),
+            ('per_page', self.page_size),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
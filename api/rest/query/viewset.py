@@ -29,6 +29,7 @@ from rest_framework.views import APIView
 
 from amcat.models import Project, CodingJob
 from amcat.tools.caching import cached
+from amcat.tools.profiling import wants_profile
 
 
 def wrap_query_action(qaction):
@@ -131,7 +132,7 @@ class QueryActionView(APIView):
             #HACK! Sets query to session for article higlighting
             request.session['query'] = qa.data['query']
 
-            task_handler = qa.run_delayed()
+            task_handler = qa.run_delayed(profile=wants_profile(request))
         except ValidationError as e:
             return Response(e.message_dict, status=400)
         else:
@@ -18,10 +18,14 @@
 ###########################################################################
 from copy import copy
 
-from rest_framework.decorators import api_view
-from django.http import HttpResponse
+import json
 
-from amcat.models.task import Task, TaskPending
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from django.http import HttpResponse, Http404
+
+from amcat.models.task import Task, TaskPending, get_task_progress
 from api.rest.resources.amcatresource import AmCATResource
 from api.rest.viewsets.task import TaskSerializer, TaskResultSerializer
 
@@ -55,3 +59,35 @@ def single_task_result(request, task_id, uuid=False):
         else:
             error_msg = "{e.__class__.__name__}: {e}".format(**locals())
         return HttpResponse(content=error_msg, status=500)
+
+
+@api_view(http_method_names=("GET",))
+def task_progress(request, task_id):
+    """
+    Return the progress of a task (by uuid). Only reads redis (or the result backend if there
+    is no redis cache, see get_task_progress), so it is cheap to poll.
+    """
+    return Response({"uuid": task_id, "progress": get_task_progress(task_id)})
+
+
+@api_view(http_method_names=("GET",))
+@permission_classes((IsAdminUser,))
+def task_profile(request, task_id):
+    """
+    Download the profile of a task (by uuid) that was run with profiling enabled. Use
+    ?folded to get only the folded stacks, e.g. to create a flamegraph.
+    """
+    task = Task.objects.filter(uuid=task_id).first()
+    profile = task and task.get_profile()
+    if profile is None:
+        raise Http404("Task {} does not exist or was not profiled".format(task_id))
+
+    if "folded" in request.GET:
+        content = "".join("{} {}\n".format(stack, n) for (stack, n) in profile["stacks"].items())
+        response = HttpResponse(content, content_type="text/plain")
+        extension = "folded"
+    else:
+        response = HttpResponse(json.dumps(profile, indent=1), content_type="application/json")
+        extension = "json"
+    response["Content-Disposition"] = 'attachment; filename="profile-{}.{}"'.format(task_id, extension)
+    return response
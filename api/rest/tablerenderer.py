@@ -28,7 +28,7 @@ from functools import partial
 
 from rest_framework.renderers import *
 from amcat.tools.table import table3
-from amcat.tools.amcatr import create_dataframe, save_to_bytes, to_r
+from amcat.tools.amcatr import create_dataframe, save_to_bytes, rows_to_columns
 
 import logging
 
@@ -294,14 +294,7 @@ class RdaRenderer(BaseRenderer):
     extension = 'rda'
 
     def json_to_vectors(self, rows):
-        result = {}
-        n = len(rows)
-        for i, row in enumerate(rows):
-            for k, v in row.iteritems():
-                if k not in result:
-                    result[k] = [None] * n
-                result[k][i] = v
-        return result
+        return rows_to_columns(rows)
 
     def render(self, data, media_type=None, renderer_context=None):
         try:
@@ -310,13 +303,13 @@ class RdaRenderer(BaseRenderer):
                              'status': renderer_context['response'].status_code})
             else:
                 vectors = self.json_to_vectors(data['results'])
-                data['results'] = create_dataframe(vectors.iteritems())
+                data['results'] = create_dataframe(vectors.items())
             return save_to_bytes(**data)
         except:
             logging.exception("Error on rendering to rda")
             raise
-        
-        
+
+
 EXPORTERS = [CSVRenderer, XLSXRenderer, SPSSRenderer, XHTMLRenderer, RdaRenderer]
 FORMAT_RENDERER_MAP = {renderer.format: renderer for renderer in EXPORTERS}
 
@@ -0,0 +1,83 @@
+###########################################################################
+#          (C) Vrije Universiteit, Amsterdam (the Netherlands)            #
+#                                                                         #
+# This file is part of AmCAT - The Amsterdam Content Analysis Toolkit     #
+#                                                                         #
+# AmCAT is free software: you can redistribute it and/or modify it under  #
+# the terms of the GNU Affero General Public License as published by the  #
+# Free Software Foundation, either version 3 of the License, or (at your  #
+# option) any later version.                                              #
+#                                                                         #
+# AmCAT is distributed in the hope that it will be useful, but WITHOUT    #
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or   #
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public     #
+# License for more details.                                               #
+#                                                                         #
+# You should have received a copy of the GNU Affero General Public        #
+# License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from amcat.models import Article, CodingJob
+from amcat.tools import amcattest
+from api.rest.pagination import AmCATKeysetPagination
+
+
+class TestKeysetPagination(amcattest.AmCATTestCase):
+    def _paginate(self, queryset, url):
+        paginator = AmCATKeysetPagination()
+        request = Request(APIRequestFactory().get(url))
+        return paginator, paginator.paginate_queryset(queryset, request)
+
+    def test_pages(self):
+        aset = amcattest.create_test_set(5)
+        qs = Article.objects.filter(articlesets_set=aset).order_by("-id")
+        ids = list(qs.values_list("id", flat=True))
+
+        url, pages = "/?page_size=2", []
+        while url:
+            paginator, results = self._paginate(qs, url)
+            pages.append([a.id for a in results])
+            url = paginator.get_next_link()
+
+        self.assertEqual([ids[0:2], ids[2:4], ids[4:5]], pages)
+
+        # Walk back using previous links
+        url = paginator.get_previous_link()
+        paginator, results = self._paginate(qs, url)
+        self.assertEqual(ids[2:4], [a.id for a in results])
+        paginator, results = self._paginate(qs, paginator.get_previous_link())
+        self.assertEqual(ids[0:2], [a.id for a in results])
+        self.assertIsNone(paginator.get_previous_link())
+
+    def test_non_unique_ordering(self):
+        aset = amcattest.create_test_set(0)
+        for i in range(5):
+            amcattest.create_test_article(articleset=aset, date="2016-01-01")
+        qs = Article.objects.filter(articlesets_set=aset).order_by("date")
+
+        url, ids = "/?page_size=2", []
+        while url:
+            paginator, results = self._paginate(qs, url)
+            ids += [a.id for a in results]
+            url = paginator.get_next_link()
+
+        self.assertEqual(sorted(aset.get_article_ids()), ids)
+
+    def test_foreign_key_ordering(self):
+        # CodingJob is ordered on ('project', '-id'), which should page on project_id
+        p1, p2 = amcattest.create_test_project(), amcattest.create_test_project()
+        jobs = [amcattest.create_test_job(project=p) for p in (p2, p1, p2, p1)]
+        qs = CodingJob.objects.filter(pk__in=[j.id for j in jobs])
+
+        paginator, results = self._paginate(qs, "/?page_size=3&cursor=")
+        self.assertEqual(["project_id", "-id"], paginator.ordering)
+        paginator, rest = self._paginate(qs, paginator.get_next_link())
+        expected = qs.order_by("project_id", "-id").values_list("id", flat=True)
+        self.assertEqual(list(expected), [j.id for j in results + rest])
+
+    def test_invalid_cursor(self):
+        qs = Article.objects.all()
+        self.assertRaises(NotFound, self._paginate, qs, "/?cursor=foo")
@@ -17,10 +17,12 @@
 # License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import tempfile
+
 from amcat.tools import amcattest
 from amcat.tools.toolkit import read_date
 
-from api.rest.tablerenderer import TableRenderer
+from api.rest.tablerenderer import TableRenderer, RdaRenderer
 
 class TestTableRenderer(amcattest.AmCATTestCase):
     def _test(self, d, header, data):
@@ -45,3 +47,26 @@ class TestTableRenderer(amcattest.AmCATTestCase):
         self._test([{"a": 1, "c": 3}, {"a": 4, "d": [{"a":"DA"}, {"b":"DB"}]}],
                    ["a", "c", "d.0.a", "d.1.b"],
                    [(1, 3, None, None), (4, None, "DA", "DB")])
+
+
+class TestRdaRenderer(amcattest.AmCATTestCase):
+    def test_render(self):
+        from rpy2 import robjects
+        rows = [{"id": 1, "title": "a", "date": read_date("2010-01-01")},
+                {"id": 2, "score": 1.5},
+                {"id": 3, "title": "c", "score": 2}]
+        columns = RdaRenderer().json_to_vectors(rows)
+        self.assertEqual(list(columns), ["id", "title", "date", "score"])
+        self.assertEqual(columns["title"], ["a", None, "c"])
+
+        data = {"results": rows, "next": None, "total": 3}
+        rda = RdaRenderer().render(data, renderer_context={})
+        with tempfile.NamedTemporaryFile(suffix=".rda") as f:
+            f.write(rda)
+            f.flush()
+            env = robjects.r["new.env"]()
+            robjects.r["load"](f.name, envir=env)
+        results = env["results"]
+        self.assertEqual(list(results.rx2("id")), [1, 2, 3])
+        self.assertEqual(list(results.rx2("score"))[1:], [1.5, 2.0])
+        self.assertEqual(list(env["total"]), [3])
@@ -21,6 +21,7 @@ from rest_framework.routers import DefaultRouter
 
 import api.rest.get_token
 from api.rest import resources
+from api.rest.resources.task import task_progress, task_profile
 from api.rest.views.meta import ArticleMetaView
 from api.rest.views.status import StatusView
 from api.rest.views.tokens import TokensView
@@ -37,6 +38,8 @@ urlpatterns = [
 
     url(r'^taskresult/(?P<task_id>[0-9]+)$', resources.single_task_result, dict(uuid=False)),
     url(r'^taskresult/(?P<task_id>[0-9a-zA-Z-]+)$', resources.single_task_result, dict(uuid=True)),
+    url(r'^taskprogress/(?P<task_id>[0-9a-zA-Z-]+)$', task_progress, name="task-progress"),
+    url(r'^taskprofile/(?P<task_id>[0-9a-zA-Z-]+)$', task_profile, name="task-profile"),
     url(r'^get_token', api.rest.get_token.obtain_auth_token),
     url(r'^status/$', StatusView.as_view(), name="status"),
     url(r'^projects/(?P<project_id>[0-9]+)/articlesets/(?P<articleset_id>[0-9]+)/meta/?$', ArticleMetaView.as_view(), name="meta"),
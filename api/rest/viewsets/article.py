@@ -53,6 +53,7 @@ from amcat.models.article import _check_read_access
 from amcat.tools.caching import cached
 from api.rest.filters import MappingOrderingFilter
 from api.rest.mixins import DatatablesMixin
+from api.rest.pagination import AmCATKeysetPagination
 from api.rest.serializer import AmCATProjectModelSerializer
 from api.rest.viewset import AmCATViewSetMixin
 from api.rest.viewsets.articleset import ArticleSetViewSetMixin
@@ -252,6 +253,19 @@ class ArticleViewSet(ProjectViewSetMixin, ArticleSetViewSetMixin, ArticleViewSet
         articleset_id = int(self.kwargs['articleset'])
         return ArticleSet.objects.get(pk=articleset_id)
 
+    @property
+    def paginator(self):
+        """
+        Use keyset pagination if a cursor is given (an empty cursor requests the first page),
+        so clients iterating over large sets do not pay for an ever growing OFFSET.
+        """
+        if not hasattr(self, '_paginator'):
+            if AmCATKeysetPagination.cursor_query_param in self.request.query_params:
+                self._paginator = AmCATKeysetPagination()
+            else:
+                self._paginator = super(ArticleViewSet, self).paginator
+        return self._paginator
+
     @property
     def text(self):
         text = self.request.GET.get('text', 'n').upper()
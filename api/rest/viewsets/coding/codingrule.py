@@ -37,6 +37,11 @@ class CodingRuleSerializer(AmCATModelSerializer):
     parsed_condition = serializers.SerializerMethodField()
 
     def get_parsed_condition(self, obj):
+        # Conditions can be given by the caller, e.g. from compiled rules
+        parsed_conditions = self.context.get("parsed_conditions", {})
+        if obj.id in parsed_conditions:
+            return parsed_conditions[obj.id]
+
         try:
             return codingruletoolkit.to_json(codingruletoolkit.parse(obj), serialise=False)
         except (ValidationError, SyntaxError):
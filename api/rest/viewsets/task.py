@@ -42,6 +42,8 @@ class TaskSerializer(AmCATModelSerializer):
 
     class Meta:
         model = Task
+        # Profiles can be large, and are downloaded using the taskprofile api
+        exclude = ("profile",)
 
     def __init__(self, *args, **kwargs):
         super(TaskSerializer, self).__init__(*args, **kwargs)
@@ -67,8 +69,12 @@ class TaskSerializer(AmCATModelSerializer):
 
     def get_progress(self, task):
         _, result, status = self.get_status_ready(task)
-        if status == IN_PROGRESS and isinstance(result, dict):
-            return result
+        if status == IN_PROGRESS:
+            progress = task.get_progress()
+            if progress is not None:
+                return progress
+            if isinstance(result, dict):
+                return result
 
     def get_description(self, task):
         return task.class_name.split(".")[-1]
@@ -246,3 +246,17 @@ class TestArticleViewSet(APITestCase):
         # unless he gets read access to project 2
         ProjectRole.objects.create(project=p2, user=p4.owner, role=reader)
         self._post_articles([a1.id, a2.id], projectid=p4.id, setid=s4.id, as_user=p4.owner, expected_status=201)
+
+    def test_keyset_pagination(self):
+        for i in range(3):
+            amcattest.create_test_article(articleset=self.aset, project=self.project)
+        ids = sorted(self.aset.get_article_ids(), reverse=True)
+        self.client.login(username=self.user.username, password="test")
+
+        url, pages = self.url_set() + "&page_size=2&order_by=-id&cursor=", []
+        while url:
+            res = json.loads(self.client.get(url).content.decode("utf-8"))
+            self.assertNotIn("pages", res)
+            pages.append([a["id"] for a in res["results"]])
+            url = res["next"]
+        self.assertEqual([ids[0:2], ids[2:3]], pages)
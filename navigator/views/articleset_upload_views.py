@@ -20,6 +20,7 @@ from amcat.scripts.article_upload.upload_plugins import get_upload_plugin, get_u
 from amcat.scripts.article_upload import upload
 from amcat.scripts.article_upload.upload import ArticleField, REQUIRED
 from amcat.tools.amcates import ARTICLE_FIELDS, is_valid_property_name
+from amcat.tools.profiling import wants_profile
 from navigator.views.project_views import ProjectDetailsView
 from navigator.views.projectview import BaseMixin
 from navigator.views.scriptview import ScriptHandler, get_temporary_file_dict
@@ -294,7 +295,8 @@ class ArticlesetUploadOptionsView(BaseMixin, FormView):
         args = self.get_script_form_kwargs(self.upload, field_map)
         args = self.clean_script_args(args)
         handler = ArticleSetUploadScriptHandler.call(target_class=self.script_class, arguments=args,
-                            project=self.project, user=self.request.user)
+                            project=self.project, user=self.request.user,
+                            profile=wants_profile(self.request))
         return redirect(reverse("navigator:task-details", args=(self.project.id, handler.task.id)))
 
 
@@ -16,12 +16,11 @@
 # You should have received a copy of the GNU Affero General Public        #
 # License along with AmCAT.  If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
-import itertools as it
 import re
 
 from django.shortcuts import render
 from amcat.models import ArticleSet, RecentProject, Project, Article
-from amcat.models.authorisation import ROLE_PROJECT_READER
+from amcat.models.authorisation import ROLE_PROJECT_READER, get_resolver
 from django.views.generic.base import RedirectView
 from django import http
 
@@ -40,12 +39,15 @@ def index(request):
         request.user.userprofile.save()
         print(request.user.userprofile.fluid)
     
-    featured_sets = [(aset, aset.project.get_role_id(user=request.user) >= ROLE_PROJECT_READER)
-                     for aset in ArticleSet.objects.filter(featured=True)]
+    featured_sets = list(ArticleSet.objects.filter(featured=True))
+    readable = get_resolver(request.user).filter_projects({aset.project_id for aset in featured_sets})
+    featured_sets = [(aset, aset.project_id in readable) for aset in featured_sets]
 
     if not request.user.is_anonymous():
-        recent_projects = list(it.islice(((rp, rp.project.get_role_id(user=request.user) >= ROLE_PROJECT_READER)
-                                          for rp in RecentProject.get_recent_projects(request.user.userprofile)), MAX_RECENT_PROJECTS))
+        recent_projects = RecentProject.get_recent_projects(request.user.userprofile).select_related("project")
+        recent_projects = list(recent_projects[:MAX_RECENT_PROJECTS])
+        readable = get_resolver(request.user).filter_projects(rp.project for rp in recent_projects)
+        recent_projects = [(rp, rp.project_id in readable) for rp in recent_projects]
         
     return render(request, 'index.html', locals())
 
@@ -20,7 +20,7 @@ import tempfile, os
 import base64
 from urllib.parse import urlencode
 
-from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadedfile import UploadedFile
 
 from django.utils.datastructures import MultiValueDict
 from django.core.urlresolvers import reverse
@@ -33,19 +33,72 @@ from django.db import models
 from django.http import QueryDict
 
 from amcat.tools.table import table3
-from amcat.tools.progress import ProgressMonitor
-from amcat.models.task import TaskHandler, IN_PROGRESS
+from amcat.tools.profiling import wants_profile
+from amcat.tools.progress import ProgressMonitor, ThrottledListener
+from amcat.models.task import TaskHandler, IN_PROGRESS, set_task_progress
 from amcat.amcatcelery import app
 
 class CeleryProgressUpdater(object):
-    def __init__(self, task_id):
+    """
+    Progress listener which stores task progress in redis (see set_task_progress). Updates are
+    throttled (see ThrottledListener), and the celery result backend is only updated once
+    to mark the task as in progress, or on every update if there is no redis cache.
+    """
+    def __init__(self, task_id, min_interval=1.0, min_delta=0.01):
         self.task_id = task_id
-    def update(self, monitor):
-        app.backend.store_result(
-            self.task_id,
-            {"completed": monitor.percent, "message": monitor.message},
-            IN_PROGRESS
-        )
+        self.started = False
+        self.update = ThrottledListener(self._update, min_interval=min_interval, min_delta=min_delta)
+
+    def _update(self, monitor):
+        stored = set_task_progress(self.task_id, monitor.percent, monitor.message)
+        if not (stored and self.started):
+            self.started = True
+            app.backend.store_result(
+                self.task_id,
+                {"completed": monitor.percent, "message": monitor.message},
+                IN_PROGRESS
+            )
+
+
+class PathUploadedFile(UploadedFile):
+    """
+    Uploaded file backed by a file on disk (see get_temporary_file_dict), which is only opened
+    when it is read. Like django's TemporaryUploadedFile, temporary_file_path() returns the
+    path, so scripts can use the file directly instead of reading it into memory.
+    """
+    def __init__(self, path, filename, content_type=None, charset=None):
+        self.path = path
+        self._file = None
+        super().__init__(None, filename, content_type, os.path.getsize(path), charset)
+
+    @classmethod
+    def from_dict(cls, file_dict):
+        return cls(file_dict["path"], file_dict["filename"], file_dict.get("content_type"))
+
+    @property
+    def file(self):
+        if self._file is None:
+            self._file = open(self.path, "rb")
+        return self._file
+
+    @file.setter
+    def file(self, file):
+        self._file = file
+
+    @property
+    def closed(self):
+        return self._file is None or self._file.closed
+
+    def open(self, mode="rb"):
+        if not self.closed:
+            self.seek(0)
+        else:
+            self._file = open(self.path, mode)
+        return self
+
+    def temporary_file_path(self):
+        return self.path
+
 
 class ScriptHandler(TaskHandler):
     def get_form_kwargs(self):
@@ -69,16 +122,14 @@ class ScriptHandler(TaskHandler):
             kwargs['data'] = d
 
         # Convert file dictionaries (as supplied by get_temporary_file_dict) to
-        # SimpleUploadedFile objects which Django understands.
+        # (lazily opened) UploadedFile objects which Django understands.
         if 'files' in kwargs:
             files = MultiValueDict()
             files.update(kwargs['files'])
             for key, filedict_list in files.lists():
                 for i, fdict in enumerate(filedict_list):
                     if isinstance(fdict, dict):
-                        fdict = dict(fdict)
-                        fdict["content"] = open(fdict["path"], "rb").read()
-                        filedict_list[i] = SimpleUploadedFile.from_dict(fdict)
+                        filedict_list[i] = PathUploadedFile.from_dict(fdict)
                 files.setlist(key, filedict_list)
             kwargs['files'] = files
         return kwargs
@@ -170,7 +221,7 @@ class ScriptMixin(FormMixin):
             kwargs['files'] = dict(kwargs['files'])
 
         task = handler.call(target_class=self.get_script(), arguments=kwargs,
-                            project=project, user=self.request.user)
+                            project=project, user=self.request.user, profile=wants_profile(self.request))
         url = reverse("navigator:task-details", args=[project.id, task.task.id])
         next = urlencode(dict(next=self.request.get_full_path()))
         return redirect("{url}?{next}".format(**locals()), permanent=False)
@@ -73,6 +73,16 @@ CACHES = {
     }
 }
 
+# R query actions (see amcat.scripts.query.queryaction_r)
+R_POOL_SIZE = amcat_config["r"].getint("workers")
+R_POOL_QUEUE_SIZE = amcat_config["r"].getint("queue_size")
+R_POOL_TIMEOUT = amcat_config["r"].getint("timeout")
+
+# Performance telemetry (see amcat.tools.telemetry)
+TELEMETRY_FILE = amcat_config["telemetry"].get("file")
+TELEMETRY_BATCH_SIZE = amcat_config["telemetry"].getint("batch_size")
+TELEMETRY_FLUSH_INTERVAL = amcat_config["telemetry"].getint("flush_interval")
+
 CACHE_BUST_TOKEN = datetime.datetime.now().isoformat()
 if not DEBUG:
     CACHE_BUST_TOKEN = amcat_config["cache"].get("bust_token")
@@ -127,6 +137,7 @@ STATICFILES_DIRS = (
 
 # List of callables that know how to import templates from various sources.
 MIDDLEWARE_CLASSES = [
+    'amcat.tools.telemetry.TelemetryMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'navigator.utils.misc.MethodOverrideMiddleware',
     'django.middleware.common.CommonMiddleware',
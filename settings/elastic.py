@@ -39,6 +39,7 @@ ES_PROD_INDEX = "amcat"
 
 ES_INDEX = os.environ.get('AMCAT_ES_INDEX', ES_TEST_INDEX if TESTING else ES_PROD_INDEX)
 ES_ARTICLE_DOCTYPE = 'article'
+ES_SENTENCE_DOCTYPE = 'sentence'
 
 
 ES_MAPPING_TYPE_PRIMITIVES = {
@@ -80,6 +81,20 @@ ES_MAPPING = {
     },
 }
 
+# Sentences are indexed as children of their article. Only the sentence text is part of _all,
+# so unqualified keywords match sentences just like they match articles.
+# The sentence doctype can only be created together with the index (see upgrade_elastic --reindex-into).
+ES_SENTENCE_MAPPING = {
+    "_parent": {"type": ES_ARTICLE_DOCTYPE},
+    "properties": {
+        "id": dict(ES_MAPPING_TYPES['int'], include_in_all=False),
+        "article_id": dict(ES_MAPPING_TYPES['int'], include_in_all=False),
+        "parnr": dict(ES_MAPPING_TYPES['int'], include_in_all=False),
+        "sentnr": dict(ES_MAPPING_TYPES['int'], include_in_all=False),
+        "sentence": ES_MAPPING_TYPES['text'],
+    },
+}
+
 ES_SETTINGS = {
     "index": {
       "similarity": {